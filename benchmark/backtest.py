@@ -0,0 +1,191 @@
+"""
+Backtesterとnotebook/backtest.ipynbのループ実装の結果・実行時間を比較するベンチマーク
+
+notebookの銘柄ごとのrolling/applyによるステージ・シグナル計算とBackTestクラスを
+そのまま移植したものを基準とし、銘柄ごとの損益が一致するかを確認する。
+--storeを指定しない場合はランダムウォークの株価で比較する。
+
+$ python benchmark/backtest.py --codes 300
+$ python benchmark/backtest.py --store data/store/prices
+"""
+
+from os import path
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'src'))
+
+from analysis import Backtester, SignalEngine  # noqa: E402
+from repository.store import PriceStoreAPI  # noqa: E402
+
+
+class BackTest:
+    """
+    notebook/backtest.ipynbのBackTestクラス(出力のみ省略)
+    """
+
+    def __init__(self, songiri_flag=False):
+        self.balance = 0
+        self.num_stock = 0
+        self.price = 0
+        self.songiri_flag = songiri_flag
+
+    def start(self, prices: list, purchase_signs: list, selling_signs: list, num_stocks: list):
+        for price, purchase, selling, num_stock in zip(prices, purchase_signs, selling_signs, num_stocks):
+            if int(purchase) == 1:
+                self.price = int((self.price * self.num_stock + price *
+                                  num_stock) / (self.num_stock + num_stock))
+                self.num_stock += num_stock
+
+            if int(selling) == 1 and self.__is_higher_purchase_price(price) and self.num_stock > 0:
+                self.balance += self.num_stock * (price - self.price)
+                self.num_stock = 0
+                self.price = 0
+
+        return self.balance + self.num_stock * (price - self.price)
+
+    def __is_higher_purchase_price(self, price):
+        if not self.songiri_flag:
+            return self.price >= price
+
+        return True
+
+
+def reference(df: pd.DataFrame, transition: tuple, songiri: bool):
+    """
+    notebookと同じ銘柄ごとのループでバックテストを行う
+
+    ステージはnotebook/adhoc.ipynb、シグナルはnotebook/backtest.ipynbのmake_signと同じ計算。
+    買いの遷移のみRunnerと同じtransitionを使う。
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        日付をindexにしたcode, closed_adjのDataFrame
+    transition : tuple
+        買いシグナルとするステージの遷移
+    songiri : bool
+        損切りするかどうか
+
+    Returns
+    -------
+    dict
+        銘柄コードと損益の辞書
+    """
+    def get_moving_statas(x):
+        if tuple(x) == transition:
+            return 5
+        elif x[1] == 1 and x[2] == 2:
+            return 2
+        else:
+            return 0
+
+    balances = {}
+    for code in df.code.unique():
+        sma = df.loc[df.code == code, ['closed_adj']].copy()
+        short = sma.closed_adj.rolling(5).mean().round(1)
+        middle = sma.closed_adj.rolling(25).mean().round(1)
+        long = sma.closed_adj.rolling(75).mean().round(1)
+        stage_one = (short >= long) & (short >= middle) & (middle >= long)
+        stage_two = (short >= long) & (short < middle) & (middle >= long)
+        stage_three = (short < long) & (short < middle) & (middle >= long)
+        stage_four = (short < long) & (short < middle) & (middle < long)
+        stage_five = (short < long) & (short >= middle) & (middle < long)
+        stage_six = (short >= long) & (short >= middle) & (middle < long)
+        sma['closed_adj_stage'] = stage_one + stage_two * 2 + stage_three * 3 + \
+            stage_four * 4 + stage_five * 5 + stage_six * 6
+        sma['price'] = sma.closed_adj
+        sma = sma[long.notna()]
+        if sma.empty:
+            continue
+
+        moving_status = sma.closed_adj_stage.rolling(3).apply(
+            get_moving_statas, raw=True)
+        purchase_sign = moving_status == 5
+        selling_sign = moving_status == 2
+        num_stock = [int(100000 / price) if purchase and price <= 1000 else 100
+                     for price, purchase in zip(sma.price, purchase_sign)]
+
+        backtest = BackTest(songiri_flag=songiri)
+        balances[code] = backtest.start(
+            sma.price.tolist(), purchase_sign.tolist(), selling_sign.tolist(), num_stock)
+    return balances
+
+
+def make_random(codes: int, days: int, seed: int):
+    """
+    ランダムウォークの株価を作成する
+
+    Parameters
+    ----------
+    codes : int
+        銘柄数
+    days : int
+        最大の日数
+    seed : int
+        乱数のシード
+
+    Returns
+    -------
+    list
+        (銘柄コード, 終値調整の配列)のリスト
+    """
+    rng = np.random.default_rng(seed)
+    series = []
+    for code in range(codes):
+        size = int(rng.integers(50, days))
+        start = rng.choice([300, 800, 3000])
+        close = np.round(start * np.exp(np.cumsum(rng.normal(0, 0.02, size))), 1)
+        series.append((1000 + code, close))
+    return series
+
+
+def main():
+    """
+    コマンドライン引数を読み込んで比較を実行する
+    """
+    parser = argparse.ArgumentParser(
+        description='Compare the vectorized backtest with the notebook loop.')
+    parser.add_argument('--store', default=None)
+    parser.add_argument('--codes', type=int, default=300)
+    parser.add_argument('--days', type=int, default=750)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-songiri', action='store_true')
+    args = parser.parse_args()
+
+    if args.store is not None:
+        store = PriceStoreAPI(args.store)
+        series = [(code, store.read(code, columns=['closed_adj'])['closed_adj'])
+                  for code in store.get_codes()]
+    else:
+        series = make_random(args.codes, args.days, args.seed)
+    codes = [code for code, _ in series]
+    songiri = not args.no_songiri
+
+    started = time.perf_counter()
+    backtester = Backtester(songiri=songiri)
+    result = backtester.run(SignalEngine.make_panel(
+        [close for _, close in series]))
+    vectorized = time.perf_counter() - started
+
+    df = pd.concat([pd.DataFrame({'code': code, 'closed_adj': close})
+                    for code, close in series])
+    started = time.perf_counter()
+    expected = reference(df, backtester.engine.transition, songiri)
+    loop = time.perf_counter() - started
+
+    mismatched = [code for code, profit in zip(codes, result['profit'])
+                  if not (np.isnan(profit) and code not in expected)
+                  and not np.isclose(profit, expected.get(code, np.nan))]
+    summary = Backtester.summarize(result['profit'])
+    print(f'codes: {len(codes)}, mismatched: {len(mismatched)} {mismatched[:10]}')
+    print(f'vectorized: {vectorized:.3f}s, notebook loop: {loop:.3f}s')
+    print(f'median: {summary["median"]:.1f}, skew: {summary["skew"]:.3f}, '
+          f'win rate: {summary["win_rate"]:.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""
+外部サービスをローカルの代替に置き換えてRunnerとリポジトリのクラスを計測するベンチマーク
+
+株価APIはHTTPのスタブ、google drive/spread sheetはメモリ上のサービス、memcacheはメモリ上のクライアント
+(benchmark/fakes.py)を使う。銘柄数ごとに新しいプロセスでRunnerを作成して銘柄リストを一巡させ、
+codes/sec、1銘柄あたりの処理時間のパーセンタイル、最大RSS、コールドスタートの時間を計測する。
+リポジトリのクラスは1呼び出しごとの時間のパーセンタイルを計測する。
+
+--baselineを指定すると保存した結果と比較し、許容範囲を超えて悪化した項目があれば終了コード1で終了する。
+
+$ python benchmark/crawler.py --codes 10,1000,4000 --save-baseline data/benchmark_baseline.json
+$ python benchmark/crawler.py --codes 10,1000,4000 --baseline data/benchmark_baseline.json
+"""
+
+from os import path
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = path.join(path.dirname(path.abspath(__file__)), '..', 'src')
+KEY_PATH = 'benchmark-key.json'
+PERCENTILES = (50, 90, 99)
+# 結果を比較する際にそろっている必要がある条件
+CONDITIONS = ('mode', 'samples', 'api_latency', 'google_latency')
+# 項目ごとの良い方向。1は大きいほど良く、-1は小さいほど良い
+DIRECTIONS = {
+    'codes_per_sec': 1,
+    'p50_ms': -1,
+    'p90_ms': -1,
+    'p99_ms': -1,
+    'peak_rss_mb': -1,
+    'cold_start_ms': -1,
+    'p50_us': -1,
+    'p99_us': -1,
+}
+
+
+def write_stocklist(directory: str, size: int):
+    """
+    業種フィルタを通る銘柄だけの銘柄リストを作成する
+
+    Parameters
+    ----------
+    directory : str
+        保存先のディレクトリ
+    size : int
+        銘柄数
+
+    Returns
+    -------
+    str
+        銘柄リストのパス
+    """
+    filepath = path.join(directory, f'stocklist_{size}.csv')
+    # 実際の銘柄コードと同じ4桁の範囲に散らばらせる
+    step = max(1, 8000 // size)
+    with open(filepath, 'w', encoding='utf-8-sig') as f:
+        f.write('銘柄コード,銘柄名,市場名,業種分類,単元株数,日経225採用銘柄\n')
+        for i in range(size):
+            f.write(f'{1300 + i * step},銘柄{i},東証1部,情報・通信,100,\n')
+    return filepath
+
+
+def percentiles(values: list, scale=1.0, suffix='ms'):
+    """
+    パーセンタイルの計算
+
+    Parameters
+    ----------
+    values : list
+        計測値
+    scale : float, optional
+        出力の単位に合わせる倍率, by default 1.0
+    suffix : str, optional
+        項目名の接尾辞, by default 'ms'
+
+    Returns
+    -------
+    dict
+        p50, p90, p99の辞書
+    """
+    import numpy as np
+
+    if len(values) == 0:
+        return {f'p{q}_{suffix}': None for q in PERCENTILES}
+    result = np.percentile(np.asarray(values) * scale, PERCENTILES)
+    return {f'p{q}_{suffix}': round(float(value), 3) for q, value in zip(PERCENTILES, result)}
+
+
+def peak_rss_mb():
+    """
+    このプロセスの最大RSSの取得
+
+    Returns
+    -------
+    float
+        最大RSS(MB)
+    """
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def probe_runner(args):
+    """
+    新しいプロセスでRunnerを作成し、銘柄リストを一巡させる
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        spawned(プロセスを起動した時刻), stocklist, url, mode, google_latencyを持つ引数
+
+    Returns
+    -------
+    dict
+        計測結果
+    """
+    import fakes
+
+    fakes.install_memcache()
+    from runner import Runner
+    drive, sheets = fakes.install_google(KEY_PATH, args.google_latency)
+    runner = Runner('localhost:11211', 'user', 'password', args.stocklist, 'folder',
+                    KEY_PATH, args.url, 'sheet')
+    cold_start = time.time() - args.spawned
+
+    from metrics import METRICS
+
+    size = runner.stock_list_api.get_size()
+    started = time.perf_counter()
+    if args.mode == 'pipeline':
+        runner.start_pipeline(time_budget=float('inf'))
+    else:
+        runner.start_batch(time_budget=float('inf'))
+    elapsed = time.perf_counter() - started
+
+    times = [started] + fakes.FakeMemcacheClient.code_times
+    latencies = [after - before for before, after in zip(times, times[1:])]
+    timers = METRICS.snapshot()['timers']
+
+    result = {
+        'codes': size,
+        'processed': len(latencies),
+        'files': len(drive.contents),
+        'rows': len(sheets.rows),
+        'elapsed': round(elapsed, 3),
+        'codes_per_sec': round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+    result.update(percentiles(latencies, 1000))
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['cold_start_ms'] = round(cold_start * 1000, 1)
+    result['stages_ms'] = {name: round(timer['mean'] * 1000, 3)
+                           for name, timer in timers.items() if name.startswith('runner.')}
+    return result
+
+
+def probe_repositories(args):
+    """
+    リポジトリのクラスの1呼び出しごとの時間を計測する
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        stocklist, url, samples, google_latencyを持つ引数
+
+    Returns
+    -------
+    dict
+        計測名をキー、p50_us, p99_usを値とした辞書
+    """
+    import fakes
+
+    fakes.install_memcache()
+    from repository.stock import StockAPI, parse_stock_csv, concat_columns
+    from repository.stock_list import StockListAPI
+    from repository.store import PriceStoreAPI
+    from repository.memcache import MemcachedAPI
+    from repository.drive import GoogleDriveAPI
+    from repository.sheet import SheetAPI
+    from repository.outbound import OutboundClient, TokenBucket
+    fakes.install_google(KEY_PATH, args.google_latency)
+
+    stock_list_api = StockListAPI(args.stocklist, filter_mode=True)
+    codes = stock_list_api.get_codes()
+    codes = [codes[i % len(codes)] for i in range(args.samples)]
+    stock_api = StockAPI(args.url)
+    memcache_api = MemcachedAPI('localhost:11211', 'user', 'password')
+    drive_api = GoogleDriveAPI('folder', KEY_PATH)
+    sheet_api = SheetAPI(KEY_PATH, 'sheet')
+    # spread sheetの書き込みのレート制限(1回/秒)は呼び出し自体の時間ではないため外す
+    sheet_api.outbound = OutboundClient('sheets', bucket=TokenBucket(1000000))
+
+    responses = {code: stock_api.fetch_stock(code, '2019', raw=True)
+                 for code in set(codes)}
+    columns = concat_columns([parse_stock_csv(responses[codes[0]])])
+    csv = responses[codes[0]].decode('utf8', errors='replace')
+
+    with tempfile.TemporaryDirectory() as directory:
+        store_api = PriceStoreAPI(directory)
+        cases = {
+            'stock.fetch_stock': lambda code: stock_api.fetch_stock(code, '2019', raw=True),
+            'stock.parse_stock_csv': lambda code: parse_stock_csv(responses[code]),
+            'stock_list.get_next_code': lambda code: stock_list_api.get_next_code(code),
+            'store.write': lambda code: store_api.write(code, columns),
+            'store.read': lambda code: store_api.read(code),
+            'memcache.set_indicator_state': lambda code: memcache_api.set_indicator_state(code, b'0' * 512),
+            'memcache.get_indicator_state': lambda code: memcache_api.get_indicator_state(code),
+            'drive.upload_file': lambda code: drive_api.upload_file(f'{code}.csv', csv),
+            'sheet.append': lambda code: sheet_api.append([[code, 1, 2, 3]]),
+        }
+        result = {}
+        for name, case in cases.items():
+            # 最初の呼び出しはimportなどを含むため計測しない
+            case(codes[0])
+            elapsed = []
+            for code in codes:
+                started = time.perf_counter()
+                case(code)
+                elapsed.append(time.perf_counter() - started)
+            result[name] = {key: value for key, value in percentiles(
+                elapsed, 1000000, 'us').items() if key in ('p50_us', 'p99_us')}
+    stock_api.close()
+    return result
+
+
+def spawn(probe: str, args, stocklist: str):
+    """
+    新しいプロセスで計測を1回実行する
+
+    Parameters
+    ----------
+    probe : str
+        計測の種類(runner, repositories)
+    args : argparse.Namespace
+        コマンドライン引数
+    stocklist : str
+        銘柄リストのパス
+
+    Returns
+    -------
+    dict
+        計測結果
+    """
+    command = [sys.executable, path.abspath(__file__), '--probe', probe,
+               '--stocklist', stocklist, '--url', args.url, '--mode', args.mode,
+               '--samples', str(args.samples),
+               '--google-latency', str(args.google_latency),
+               '--spawned', str(time.time())]
+    result = subprocess.run(command, cwd=SRC_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f'Benchmark process failed:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    保存した結果と比較し、許容範囲を超えて悪化した項目を列挙する
+
+    Parameters
+    ----------
+    results : dict
+        今回の結果
+    baseline : dict
+        保存した結果
+    tolerance : float
+        悪化を許容する割合
+
+    Returns
+    -------
+    list
+        (区分, 項目, 保存した値, 今回の値, 変化率, 悪化したかどうか)のリスト
+    """
+    rows = []
+    for section in ('universes', 'repositories'):
+        for name, metrics in results.get(section, {}).items():
+            base = baseline.get(section, {}).get(name)
+            if base is None:
+                continue
+            for key, direction in DIRECTIONS.items():
+                current, previous = metrics.get(key), base.get(key)
+                if current is None or not previous:
+                    continue
+                change = (current - previous) / previous
+                rows.append((f'{section}:{name}', key, previous, current, change,
+                             change * direction < -tolerance))
+    return rows
+
+
+def main():
+    """
+    コマンドライン引数を読み込んでベンチマークを実行する
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmark Runner and the repository classes against local fakes.')
+    parser.add_argument('--codes', default='10,1000,4000',
+                        help='comma separated universe sizes')
+    parser.add_argument('--mode', choices=['batch', 'pipeline'], default='batch')
+    parser.add_argument('--samples', type=int, default=200,
+                        help='calls per repository method')
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='seconds added to each stock API response')
+    parser.add_argument('--google-latency', type=float, default=0.0,
+                        help='seconds added to each Drive/Sheets request')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--save-baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--probe', choices=['runner', 'repositories'], default=None,
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--stocklist', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--url', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--spawned', type=float, default=None,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe is not None:
+        # 計測用のプロセス。Runnerのログは標準エラーに出るため、結果は標準出力の最後の行に出す
+        sys.path.insert(0, SRC_DIR)
+        probe = probe_runner if args.probe == 'runner' else probe_repositories
+        print(json.dumps(probe(args)))
+        return
+
+    import fakes
+
+    server = fakes.StockServer(args.api_latency)
+    args.url = server.start()
+    results = {'mode': args.mode, 'samples': args.samples, 'api_latency': args.api_latency,
+               'google_latency': args.google_latency, 'universes': {}}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for size in [int(size) for size in args.codes.split(',')]:
+                stocklist = write_stocklist(directory, size)
+                results['universes'][str(size)] = spawn('runner', args, stocklist)
+            results['repositories'] = spawn(
+                'repositories', args, write_stocklist(directory, 100))
+    finally:
+        server.stop()
+
+    print(f'{"codes":>6}{"codes/sec":>11}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}'
+          f'{"rss MB":>9}{"cold ms":>9}')
+    for size, result in results['universes'].items():
+        print(f'{size:>6}{result["codes_per_sec"]:>11.1f}{result["p50_ms"]:>9.2f}'
+              f'{result["p90_ms"]:>9.2f}{result["p99_ms"]:>9.2f}'
+              f'{result["peak_rss_mb"]:>9.1f}{result["cold_start_ms"]:>9.1f}')
+    print(f'\n{"repository call":<32}{"p50 us":>10}{"p99 us":>10}')
+    for name, result in results['repositories'].items():
+        print(f'{name:<32}{result["p50_us"]:>10.1f}{result["p99_us"]:>10.1f}')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for condition in CONDITIONS:
+            if baseline.get(condition) != results[condition]:
+                print(f'\nWarning: {condition} differs from the baseline '
+                      f'({baseline.get(condition)} -> {results[condition]}).')
+        rows = compare(results, baseline, args.tolerance)
+        regressions = [row for row in rows if row[5]]
+        print(f'\n{"target":<48}{"metric":<16}{"baseline":>12}{"current":>12}{"change":>9}')
+        for target, key, previous, current, change, regressed in rows:
+            mark = '  REGRESSION' if regressed else ''
+            print(f'{target:<48}{key:<16}{previous:>12.3f}{current:>12.3f}{change:>+9.1%}{mark}')
+        if regressions:
+            print(f'\n{len(regressions)} metrics regressed more than {args.tolerance:.0%}.')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
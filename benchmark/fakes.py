@@ -0,0 +1,611 @@
+"""
+ベンチマーク用の外部サービスの代替
+
+株価API(HTTPのスタブ)、google drive/spread sheet(メモリ上のサービス)、memcache(メモリ上のクライアント)を
+リポジトリのクラスから見て本物と同じ呼び出し方で使えるように置き換える。
+リポジトリのクラス自体は置き換えないため、Runnerとリポジトリの処理はそのまま計測される。
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import parse_qs
+import itertools
+import sys
+import time
+import types
+import numpy as np
+
+ENCODING = 'shift_jis'
+COLUMN_HEADER = '日付,始値,高値,安値,終値,出来高,終値調整'
+
+
+class StockServer:
+    """
+    株価APIと同じ形式(ヘッダー2行 + 日付,始値,高値,安値,終値,出来高,終値調整)の
+    合成した株価を返すHTTPのスタブ
+
+    株価は銘柄コードをSEEDS通りの系列に振り分けたランダムウォークで、同じ銘柄・年には常に同じ内容を返す。
+    ヘッダーは本物のAPIと同じくShift_JISで返す。
+
+    Attributes
+    -------
+    SEEDS : int
+        作成する株価の系列の数
+    latency : float
+        1リクエストごとに待たせる時間(秒)
+    url : str
+        スタブのURL。start前はNone
+    """
+    SEEDS = 64
+
+    def __init__(self, latency=0.0):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        latency : float, optional
+            1リクエストごとに待たせる時間(秒), by default 0.0
+        """
+        self.latency = latency
+        self.url = None
+        self.__server = None
+        self.__rows = {}
+        self.__lock = Lock()
+
+    def start(self):
+        """
+        別スレッドでスタブを起動する
+
+        Returns
+        -------
+        str
+            スタブのURL
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # ヘッダーと本文を別々に送るため、Nagleを切らないと遅延ACKの待ちが入る
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers['Content-Length'])
+                query = parse_qs(self.rfile.read(length).decode())
+                body = server.body(query['code'][0], query['year'][0])
+                if server.latency > 0:
+                    time.sleep(server.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.__server.daemon_threads = True
+        Thread(target=self.__server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.__server.server_address[1]}/'
+        return self.url
+
+    def stop(self):
+        """
+        スタブを停止する
+        """
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    def body(self, code: str, year: str):
+        """
+        1銘柄・1年分のレスポンスの作成
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        year : str
+            年(西暦)
+
+        Returns
+        -------
+        bytes
+            レスポンスのバイト列
+        """
+        header = f'{code} 東証1部 ベンチマーク用銘柄\n{COLUMN_HEADER}\n'.encode(
+            ENCODING)
+        return header + self.__get_rows(int(code) % self.SEEDS, int(year))
+
+    def __get_rows(self, seed: int, year: int):
+        """
+        系列・年ごとの株価の行を作成する。作成済みのものは使い回す
+
+        Parameters
+        ----------
+        seed : int
+            系列の番号
+        year : int
+            年(西暦)
+
+        Returns
+        -------
+        bytes
+            株価の行のバイト列
+        """
+        with self.__lock:
+            if (seed, year) not in self.__rows:
+                rng = np.random.default_rng(seed * 10000 + year)
+                days = np.arange(np.datetime64(f'{year}-01-01'),
+                                 np.datetime64(f'{year + 1}-01-01'))
+                days = days[np.is_busday(days)]
+                close = np.round(
+                    1000 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days)))))
+                volume = rng.integers(1000, 1000000, len(days))
+                lines = [f'{day},{price:.0f},{price + 5:.0f},{price - 5:.0f},{price:.0f},{size},{price:.0f}'
+                         for day, price, size in zip(days, close, volume)]
+                self.__rows[(seed, year)] = '\n'.join(lines).encode('utf8')
+            return self.__rows[(seed, year)]
+
+
+class FakeMemcacheClient:
+    """
+    bmemcached.Clientと同じメソッドを持つメモリ上のキャッシュ
+
+    スレッドごとに作られるクライアントの間で同じ内容を共有する。
+    銘柄コードのキーがセットされた時刻を記録し、1銘柄あたりの処理時間の計算に使う。
+    有効期限(秒)を指定したキーは、clockの時刻で期限を過ぎると消える。
+
+    Attributes
+    -------
+    CODE_KEY : str
+        時刻を記録する銘柄コードのキー
+    store : dict
+        キーをキー、(値, CAS値)を値とした辞書
+    deadlines : dict
+        有効期限のあるキーをキー、期限の時刻を値とした辞書
+    code_times : list
+        銘柄コードのキーがセットされた時刻(time.perf_counter)のリスト
+    clock : callable
+        有効期限の判定に使う時刻(秒)を返す関数。テストでは進められる時計に差し替える
+    """
+    CODE_KEY = 'code'
+    store = {}
+    deadlines = {}
+    code_times = []
+    clock = staticmethod(time.monotonic)
+    __lock = Lock()
+    __cas = itertools.count(1)
+
+    def __init__(self, servers=None, username=None, password=None):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        servers : list, optional
+            memcacheのホスト(使わない)
+        username : str, optional
+            memcacheのユーザ名(使わない)
+        password : str, optional
+            memcacheのパスワード(使わない)
+        """
+        pass
+
+    @classmethod
+    def clear(cls):
+        """
+        キャッシュの内容と記録した時刻を消去する
+        """
+        with cls.__lock:
+            cls.store.clear()
+            cls.deadlines.clear()
+            cls.code_times.clear()
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_multi(self, keys):
+        with self.__lock:
+            entries = {key: self.__get_entry(key) for key in keys}
+        return {key: entry[0] for key, entry in entries.items() if entry is not None}
+
+    def set(self, key, value, time=0):
+        with self.__lock:
+            self.__put(key, value, time)
+            if key == self.CODE_KEY:
+                # 引数のtimeがモジュールを隠すため、_nowで時刻を取る
+                self.code_times.append(_now())
+        return True
+
+    def set_multi(self, mapping, time=0):
+        for key, value in mapping.items():
+            self.set(key, value, time)
+        return True
+
+    def add(self, key, value, time=0):
+        with self.__lock:
+            if self.__get_entry(key) is not None:
+                return False
+            self.__put(key, value, time)
+            return True
+
+    def incr(self, key, value):
+        with self.__lock:
+            number = int(self.__get_entry(key)[0]) + value
+            # incrは有効期限を変えない
+            self.store[key] = (number, next(self.__cas))
+            return number
+
+    def gets(self, key):
+        with self.__lock:
+            entry = self.__get_entry(key)
+        return entry if entry is not None else (None, None)
+
+    def cas(self, key, value, cas, time=0):
+        with self.__lock:
+            entry = self.__get_entry(key)
+            if entry is None or entry[1] != cas:
+                return False
+            self.__put(key, value, time)
+            return True
+
+    def delete(self, key, cas=0):
+        with self.__lock:
+            entry = self.__get_entry(key)
+            if cas and entry is not None and entry[1] != cas:
+                return False
+            self.store.pop(key, None)
+            self.deadlines.pop(key, None)
+        return True
+
+    def __get_entry(self, key):
+        """
+        有効期限を過ぎていない値の取得。ロックを取得してから呼ぶ
+
+        Parameters
+        ----------
+        key : str
+            キー
+
+        Returns
+        -------
+        tuple
+            (値, CAS値)。ない場合や期限を過ぎた場合はNone
+        """
+        deadline = self.deadlines.get(key)
+        if deadline is not None and type(self).clock() >= deadline:
+            self.store.pop(key, None)
+            del self.deadlines[key]
+        return self.store.get(key)
+
+    def __put(self, key, value, expire):
+        """
+        値と有効期限をセットする。ロックを取得してから呼ぶ
+
+        Parameters
+        ----------
+        key : str
+            キー
+        value : object
+            値
+        expire : int
+            有効期限(秒)。0の場合は期限なし
+        """
+        self.store[key] = (value, next(self.__cas))
+        if expire:
+            self.deadlines[key] = type(self).clock() + expire
+        else:
+            self.deadlines.pop(key, None)
+
+
+class FakeRequest:
+    """
+    googleapiclientのHttpRequestと同じくexecuteで実行するリクエスト
+
+    Attributes
+    -------
+    func : callable
+        実行する処理
+    latency : float
+        実行ごとに待たせる時間(秒)
+    """
+
+    def __init__(self, func, latency=0.0):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        func : callable
+            実行する処理
+        latency : float, optional
+            実行ごとに待たせる時間(秒), by default 0.0
+        """
+        self.func = func
+        self.latency = latency
+
+    def execute(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self.func()
+
+
+class FakeBatch:
+    """
+    googleapiclientのBatchHttpRequestと同じくリクエストをまとめて実行し、結果をcallbackで返す
+
+    Attributes
+    -------
+    callback : callable
+        (リクエストID, レスポンス, 例外)を受け取る関数
+    latency : float
+        1回のバッチごとに待たせる時間(秒)
+    """
+
+    def __init__(self, callback, latency=0.0):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        callback : callable
+            (リクエストID, レスポンス, 例外)を受け取る関数
+        latency : float, optional
+            1回のバッチごとに待たせる時間(秒), by default 0.0
+        """
+        self.callback = callback
+        self.latency = latency
+        self.__requests = []
+
+    def add(self, request, request_id=None):
+        self.__requests.append((request_id, request))
+
+    def execute(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        for request_id, request in self.__requests:
+            try:
+                response = request.func()
+            except Exception as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeDriveService:
+    """
+    google drive v3のfilesのcreate/update/list/delete/batchをメモリ上で行うサービス
+
+    Attributes
+    -------
+    latency : float
+        1リクエストごとに待たせる時間(秒)
+    contents : dict
+        ファイルのキー値をキー、(ファイル名, 内容のバイト列)を値とした辞書
+    uploaded_bytes : int
+        アップロードされたバイト数の合計
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        latency : float, optional
+            1リクエストごとに待たせる時間(秒), by default 0.0
+        """
+        self.latency = latency
+        self.contents = {}
+        self.uploaded_bytes = 0
+        self.__ids = itertools.count(1)
+        self.__lock = Lock()
+
+    def files(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(callback, self.latency)
+
+    def create(self, body=None, media_body=None, fields=None):
+        def create():
+            data = self.__read(media_body)
+            with self.__lock:
+                fileid = f'file{next(self.__ids)}'
+                self.contents[fileid] = (body['name'], data)
+            return {'id': fileid}
+        return FakeRequest(create, self.latency)
+
+    def update(self, fileId=None, body=None, media_body=None, fields=None):
+        def update():
+            with self.__lock:
+                if fileId not in self.contents:
+                    raise _not_found()
+                name, data = self.contents[fileId]
+                if body is not None and 'name' in body:
+                    name = body['name']
+            if media_body is not None:
+                data = self.__read(media_body)
+            with self.__lock:
+                # 更新日時の順に並ぶよう、末尾に移す
+                self.contents.pop(fileId, None)
+                self.contents[fileId] = (name, data)
+            return {'id': fileId}
+        return FakeRequest(update, self.latency)
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, orderBy=None):
+        def list_files():
+            name = None
+            if q.startswith("name = '"):
+                name = q[len("name = '"):q.index("'", len("name = '"))]
+            with self.__lock:
+                items = [{'id': fileid, 'name': filename}
+                         for fileid, (filename, _) in self.contents.items()
+                         if name is None or filename == name]
+            # 作成・更新した順に辞書に並んでいるため、新しい順の指定は逆順にする
+            if orderBy == 'modifiedTime desc':
+                items.reverse()
+            start = int(pageToken or 0)
+            result = {'files': items[start:start + pageSize]}
+            if start + pageSize < len(items):
+                result['nextPageToken'] = str(start + pageSize)
+            return result
+        return FakeRequest(list_files, self.latency)
+
+    def delete(self, fileId=None):
+        def delete():
+            with self.__lock:
+                if self.contents.pop(fileId, None) is None:
+                    raise _not_found()
+            return ''
+        return FakeRequest(delete, self.latency)
+
+    def __read(self, media_body):
+        """
+        アップロードされた内容を読み込む
+
+        Parameters
+        ----------
+        media_body : MediaUpload
+            アップロードする内容
+
+        Returns
+        -------
+        bytes
+            内容のバイト列
+        """
+        data = media_body.getbytes(0, media_body.size())
+        with self.__lock:
+            self.uploaded_bytes += len(data)
+        return data
+
+
+class FakeSheetsService:
+    """
+    google spread sheet v4のvalues().appendをメモリ上で行うサービス
+
+    Attributes
+    -------
+    latency : float
+        1リクエストごとに待たせる時間(秒)
+    rows : list
+        追加された行
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        latency : float, optional
+            1リクエストごとに待たせる時間(秒), by default 0.0
+        """
+        self.latency = latency
+        self.rows = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def append(self, spreadsheetId=None, range=None, valueInputOption=None, body=None,
+               insertDataOption=None):
+        def append():
+            self.rows.extend(body['values'])
+            return {'updates': {'updatedRows': len(body['values'])}}
+        return FakeRequest(append, self.latency)
+
+
+class FakeGoogleFactory:
+    """
+    GoogleClientFactoryの代わりにメモリ上のサービスを返すクラス
+
+    Attributes
+    -------
+    services : dict
+        (API名, バージョン)をキー、サービスを値とした辞書
+    """
+
+    def __init__(self, drive: FakeDriveService, sheets: FakeSheetsService):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        drive : FakeDriveService
+            google driveのサービス
+        sheets : FakeSheetsService
+            google spread sheetのサービス
+        """
+        self.services = {('drive', 'v3'): drive, ('sheets', 'v4'): sheets}
+
+    def get_service(self, name: str, version: str):
+        return self.services[(name, version)]
+
+
+def install_memcache():
+    """
+    bmemcachedの代わりにFakeMemcacheClientを使うようにする。MemcachedAPIのimport前後どちらでもよい
+    """
+    module = types.ModuleType('bmemcached')
+    module.Client = FakeMemcacheClient
+    sys.modules['bmemcached'] = module
+    FakeMemcacheClient.clear()
+
+
+def install_google(key_path: str, latency=0.0):
+    """
+    サービスアカウントのキーファイルに対するGoogleClientFactoryをメモリ上のサービスに置き換える
+
+    Parameters
+    ----------
+    key_path : str
+        GoogleDriveAPI/SheetAPIに渡すキーファイルのパス
+    latency : float, optional
+        1リクエストごとに待たせる時間(秒), by default 0.0
+
+    Returns
+    -------
+    tuple
+        (FakeDriveService, FakeSheetsService)
+    """
+    from repository.google import service
+
+    drive = FakeDriveService(latency)
+    sheets = FakeSheetsService(latency)
+    service._factories[key_path] = FakeGoogleFactory(drive, sheets)
+    return drive, sheets
+
+
+def _not_found():
+    """
+    google apiの404と同じ例外の作成
+
+    Returns
+    -------
+    HttpError
+        ステータス404の例外
+    """
+    from googleapiclient.errors import HttpError
+    from httplib2 import Response
+
+    return HttpError(Response({'status': 404}), b'File not found')
+
+
+def _now():
+    """
+    時刻の取得
+
+    Returns
+    -------
+    float
+        time.perf_counter()
+    """
+    return time.perf_counter()
@@ -0,0 +1,88 @@
+"""
+google functionのコールドスタートにかかる時間を計測するベンチマーク
+
+新しいプロセスでmain/runnerのimportとRunnerの作成にかかる時間を計測し、
+複数回の中央値を出力する。外部サービスへの接続は行わない。
+
+$ python benchmark/startup.py --repeat 10
+"""
+
+from os import path
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = path.join(path.dirname(path.abspath(__file__)), '..', 'src')
+
+# 計測用のプロセスで実行するコード。各段階の経過時間(秒)をjsonで出力する
+PROBE = """
+import json, sys, time
+timings = {}
+started = time.perf_counter()
+import main
+timings['import_main'] = time.perf_counter() - started
+
+started = time.perf_counter()
+from runner import Runner
+timings['import_runner'] = time.perf_counter() - started
+
+started = time.perf_counter()
+runner = Runner('localhost:11211', 'user', 'password', sys.argv[1], 'drive',
+                'key.json', 'http://localhost/', 'sheet')
+timings['init_runner'] = time.perf_counter() - started
+
+started = time.perf_counter()
+from repository.stock import parse_stock_csv
+parse_stock_csv(b'header\\nheader\\n2020-01-06,1,2,3,4,5,6\\n')
+timings['first_parse'] = time.perf_counter() - started
+
+timings['modules'] = len(sys.modules)
+print(json.dumps(timings))
+"""
+
+
+def measure(stocklist: str):
+    """
+    新しいプロセスで起動時間を1回計測する
+
+    Parameters
+    ----------
+    stocklist : str
+        銘柄リストのパス
+
+    Returns
+    -------
+    dict
+        段階ごとの経過時間(秒)と読み込んだモジュール数
+    """
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, stocklist],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """
+    コマンドライン引数を読み込んでベンチマークを実行する
+    """
+    parser = argparse.ArgumentParser(
+        description='Measure import and init cost of the function entry point.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--stocklist', default='resources/stocklist.csv')
+    args = parser.parse_args()
+
+    runs = [measure(args.stocklist) for _ in range(args.repeat)]
+    print(f'{"stage":<16}{"median ms":>12}{"max ms":>12}')
+    for stage in ['import_main', 'import_runner', 'init_runner', 'first_parse']:
+        values = [run[stage] * 1000 for run in runs]
+        print(f'{stage:<16}{statistics.median(values):>12.1f}{max(values):>12.1f}')
+    total = [sum(run[stage] for stage in run if stage != 'modules') * 1000
+             for run in runs]
+    print(f'{"total":<16}{statistics.median(total):>12.1f}{max(total):>12.1f}')
+    print(f'modules loaded: {runs[-1]["modules"]}')
+
+
+if __name__ == '__main__':
+    main()
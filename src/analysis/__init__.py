@@ -0,0 +1,8 @@
+from .signal_engine import SignalEngine
+from .indicator_state import IndicatorState
+from .backtest import Backtester
+from .sweep import ParameterSweep
+from .indicators import IndicatorSet, RollingKernel, INDICATORS, register
+
+__all__ = ['SignalEngine', 'IndicatorState', 'Backtester', 'ParameterSweep',
+           'IndicatorSet', 'RollingKernel', 'INDICATORS', 'register']
@@ -0,0 +1,300 @@
+import numpy as np
+from .signal_engine import SignalEngine
+
+
+class Backtester:
+    """
+    ステージ遷移による売買のバックテストを全銘柄まとめて行うクラス
+
+    notebook/backtest.ipynbのBackTestと同じ売買・損益計算を行う。
+    買いはRunnerの買いシグナルと同じステージ遷移(SignalEngine.transition)の日、
+    売りはステージ1から2に変化した日とする。
+    売買の状態は銘柄ごとに逐次的に変わるため、売買のある日だけを(売買の順番 × 銘柄)の配列に
+    詰め、順番ごとに全銘柄まとめて更新する。
+
+    Attributes
+    -------
+    SELL_TRANSITION : tuple
+        売りシグナルとするステージの遷移
+    BUDGET : int
+        単価が安い銘柄を購入する際の1回あたりの金額の目安
+    MAX_UNIT_PRICE : float
+        BUDGETに近くなるまで単元を増やす株価の上限
+    UNIT : int
+        購入時の株数
+    engine : SignalEngine
+        移動平均・ステージを計算するクラス
+    sell_transition : tuple
+        売りシグナルとするステージの遷移
+    songiri : bool
+        平均取得単価を下回っていても売りシグナルで売るかどうか
+    """
+    SELL_TRANSITION = (1, 2)
+    BUDGET = 100000
+    MAX_UNIT_PRICE = 1000
+    UNIT = 100
+
+    def __init__(self, engine=None, sell_transition=SELL_TRANSITION, songiri=True):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        engine : SignalEngine, optional
+            移動平均・ステージを計算するクラス, by default None (既定の期間・遷移)
+        sell_transition : tuple, optional
+            売りシグナルとするステージの遷移, by default SELL_TRANSITION
+        songiri : bool, optional
+            平均取得単価を下回っていても売りシグナルで売るかどうか, by default True
+        """
+        self.engine = engine if engine is not None else SignalEngine()
+        self.sell_transition = tuple(sell_transition)
+        self.songiri = songiri
+
+    def signals(self, close: np.ndarray, averages=None):
+        """
+        全銘柄の売買シグナルと購入株数を計算する
+
+        Parameters
+        ----------
+        close : np.ndarray
+            (日付 × 銘柄)の終値調整の配列。欠損はNaN
+        averages : dict, optional
+            計算済みのshort, middle, longの移動平均, by default None (engineで計算する)
+
+        Returns
+        -------
+        dict
+            stage, valid, purchase_sign, selling_sign, num_stockの(日付 × 銘柄)の配列
+        """
+        close = np.asarray(close, dtype=np.float64)
+        if close.ndim == 1:
+            close = close[:, np.newaxis]
+
+        if averages is None:
+            averages = self.engine.compute(close)
+        short, middle, long = averages['short'], averages['middle'], averages['long']
+        valid = ~(np.isnan(short) | np.isnan(middle) | np.isnan(long))
+        stage = self.six_stage(short, middle, long)
+
+        purchase_sign = SignalEngine.match_transition(
+            stage, valid, self.engine.transition)
+        # notebookのrolling(3)と同じく、遷移の前にもう1日分の有効な日を必要とする
+        selling_sign = SignalEngine.match_transition(
+            stage, valid, self.sell_transition)
+        selling_sign &= SignalEngine.shift(
+            valid, len(self.sell_transition), fill=False)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            num_stock = np.where(
+                purchase_sign & (close <= self.MAX_UNIT_PRICE),
+                np.trunc(self.BUDGET / close), self.UNIT)
+        return {
+            'stage': stage,
+            'valid': valid,
+            'purchase_sign': purchase_sign,
+            'selling_sign': selling_sign,
+            'num_stock': np.where(purchase_sign, num_stock, 0).astype(np.int64),
+        }
+
+    def run(self, close: np.ndarray, averages=None):
+        """
+        全銘柄のバックテストを行う
+
+        Parameters
+        ----------
+        close : np.ndarray
+            (日付 × 銘柄)の終値調整の配列。欠損はNaN
+        averages : dict, optional
+            計算済みのshort, middle, longの移動平均, by default None (engineで計算する)
+
+        Returns
+        -------
+        dict
+            銘柄ごとの配列の辞書。
+            profitは最終日の含み損益を含めた損益、balanceは確定した損益、
+            num_stock・priceは最終日の保有株数と平均取得単価、purchases・salesは売買の回数。
+            移動平均が計算できる日がない銘柄のprofitはNaN
+        """
+        close = np.asarray(close, dtype=np.float64)
+        if close.ndim == 1:
+            close = close[:, np.newaxis]
+        signals = self.signals(close, averages)
+        columns = close.shape[1]
+
+        # 売買のある日を銘柄ごとに古い順に並べ、(売買の順番 × 銘柄)に詰める
+        events = signals['purchase_sign'] | signals['selling_sign']
+        code_index, day_index = np.nonzero(events.T)
+        counts = np.bincount(code_index, minlength=columns)
+        rank = np.arange(len(code_index)) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        shape = (counts.max(initial=0), columns)
+
+        purchase = np.zeros(shape, dtype=bool)
+        selling = np.zeros(shape, dtype=bool)
+        prices = np.zeros(shape)
+        num_stocks = np.zeros(shape, dtype=np.int64)
+        purchase[rank, code_index] = signals['purchase_sign'][day_index, code_index]
+        selling[rank, code_index] = signals['selling_sign'][day_index, code_index]
+        prices[rank, code_index] = close[day_index, code_index]
+        num_stocks[rank, code_index] = signals['num_stock'][day_index, code_index]
+
+        balance = np.zeros(columns)
+        num_stock = np.zeros(columns, dtype=np.int64)
+        price = np.zeros(columns)
+        purchases = np.zeros(columns, dtype=np.int64)
+        sales = np.zeros(columns, dtype=np.int64)
+        for i in range(shape[0]):
+            # 購入: 平均取得単価を整数に切り捨てて更新する
+            bought = purchase[i]
+            total = num_stock + num_stocks[i]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                averaged = np.trunc(
+                    (price * num_stock + prices[i] * num_stocks[i]) / total)
+            price = np.where(bought, averaged, price)
+            num_stock = np.where(bought, total, num_stock)
+            purchases += bought
+
+            # 売却: 損切りしない場合は平均取得単価が売値以上のときだけ売る
+            sold = selling[i] & (num_stock > 0)
+            if not self.songiri:
+                sold &= price >= prices[i]
+            balance += np.where(sold, num_stock * (prices[i] - price), 0.0)
+            num_stock = np.where(sold, 0, num_stock)
+            price = np.where(sold, 0.0, price)
+            sales += sold
+
+        valid = signals['valid']
+        has_valid = valid.any(axis=0)
+        # 最終日の株価は移動平均が計算できた最後の日の終値調整
+        last_day = close.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+        last_price = close[last_day, np.arange(columns)]
+        profit = np.where(has_valid, balance +
+                          num_stock * (last_price - price), np.nan)
+        return {
+            'profit': profit,
+            'balance': balance,
+            'num_stock': num_stock,
+            'price': price,
+            'purchases': purchases,
+            'sales': sales,
+        }
+
+    def run_store(self, store_api, codes=None, start=None, end=None):
+        """
+        列指向のストアに保存した株価でバックテストを行う
+
+        Parameters
+        ----------
+        store_api : PriceStoreAPI
+            株価を保存したストア
+        codes : list, optional
+            対象の銘柄コード, by default None (保存済みの全銘柄)
+        start : str, optional
+            開始日(YYYY-MM-DD, 境界を含む), by default None
+        end : str, optional
+            終了日(YYYY-MM-DD, 境界を含む), by default None
+
+        Returns
+        -------
+        pd.DataFrame
+            銘柄ごとのバックテスト結果
+        """
+        import pandas as pd
+
+        codes, close = self.load_panel(store_api, codes, start, end)
+        df = pd.DataFrame(self.run(close))
+        df.insert(0, 'code', codes)
+        return df
+
+    @staticmethod
+    def load_panel(store_api, codes=None, start=None, end=None):
+        """
+        列指向のストアから終値調整を読み込み、(日付 × 銘柄)の配列にする
+
+        Parameters
+        ----------
+        store_api : PriceStoreAPI
+            株価を保存したストア
+        codes : list, optional
+            対象の銘柄コード, by default None (保存済みの全銘柄)
+        start : str, optional
+            開始日(YYYY-MM-DD, 境界を含む), by default None
+        end : str, optional
+            終了日(YYYY-MM-DD, 境界を含む), by default None
+
+        Returns
+        -------
+        tuple
+            (銘柄コードのリスト, 最新日でそろえた終値調整の配列)
+        """
+        codes = list(codes) if codes is not None else store_api.get_codes()
+        series = [store_api.read(code, start, end, ['closed_adj'])['closed_adj']
+                  for code in codes]
+        return codes, SignalEngine.make_panel(series)
+
+    @staticmethod
+    def six_stage(short: np.ndarray, middle: np.ndarray, long: np.ndarray):
+        """
+        短期・中期・長期の移動平均の並びから6つのステージに分類する
+
+        Parameters
+        ----------
+        short : np.ndarray
+            短期移動平均
+        middle : np.ndarray
+            中期移動平均
+        long : np.ndarray
+            長期移動平均
+
+        Returns
+        -------
+        np.ndarray
+            1〜6のステージ。移動平均が欠損している日は0
+        """
+        with np.errstate(invalid='ignore'):
+            short_long = short >= long
+            short_middle = short >= middle
+            middle_long = middle >= long
+        stage = np.select(
+            [short_long & short_middle & middle_long,
+             short_long & ~short_middle & middle_long,
+             ~short_long & ~short_middle & middle_long,
+             ~short_long & ~short_middle & ~middle_long,
+             ~short_long & short_middle & ~middle_long,
+             short_long & short_middle & ~middle_long],
+            [1, 2, 3, 4, 5, 6], 0).astype(np.int8)
+        stage[np.isnan(short) | np.isnan(middle) | np.isnan(long)] = 0
+        return stage
+
+    @staticmethod
+    def summarize(profit: np.ndarray):
+        """
+        損益の分布の要約統計量を計算する
+
+        Parameters
+        ----------
+        profit : np.ndarray
+            銘柄ごとの損益。NaNは除く
+
+        Returns
+        -------
+        dict
+            count, mean, median, skew(scipy.stats.skewと同じ偏りのある歪度), win_rate
+        """
+        profit = np.asarray(profit, dtype=np.float64)
+        profit = profit[~np.isnan(profit)]
+        if len(profit) == 0:
+            return {'count': 0, 'mean': np.nan, 'median': np.nan,
+                    'skew': np.nan, 'win_rate': np.nan}
+
+        deviation = profit - profit.mean()
+        m2 = np.mean(deviation ** 2)
+        m3 = np.mean(deviation ** 3)
+        return {
+            'count': len(profit),
+            'mean': profit.mean(),
+            'median': np.median(profit),
+            'skew': m3 / m2 ** 1.5 if m2 > 0 else np.nan,
+            'win_rate': np.mean(profit > 0),
+        }
@@ -0,0 +1,321 @@
+from collections import deque
+import struct
+import numpy as np
+
+
+class IndicatorState:
+    """
+    銘柄ごとの移動平均とステージを逐次更新で保持するクラス
+
+    直近の長期移動平均の日数分の終値調整をリングバッファに持ち、
+    各期間の移動平均の合計を足し引きすることで1日分の更新をO(1)で行う。
+
+    Attributes
+    -------
+    VERSION : int
+        シリアライズ形式のバージョン
+    HEADER : struct.Struct
+        シリアライズ時のヘッダー形式
+    windows : tuple
+        短期・中期・長期の移動平均の日数
+    transition : tuple
+        買いシグナルとするステージの遷移
+    count : int
+        これまでに取り込んだ日数
+    last_date : int
+        最後に取り込んだ日付(1970-01-01からの経過日数)
+    """
+    VERSION = 1
+    HEADER = struct.Struct('<BHHHBIHidB')
+    FOUR_STAGE = 4
+    FIVE_STAGE = 5
+
+    def __init__(self, short_term=5, middle_term=25, long_term=75, transition=(4, 4, 5)):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        short_term : int, optional
+            短期移動平均の日数, by default 5
+        middle_term : int, optional
+            中期移動平均の日数, by default 25
+        long_term : int, optional
+            長期移動平均の日数, by default 75
+        transition : tuple, optional
+            買いシグナルとするステージの遷移, by default (4, 4, 5)
+        """
+        self.windows = (short_term, middle_term, long_term)
+        self.transition = tuple(transition)
+        self.count = 0
+        self.last_date = -1
+        self.__size = max(self.windows)
+        self.__buffer = np.zeros(self.__size)
+        self.__position = 0
+        self.__sums = [0.0] * len(self.windows)
+        self.__previous_close = np.nan
+        self.__previous_valid = False
+        self.__stages = deque(maxlen=len(self.transition))
+
+    @classmethod
+    def from_closes(cls, dates, closes, short_term=5, middle_term=25, long_term=75, transition=(4, 4, 5)):
+        """
+        日付順の株価から状態を作成する
+
+        Parameters
+        ----------
+        dates : array_like
+            1970-01-01からの経過日数
+        closes : array_like
+            終値調整
+        short_term : int, optional
+            短期移動平均の日数, by default 5
+        middle_term : int, optional
+            中期移動平均の日数, by default 25
+        long_term : int, optional
+            長期移動平均の日数, by default 75
+        transition : tuple, optional
+            買いシグナルとするステージの遷移, by default (4, 4, 5)
+
+        Returns
+        -------
+        IndicatorState
+            全日付を取り込んだ状態
+        """
+        state = cls(short_term, middle_term, long_term, transition)
+        # 長期移動平均とステージ遷移の判定に必要な日数だけ取り込めば同じ状態になる
+        start = max(len(closes) - state.__size - len(state.transition), 0)
+        for date, close in zip(dates[start:], closes[start:]):
+            state.update(int(date), float(close))
+        state.count = len(closes)
+        return state
+
+    def update(self, date: int, close: float):
+        """
+        1日分の株価を取り込む
+
+        Parameters
+        ----------
+        date : int
+            1970-01-01からの経過日数
+        close : float
+            終値調整
+        """
+        self.__previous_close = self.__get_close(0) if self.count > 0 else np.nan
+        self.__previous_valid = self.is_valid()
+
+        for i, window in enumerate(self.windows):
+            self.__sums[i] += close
+            if self.count >= window:
+                self.__sums[i] -= self.__get_close(window - 1)
+
+        self.__buffer[self.__position] = close
+        self.__position = (self.__position + 1) % self.__size
+        self.count += 1
+        self.last_date = date
+
+        # 足し引きによる誤差がたまらないよう、バッファが一周するごとに合計を計算し直す
+        if self.__position == 0:
+            self.__resync()
+
+        stage = self.__get_stage() if self.is_valid() else 0
+        self.__stages.append((stage, self.is_valid()))
+
+    def latest(self):
+        """
+        最後に取り込んだ日の指標の取得
+
+        Returns
+        -------
+        dict
+            short, middle, long, stage, valid, purchase_sign, dod, diff, closed_adj
+        """
+        short, middle, long = self.__get_averages()
+        close = self.__get_close(0) if self.count > 0 else np.nan
+        if self.__previous_valid:
+            dod = float(np.round(close / self.__previous_close - 1, 3))
+            diff = close - self.__previous_close
+        else:
+            dod = diff = np.nan
+
+        stage, valid = self.__stages[-1] if self.__stages else (0, False)
+        return {
+            'short': short,
+            'middle': middle,
+            'long': long,
+            'stage': stage,
+            'valid': valid,
+            'purchase_sign': self.__is_purchase(),
+            'dod': dod,
+            'diff': diff,
+            'closed_adj': close,
+        }
+
+    def is_valid(self):
+        """
+        全期間の移動平均が計算できるかどうか
+
+        Returns
+        -------
+        bool
+            長期移動平均の日数以上取り込んでいる場合True
+        """
+        return self.count >= self.__size
+
+    def get_last_close(self):
+        """
+        最後に取り込んだ終値調整の取得
+
+        Returns
+        -------
+        float
+            終値調整。取り込んでいない場合はNaN
+        """
+        return self.__get_close(0) if self.count > 0 else np.nan
+
+    def is_compatible(self, short_term: int, middle_term: int, long_term: int, transition: tuple):
+        """
+        移動平均の日数とステージ遷移が同じかどうか
+
+        Returns
+        -------
+        bool
+            同じ設定の場合True
+        """
+        return self.windows == (short_term, middle_term, long_term) and self.transition == tuple(transition)
+
+    def to_bytes(self):
+        """
+        状態をバイト列にする
+
+        Returns
+        -------
+        bytes
+            シリアライズした状態
+        """
+        header = self.HEADER.pack(
+            self.VERSION, *self.windows, len(self.transition), self.count,
+            self.__position, self.last_date, self.__previous_close, self.__previous_valid)
+        stages = bytes(stage for stage, _ in self.__stages)
+        valids = bytes(valid for _, valid in self.__stages)
+        return b''.join([
+            header,
+            bytes(self.transition),
+            bytes([len(self.__stages)]),
+            stages,
+            valids,
+            self.__buffer.tobytes(),
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """
+        バイト列から状態を復元する
+
+        Parameters
+        ----------
+        data : bytes
+            to_bytesでシリアライズした状態
+
+        Returns
+        -------
+        IndicatorState
+            復元した状態
+
+        Raises
+        ------
+        Exception
+            バージョンが異なる場合
+        """
+        version, short_term, middle_term, long_term, length, count, position, last_date, \
+            previous_close, previous_valid = cls.HEADER.unpack_from(data)
+        if version != cls.VERSION:
+            raise Exception('Unsupported indicator state version.')
+
+        offset = cls.HEADER.size
+        transition = tuple(data[offset:offset + length])
+        offset += length
+        num_stages = data[offset]
+        offset += 1
+        stages = data[offset:offset + num_stages]
+        offset += num_stages
+        valids = data[offset:offset + num_stages]
+        offset += num_stages
+
+        state = cls(short_term, middle_term, long_term, transition)
+        state.count = count
+        state.last_date = last_date
+        state.__position = position
+        state.__previous_close = previous_close
+        state.__previous_valid = bool(previous_valid)
+        state.__stages.extend(zip(stages, map(bool, valids)))
+        state.__buffer = np.frombuffer(
+            data, dtype=np.float64, count=state.__size, offset=offset).copy()
+        state.__resync()
+        return state
+
+    def __get_close(self, lag: int):
+        """
+        lag日前の終値調整の取得
+
+        Parameters
+        ----------
+        lag : int
+            何日前か(0が最新)
+
+        Returns
+        -------
+        float
+            終値調整
+        """
+        return float(self.__buffer[(self.__position - 1 - lag) % self.__size])
+
+    def __get_averages(self):
+        """
+        各期間の移動平均の取得
+
+        Returns
+        -------
+        list
+            小数第1位で丸めた移動平均。日数が足りない期間はNaN
+        """
+        return [float(np.round(np.round(total, 8) / window, 1)) if self.count >= window else np.nan
+                for total, window in zip(self.__sums, self.windows)]
+
+    def __get_stage(self):
+        """
+        最新日のステージの取得
+
+        Returns
+        -------
+        int
+            ステージ(4, 5, それ以外は0)
+        """
+        short, middle, long = self.__get_averages()
+        if short < long and short < middle and middle < long:
+            return self.FOUR_STAGE
+        if short < long and short >= middle and middle < long:
+            return self.FIVE_STAGE
+        return 0
+
+    def __is_purchase(self):
+        """
+        直近のステージが遷移パターンと一致するかどうか
+
+        Returns
+        -------
+        bool
+            一致する場合True
+        """
+        if len(self.__stages) < len(self.transition):
+            return False
+        return all(valid and stage == expected
+                   for (stage, valid), expected in zip(self.__stages, self.transition))
+
+    def __resync(self):
+        """
+        リングバッファから各期間の合計を計算し直す
+        """
+        for i, window in enumerate(self.windows):
+            n = min(window, self.count)
+            self.__sums[i] = float(sum(self.__get_close(lag) for lag in range(n)))
@@ -0,0 +1,587 @@
+import numpy as np
+from .signal_engine import SignalEngine
+from .backtest import Backtester
+
+"""
+株価の配列から計算する指標
+
+指標はINDICATORSに名前で登録し、IndicatorSetで複数の指標をまとめて計算する。
+入力のカラムごとに1つのRollingKernelを作り、累積和と期間ごとの合計を指標間で共有する。
+"""
+
+INDICATORS = {}
+
+
+def register(cls):
+    """
+    指標のクラスをNAMEで登録するデコレータ
+
+    Parameters
+    ----------
+    cls : type
+        Indicatorのサブクラス
+
+    Returns
+    -------
+    type
+        登録したクラス
+    """
+    INDICATORS[cls.NAME] = cls
+    return cls
+
+
+class RollingKernel:
+    """
+    1つのカラムの移動窓の集計をまとめて行うクラス
+
+    値と2乗値の累積和を1度だけ計算し、期間ごとの合計・2乗和は計算済みのものを使い回す。
+    分散の桁落ちを抑えるため、2乗和は銘柄ごとの最初の値を引いてから計算する。
+
+    Attributes
+    -------
+    values : np.ndarray
+        (日付 × 銘柄)の値。欠損はNaN
+    """
+
+    def __init__(self, values: np.ndarray):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        values : np.ndarray
+            (日付 × 銘柄)の値。欠損はNaN
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, np.newaxis]
+        self.values = values
+        self.__csum, self.__ccount = SignalEngine.prefix_sums(values)
+        self.__csquare = None
+        self.__sums = {}
+        self.__squares = {}
+
+    def sum(self, window: int):
+        """
+        移動窓の合計の取得。窓内に欠損がある日はNaN
+
+        Parameters
+        ----------
+        window : int
+            日数
+
+        Returns
+        -------
+        np.ndarray
+            (日付 × 銘柄)の合計
+        """
+        if window not in self.__sums:
+            self.__sums[window] = self.__window_sum(self.__csum, window)
+        return self.__sums[window]
+
+    def mean(self, window: int):
+        """
+        移動平均の取得。SignalEngine.moving_averageの丸める前の値と同じ
+
+        Parameters
+        ----------
+        window : int
+            日数
+
+        Returns
+        -------
+        np.ndarray
+            (日付 × 銘柄)の移動平均
+        """
+        return self.sum(window) / window
+
+    def std(self, window: int, ddof=1):
+        """
+        移動標準偏差の取得
+
+        Parameters
+        ----------
+        window : int
+            日数
+        ddof : int, optional
+            自由度の補正, by default 1 (pandasのrolling().std()と同じ)
+
+        Returns
+        -------
+        np.ndarray
+            (日付 × 銘柄)の移動標準偏差
+        """
+        if window not in self.__squares:
+            if self.__csquare is None:
+                self.__csquare = self.__centered_prefix_sums()
+            self.__squares[window] = self.__window_sum(
+                self.__csquare[0], window), self.__window_sum(self.__csquare[1], window)
+        sums, squares = self.__squares[window]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (squares - sums * sums / window) / (window - ddof)
+        return np.sqrt(np.maximum(variance, 0.0))
+
+    def ema(self, span: int):
+        """
+        指数移動平均の取得。pandasのewm(span=span, adjust=False).mean()と同じ
+
+        銘柄ごとに最初の値から始め、以降の欠損の日は前日の値を引き継ぐ。
+
+        Parameters
+        ----------
+        span : int
+            日数
+
+        Returns
+        -------
+        np.ndarray
+            (日付 × 銘柄)の指数移動平均
+        """
+        alpha = 2.0 / (span + 1)
+        average = np.full(self.values.shape, np.nan)
+        current = np.full(self.values.shape[1], np.nan)
+        for day, values in enumerate(self.values):
+            observed = ~np.isnan(values)
+            current = np.where(
+                observed, np.where(np.isnan(current), values,
+                                   alpha * values + (1 - alpha) * current),
+                current)
+            average[day] = current
+        return average
+
+    def __window_sum(self, csum: np.ndarray, window: int):
+        """
+        累積和から移動窓の合計を計算する
+
+        Parameters
+        ----------
+        csum : np.ndarray
+            先頭に0行を足した累積和
+        window : int
+            日数
+
+        Returns
+        -------
+        np.ndarray
+            (日付 × 銘柄)の合計。窓内に欠損がある日はNaN
+        """
+        rows = self.values.shape[0]
+        sums = np.full(self.values.shape, np.nan)
+        if window > rows:
+            return sums
+        counts = self.__ccount[window:] - self.__ccount[:-window]
+        # 累積和の差による桁落ちを丸める
+        sums[window - 1:] = np.where(
+            counts == window, np.round(csum[window:] - csum[:-window], 8), np.nan)
+        return sums
+
+    def __centered_prefix_sums(self):
+        """
+        銘柄ごとの最初の値を引いた値と、その2乗の累積和を計算する
+
+        Returns
+        -------
+        tuple
+            (先頭に0行を足した累積和, 先頭に0行を足した2乗の累積和)
+        """
+        observed = ~np.isnan(self.values)
+        first = self.values[np.argmax(observed, axis=0),
+                            np.arange(self.values.shape[1])]
+        centered = np.where(observed, self.values - first, 0.0)
+        csum = np.zeros((self.values.shape[0] + 1, self.values.shape[1]))
+        np.cumsum(centered, axis=0, out=csum[1:])
+        csquare = np.zeros(csum.shape)
+        np.cumsum(centered * centered, axis=0, out=csquare[1:])
+        return csum, csquare
+
+
+class Indicator:
+    """
+    指標の基底クラス
+
+    Attributes
+    -------
+    NAME : str
+        登録名
+    OUTPUTS : tuple
+        出力の種類。出力が1つの場合はNone
+    column : str
+        入力のカラム
+    """
+    NAME = None
+
+    def __init__(self, column='closed_adj'):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        column : str, optional
+            入力のカラム, by default 'closed_adj'
+        """
+        self.column = column
+
+    OUTPUTS = (None,)
+
+    def names(self):
+        """
+        出力名の取得
+
+        出力名は「登録名_引数_出力_カラム」の形式で、引数が違う同じ指標を区別する。
+
+        Returns
+        -------
+        list
+            OUTPUTSの順の出力名のリスト
+        """
+        return ['_'.join(str(part) for part in (self.NAME, *self.params(), output, self.column)
+                         if part is not None)
+                for output in self.OUTPUTS]
+
+    def params(self):
+        """
+        出力名に含める引数の取得
+
+        Returns
+        -------
+        tuple
+            カラム以外の引数
+        """
+        return ()
+
+    def compute(self, kernel: RollingKernel):
+        """
+        指標を計算する
+
+        Parameters
+        ----------
+        kernel : RollingKernel
+            入力のカラムの集計
+
+        Returns
+        -------
+        dict
+            出力名と(日付 × 銘柄)の配列の辞書
+        """
+        raise NotImplementedError
+
+
+@register
+class SMA(Indicator):
+    """
+    単純移動平均。notebookと同じく小数第1位で丸める
+    """
+    NAME = 'sma'
+
+    def __init__(self, window=25, column='closed_adj'):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        window : int, optional
+            日数, by default 25
+        column : str, optional
+            入力のカラム, by default 'closed_adj'
+        """
+        super().__init__(column)
+        self.window = int(window)
+
+    def compute(self, kernel: RollingKernel):
+        name, = self.names()
+        return {name: np.round(kernel.mean(self.window), 1)}
+
+    def params(self):
+        return (self.window,)
+
+
+@register
+class EMA(Indicator):
+    """
+    指数移動平均
+    """
+    NAME = 'ema'
+
+    def __init__(self, span=25, column='closed_adj'):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        span : int, optional
+            日数, by default 25
+        column : str, optional
+            入力のカラム, by default 'closed_adj'
+        """
+        super().__init__(column)
+        self.span = int(span)
+
+    def compute(self, kernel: RollingKernel):
+        name, = self.names()
+        return {name: kernel.ema(self.span)}
+
+    def params(self):
+        return (self.span,)
+
+
+@register
+class Bollinger(Indicator):
+    """
+    ボリンジャーバンド。notebook/adhoc.ipynbと同じく、値がバンドの外に出た日をアラートとする
+    """
+    NAME = 'bollinger'
+    OUTPUTS = ('upper', 'lower', 'upper_alert', 'lower_alert')
+
+    def __init__(self, window=20, width=2, column='closed_adj'):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        window : int, optional
+            日数, by default 20
+        width : float, optional
+            バンドの幅(標準偏差の倍数), by default 2
+        column : str, optional
+            入力のカラム, by default 'closed_adj'
+        """
+        super().__init__(column)
+        self.window = int(window)
+        self.width = float(width)
+
+    def compute(self, kernel: RollingKernel):
+        mean = kernel.mean(self.window)
+        band = kernel.std(self.window) * self.width
+        upper = mean + band
+        lower = mean - band
+        with np.errstate(invalid='ignore'):
+            upper_alert = upper <= kernel.values
+            lower_alert = lower >= kernel.values
+        return dict(zip(self.names(), (upper, lower, upper_alert, lower_alert)))
+
+    def params(self):
+        return (self.window, f'{self.width:g}')
+
+
+@register
+class Stage(Indicator):
+    """
+    短期・中期・長期の移動平均の並びによる6つのステージ
+    """
+    NAME = 'stage'
+
+    def __init__(self, short_term=5, middle_term=25, long_term=75, column='closed_adj'):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        short_term : int, optional
+            短期移動平均の日数, by default 5
+        middle_term : int, optional
+            中期移動平均の日数, by default 25
+        long_term : int, optional
+            長期移動平均の日数, by default 75
+        column : str, optional
+            入力のカラム, by default 'closed_adj'
+        """
+        super().__init__(column)
+        self.windows = (int(short_term), int(middle_term), int(long_term))
+
+    def compute(self, kernel: RollingKernel):
+        short, middle, long = [np.round(kernel.mean(window), 1)
+                               for window in self.windows]
+        name, = self.names()
+        return {name: Backtester.six_stage(short, middle, long)}
+
+    def params(self):
+        return self.windows
+
+
+@register
+class VolumeCycle(Stage):
+    """
+    出来高の移動平均の並びによるステージ(出来高循環分析)
+    """
+    NAME = 'volume_cycle'
+
+    def __init__(self, short_term=5, middle_term=25, long_term=75, column='volume'):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        short_term : int, optional
+            短期移動平均の日数, by default 5
+        middle_term : int, optional
+            中期移動平均の日数, by default 25
+        long_term : int, optional
+            長期移動平均の日数, by default 75
+        column : str, optional
+            入力のカラム, by default 'volume'
+        """
+        super().__init__(short_term, middle_term, long_term, column)
+
+
+class IndicatorSet:
+    """
+    複数の指標をまとめて計算するクラス
+
+    入力のカラムごとにRollingKernelを1つだけ作り、同じ期間の合計は指標間で共有する。
+
+    Attributes
+    -------
+    indicators : list
+        計算する指標のリスト
+    conditions : dict
+        買いシグナルの条件とする出力名と値の辞書。値がNoneの場合は真であることを条件とする
+    """
+
+    def __init__(self, indicators: list, conditions: dict = None):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        indicators : list
+            計算する指標のリスト
+        conditions : dict, optional
+            買いシグナルの条件とする出力名と値の辞書, by default None
+
+        Raises
+        ------
+        Exception
+            出力名が重複する場合や、条件に指標の出力にない名前がある場合
+        """
+        self.indicators = list(indicators)
+        names = set()
+        for indicator in self.indicators:
+            for name in indicator.names():
+                if name in names:
+                    raise Exception(f'Duplicate indicator output: {name}')
+                names.add(name)
+        self.conditions = dict(conditions or {})
+        for name in self.conditions:
+            if name not in names:
+                raise Exception(f'Unknown indicator output: {name}')
+
+    @classmethod
+    def parse(cls, text: str, conditions: str = None):
+        """
+        カンマ区切りの指定から指標を作成する
+
+        各指定は「登録名:引数:引数...」の形式で、引数はコンストラクタの順に渡す。
+        例: "sma:5,bollinger:20:2,ema:12,volume_cycle,stage"
+
+        条件は「出力名」または「出力名=値」のカンマ区切りで、最新日の値が真または指定の値の場合だけ
+        買いシグナルとする。例: "bollinger_20_2_lower_alert_closed_adj,volume_cycle_5_25_75_volume=1"
+
+        Parameters
+        ----------
+        text : str
+            指標の指定
+        conditions : str, optional
+            買いシグナルの条件の指定, by default None
+
+        Returns
+        -------
+        IndicatorSet
+            指標のセット
+
+        Raises
+        ------
+        Exception
+            登録されていない指標の場合や、出力名が重複する場合
+        """
+        indicators = []
+        for spec in text.split(','):
+            spec = spec.strip()
+            if not spec:
+                continue
+            name, *args = spec.split(':')
+            if name not in INDICATORS:
+                raise Exception(f'Unknown indicator: {name}')
+            indicators.append(INDICATORS[name](*args))
+
+        selected = {}
+        for condition in (conditions or '').split(','):
+            condition = condition.strip()
+            if not condition:
+                continue
+            name, _, value = condition.partition('=')
+            selected[name.strip()] = float(value) if value else None
+        return cls(indicators, selected)
+
+    def names(self):
+        """
+        全ての指標の出力名の取得
+
+        Returns
+        -------
+        list
+            compute, latestの辞書と同じ順の出力名のリスト
+        """
+        return [name for indicator in self.indicators for name in indicator.names()]
+
+    def compute(self, columns: dict):
+        """
+        全ての指標を計算する
+
+        Parameters
+        ----------
+        columns : dict
+            カラム名と日付順の(日付 × 銘柄)または1次元の配列の辞書
+
+        Returns
+        -------
+        dict
+            出力名と(日付 × 銘柄)の配列の辞書
+        """
+        kernels = {}
+        result = {}
+        for indicator in self.indicators:
+            if indicator.column not in kernels:
+                kernels[indicator.column] = RollingKernel(
+                    columns[indicator.column])
+            result.update(indicator.compute(kernels[indicator.column]))
+        return result
+
+    def latest(self, columns: dict):
+        """
+        全ての指標の最新日の値を計算する
+
+        Parameters
+        ----------
+        columns : dict
+            カラム名と日付順の1次元の配列の辞書
+
+        Returns
+        -------
+        dict
+            出力名と最新日の値の辞書
+        """
+        return {name: values[-1, 0].item()
+                for name, values in self.compute(columns).items()}
+
+    def select(self, latest: dict):
+        """
+        最新日の値が買いシグナルの条件を全て満たすかの判定
+
+        Parameters
+        ----------
+        latest : dict
+            latestで計算した出力名と最新日の値の辞書
+
+        Returns
+        -------
+        bool
+            条件を満たす場合(条件がない場合を含む)はTrue
+        """
+        for name, value in self.conditions.items():
+            current = latest[name]
+            if value is None:
+                if not current or current != current:
+                    return False
+            elif current != value:
+                return False
+        return True
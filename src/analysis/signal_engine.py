@@ -0,0 +1,249 @@
+import numpy as np
+
+
+class SignalEngine:
+    """
+    移動平均・ステージ・ステージ遷移による買いシグナルを全銘柄まとめて計算するクラス
+
+    株価は(日付 × 銘柄)の2次元配列で受け取る。銘柄ごとに日付数が異なる場合は
+    make_panelで末尾(最新日)をそろえ、先頭をNaNで埋めた配列にする。
+
+    Attributes
+    -------
+    FOUR_STAGE : int
+        短期 < 中期 < 長期のステージ
+    FIVE_STAGE : int
+        中期 <= 短期 < 長期のステージ
+    short_term : int
+        短期移動平均の日数
+    middle_term : int
+        中期移動平均の日数
+    long_term : int
+        長期移動平均の日数
+    transition : tuple
+        買いシグナルとするステージの遷移
+    """
+    FOUR_STAGE = 4
+    FIVE_STAGE = 5
+
+    def __init__(self, short_term=5, middle_term=25, long_term=75, transition=(4, 4, 5)):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        short_term : int, optional
+            短期移動平均の日数, by default 5
+        middle_term : int, optional
+            中期移動平均の日数, by default 25
+        long_term : int, optional
+            長期移動平均の日数, by default 75
+        transition : tuple, optional
+            買いシグナルとするステージの遷移, by default (4, 4, 5)
+        """
+        self.short_term = short_term
+        self.middle_term = middle_term
+        self.long_term = long_term
+        self.transition = tuple(transition)
+
+    def compute(self, close: np.ndarray):
+        """
+        全銘柄の移動平均・ステージ・買いシグナルを計算する
+
+        Parameters
+        ----------
+        close : np.ndarray
+            (日付 × 銘柄)の終値調整の配列。欠損はNaN
+
+        Returns
+        -------
+        dict
+            short, middle, long, stage, valid, purchase_sign, dod, diffの(日付 × 銘柄)の配列。
+            validは3つの移動平均がそろった日、purchase_signとstageはvalidでない日は0
+        """
+        close = np.asarray(close, dtype=np.float64)
+        if close.ndim == 1:
+            close = close[:, np.newaxis]
+
+        # 累積和を1回だけ計算し、各期間の移動平均で共有する
+        csum, ccount = self.prefix_sums(close)
+
+        short = self.moving_average(csum, ccount, self.short_term)
+        middle = self.moving_average(csum, ccount, self.middle_term)
+        long = self.moving_average(csum, ccount, self.long_term)
+
+        with np.errstate(invalid='ignore'):
+            four_stage = (short < long) & (short < middle) & (middle < long)
+            five_stage = (short < long) & (short >= middle) & (middle < long)
+        stage = (four_stage * self.FOUR_STAGE +
+                 five_stage * self.FIVE_STAGE).astype(np.int8)
+
+        valid = ~(np.isnan(short) | np.isnan(middle) | np.isnan(long))
+        stage[~valid] = 0
+
+        previous = self.shift(close, 1)
+        previous_valid = self.shift(valid, 1, fill=False)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dod = np.where(previous_valid, np.round(
+                close / previous - 1, 3), np.nan)
+            diff = np.where(previous_valid, close - previous, np.nan)
+
+        return {
+            'short': short,
+            'middle': middle,
+            'long': long,
+            'stage': stage,
+            'valid': valid,
+            'purchase_sign': self.match_transition(stage, valid, self.transition),
+            'dod': dod,
+            'diff': diff,
+        }
+
+    def latest(self, close: np.ndarray):
+        """
+        全銘柄の最新日の指標を計算する
+
+        Parameters
+        ----------
+        close : np.ndarray
+            (日付 × 銘柄)の終値調整の配列。最終行が各銘柄の最新日
+
+        Returns
+        -------
+        dict
+            各指標の銘柄ごとの配列と、最新日の終値調整(closed_adj)
+        """
+        close = np.asarray(close, dtype=np.float64)
+        if close.ndim == 1:
+            close = close[:, np.newaxis]
+
+        result = self.compute(close)
+        latest = {name: values[-1] for name, values in result.items()}
+        latest['closed_adj'] = close[-1]
+        return latest
+
+    @staticmethod
+    def prefix_sums(close: np.ndarray):
+        """
+        移動平均の計算に使う累積和を計算する
+
+        Parameters
+        ----------
+        close : np.ndarray
+            (日付 × 銘柄)の終値調整の配列。欠損はNaN
+
+        Returns
+        -------
+        tuple
+            (先頭に0行を足した累積和, 先頭に0行を足した欠損でない値の累積数)
+        """
+        filled = np.where(np.isnan(close), 0.0, close)
+        csum = np.zeros((close.shape[0] + 1, close.shape[1]))
+        np.cumsum(filled, axis=0, out=csum[1:])
+        ccount = np.zeros(csum.shape, dtype=np.int64)
+        np.cumsum(~np.isnan(close), axis=0, out=ccount[1:])
+        return csum, ccount
+
+    @staticmethod
+    def moving_average(csum: np.ndarray, ccount: np.ndarray, window: int):
+        """
+        累積和から移動平均を計算する。窓内に欠損がある日はNaN
+
+        Parameters
+        ----------
+        csum : np.ndarray
+            先頭に0行を足した累積和
+        ccount : np.ndarray
+            先頭に0行を足した欠損でない値の累積数
+        window : int
+            移動平均の日数
+
+        Returns
+        -------
+        np.ndarray
+            小数第1位で丸めた移動平均
+        """
+        rows = csum.shape[0] - 1
+        average = np.full((rows,) + csum.shape[1:], np.nan)
+        if window > rows:
+            return average
+
+        sums = csum[window:] - csum[:-window]
+        counts = ccount[window:] - ccount[:-window]
+        # 累積和の差による桁落ちを丸めてから割る
+        sums = np.round(sums, 8)
+        average[window - 1:] = np.where(counts == window, sums / window, np.nan)
+        return np.round(average, 1)
+
+    @staticmethod
+    def match_transition(stage: np.ndarray, valid: np.ndarray, transition: tuple):
+        """
+        直近の日付のステージが遷移パターンと一致するかを判定する
+
+        Parameters
+        ----------
+        stage : np.ndarray
+            (日付 × 銘柄)のステージ
+        valid : np.ndarray
+            (日付 × 銘柄)のステージが計算できた日
+        transition : tuple
+            古い順のステージの遷移
+
+        Returns
+        -------
+        np.ndarray
+            遷移パターンの最終日にTrueとなる(日付 × 銘柄)の配列
+        """
+        matched = np.ones(stage.shape, dtype=bool)
+        for lag, expected in enumerate(reversed(transition)):
+            matched &= SignalEngine.shift(stage == expected, lag, fill=False)
+            matched &= SignalEngine.shift(valid, lag, fill=False)
+        return matched
+
+    @staticmethod
+    def shift(values: np.ndarray, lag: int, fill=np.nan):
+        """
+        日付方向に配列をずらす
+
+        Parameters
+        ----------
+        values : np.ndarray
+            (日付 × 銘柄)の配列
+        lag : int
+            ずらす日数
+        fill : optional
+            空いた先頭を埋める値, by default np.nan
+
+        Returns
+        -------
+        np.ndarray
+            lag日前の値を持つ配列
+        """
+        if lag == 0:
+            return values
+        shifted = np.empty_like(values, dtype=np.result_type(values, type(fill)))
+        shifted[:lag] = fill
+        shifted[lag:] = values[:-lag]
+        return shifted
+
+    @staticmethod
+    def make_panel(series: list):
+        """
+        銘柄ごとの株価を最新日でそろえた(日付 × 銘柄)の配列にする
+
+        Parameters
+        ----------
+        series : list
+            日付順の銘柄ごとの1次元配列のリスト
+
+        Returns
+        -------
+        np.ndarray
+            先頭をNaNで埋めた(日付 × 銘柄)の配列
+        """
+        rows = max((len(values) for values in series), default=0)
+        panel = np.full((rows, len(series)), np.nan)
+        for column, values in enumerate(series):
+            if len(values) > 0:
+                panel[rows - len(values):, column] = values
+        return panel
@@ -0,0 +1,183 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import numpy as np
+from .signal_engine import SignalEngine
+from .backtest import Backtester
+
+# プロセスごとに1度だけ計算し、移動平均の期間の組み合わせ間で共有する
+_close = None
+_prefix_sums = None
+_averages = {}
+
+
+class ParameterSweep:
+    """
+    移動平均の期間と買いシグナルのステージ遷移の組み合わせをバックテストで比較するクラス
+
+    株価の累積和は1度だけ計算し、各期間の移動平均はその累積和から1度ずつ計算して
+    組み合わせ間で使い回す。期間の組み合わせごとにプロセスプールで並列に評価する。
+
+    Attributes
+    -------
+    SORT_KEY : str
+        順位付けに使う指標
+    short_terms : list
+        短期移動平均の日数の候補
+    middle_terms : list
+        中期移動平均の日数の候補
+    long_terms : list
+        長期移動平均の日数の候補
+    transitions : list
+        買いシグナルとするステージの遷移の候補
+    songiri : bool
+        平均取得単価を下回っていても売りシグナルで売るかどうか
+    """
+    SORT_KEY = 'median'
+
+    def __init__(self, short_terms: list, middle_terms: list, long_terms: list, transitions: list, songiri=True):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        short_terms : list
+            短期移動平均の日数の候補
+        middle_terms : list
+            中期移動平均の日数の候補
+        long_terms : list
+            長期移動平均の日数の候補
+        transitions : list
+            買いシグナルとするステージの遷移の候補
+        songiri : bool, optional
+            平均取得単価を下回っていても売りシグナルで売るかどうか, by default True
+        """
+        self.short_terms = sorted(set(short_terms))
+        self.middle_terms = sorted(set(middle_terms))
+        self.long_terms = sorted(set(long_terms))
+        self.transitions = [tuple(transition) for transition in transitions]
+        self.songiri = songiri
+
+    def get_windows(self):
+        """
+        短期 < 中期 < 長期となる期間の組み合わせの取得
+
+        Returns
+        -------
+        list
+            (短期, 中期, 長期)のリスト
+        """
+        return [(short, middle, long)
+                for short, middle, long in product(self.short_terms, self.middle_terms, self.long_terms)
+                if short < middle < long]
+
+    def run(self, close: np.ndarray, processes=None, sort_key=SORT_KEY):
+        """
+        全ての組み合わせを評価し、指標の高い順に並べる
+
+        Parameters
+        ----------
+        close : np.ndarray
+            (日付 × 銘柄)の終値調整の配列。欠損はNaN
+        processes : int, optional
+            プロセス数, by default None (CPU数)。1の場合は同じプロセスで実行する
+        sort_key : str, optional
+            順位付けに使う指標, by default SORT_KEY
+
+        Returns
+        -------
+        pd.DataFrame
+            組み合わせごとの損益の要約統計量。rankが順位
+        """
+        import pandas as pd
+
+        windows = self.get_windows()
+        if processes == 1:
+            _init_worker(close)
+            results = [_evaluate(window, self.transitions, self.songiri)
+                       for window in windows]
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                     initargs=(close,)) as executor:
+                results = list(executor.map(
+                    _evaluate, windows, [self.transitions] * len(windows),
+                    [self.songiri] * len(windows)))
+
+        df = pd.DataFrame([row for rows in results for row in rows])
+        if df.empty:
+            return df
+        df = df.sort_values(sort_key, ascending=False,
+                            na_position='last').reset_index(drop=True)
+        df.insert(0, 'rank', np.arange(1, len(df) + 1))
+        return df
+
+
+def _init_worker(close: np.ndarray):
+    """
+    プロセスごとに株価と累積和を保持する
+
+    Parameters
+    ----------
+    close : np.ndarray
+        (日付 × 銘柄)の終値調整の配列
+    """
+    global _close, _prefix_sums, _averages
+    _close = np.asarray(close, dtype=np.float64)
+    if _close.ndim == 1:
+        _close = _close[:, np.newaxis]
+    _prefix_sums = SignalEngine.prefix_sums(_close)
+    _averages = {}
+
+
+def _get_average(window: int):
+    """
+    保持した累積和から移動平均を取得する。計算済みの期間は使い回す
+
+    Parameters
+    ----------
+    window : int
+        移動平均の日数
+
+    Returns
+    -------
+    np.ndarray
+        (日付 × 銘柄)の移動平均
+    """
+    if window not in _averages:
+        _averages[window] = SignalEngine.moving_average(
+            *_prefix_sums, window)
+    return _averages[window]
+
+
+def _evaluate(windows: tuple, transitions: list, songiri: bool):
+    """
+    1つの期間の組み合わせについて、全ての遷移の候補をバックテストする
+
+    Parameters
+    ----------
+    windows : tuple
+        (短期, 中期, 長期)の移動平均の日数
+    transitions : list
+        買いシグナルとするステージの遷移の候補
+    songiri : bool
+        平均取得単価を下回っていても売りシグナルで売るかどうか
+
+    Returns
+    -------
+    list
+        組み合わせごとの結果の辞書のリスト
+    """
+    short, middle, long = windows
+    averages = {'short': _get_average(short), 'middle': _get_average(middle),
+                'long': _get_average(long)}
+
+    rows = []
+    for transition in transitions:
+        engine = SignalEngine(short, middle, long, transition)
+        result = Backtester(engine, songiri=songiri).run(_close, averages)
+        row = {'short': short, 'middle': middle, 'long': long,
+               'transition': '-'.join(str(stage) for stage in transition)}
+        row.update(Backtester.summarize(result['profit']))
+        row['purchases'] = int(result['purchases'].sum())
+        row['sales'] = int(result['sales'].sum())
+        rows.append(row)
+    return rows
@@ -0,0 +1,262 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from os import environ, path
+import argparse
+import time
+import numpy as np
+from dotenv import load_dotenv
+from tqdm import tqdm
+from repository.stock_list import StockListAPI
+from repository.stock import StockAPI, StockCache, parse_stock_csv, concat_columns
+from repository.store import PriceStoreAPI
+from analysis import SignalEngine
+
+from logging import getLogger, StreamHandler, DEBUG
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+
+"""
+全銘柄の過去の株価を取得し、列指向のストアにまとめて保存するコマンド
+
+$ python backfill.py --start-year 2018 --end-year 2020 --output ../data/store
+"""
+
+config = 'resources/.env'
+load_dotenv(config, verbose=True)
+
+INDICATOR_SCHEMA = {
+    'date': np.int32,
+    'short': np.float64,
+    'middle': np.float64,
+    'long': np.float64,
+    'stage': np.int8,
+    'purchase_sign': np.bool_,
+}
+PRICE_DIR = 'prices'
+INDICATOR_DIR = 'indicators'
+DONE_FILE = 'backfill_done.txt'
+FAILED_FILE = 'backfill_failed.txt'
+
+
+def build_columns(texts: list):
+    """
+    1銘柄分の株価csvをパースし、移動平均とステージを計算する
+
+    プロセスプールで実行するため、モジュールの関数にしている。
+
+    Parameters
+    ----------
+    texts : list
+        年ごとの株価APIのレスポンスのバイト列
+
+    Returns
+    -------
+    tuple
+        (株価のカラムの辞書, 指標のカラムの辞書)
+    """
+    prices = concat_columns([parse_stock_csv(text) for text in texts])
+
+    result = SignalEngine().compute(prices['closed_adj'])
+    indicators = {name: result[name][:, 0]
+                  for name in INDICATOR_SCHEMA if name != 'date'}
+    indicators['date'] = prices['date']
+    return prices, indicators
+
+
+def load_done(filepath: str):
+    """
+    保存済み(または失敗した)銘柄コードを読み込む
+
+    Parameters
+    ----------
+    filepath : str
+        銘柄コードを行頭に記録したファイルのパス
+
+    Returns
+    -------
+    set
+        銘柄コード
+    """
+    if not path.exists(filepath):
+        return set()
+    with open(filepath) as f:
+        return {line.split('\t')[0].strip() for line in f if line.strip()}
+
+
+def backfill(codes: list, years: list, stock_api: StockAPI, output: str, processes=None, max_pending=64,
+             retry_failed=False):
+    """
+    株価を取得し、プロセスプールでパース・指標計算をしてストアに保存する
+
+    保存が終わった銘柄コードを1行ずつ記録し、再実行時は記録済みの銘柄を飛ばす。
+    取得・計算・保存に失敗した銘柄は失敗した銘柄のファイルに記録して残りの銘柄を続け、最後に一覧を出力する。
+
+    Parameters
+    ----------
+    codes : list
+        銘柄コードのリスト
+    years : list
+        取得する年(西暦)のリスト
+    stock_api : StockAPI
+        株価取得APIのインスタンス
+    output : str
+        保存先のディレクトリ
+    processes : int, optional
+        パース・指標計算のプロセス数, by default None (CPU数)
+    max_pending : int, optional
+        同時に取得・計算中にする銘柄数の上限, by default 64
+    retry_failed : bool, optional
+        以前の実行で失敗した銘柄も処理し直す, by default False
+
+    Returns
+    -------
+    list
+        この実行で失敗した銘柄コードのリスト
+    """
+    price_store = PriceStoreAPI(path.join(output, PRICE_DIR))
+    indicator_store = PriceStoreAPI(
+        path.join(output, INDICATOR_DIR), INDICATOR_SCHEMA)
+    done_path = path.join(output, DONE_FILE)
+    failed_path = path.join(output, FAILED_FILE)
+    done = load_done(done_path)
+    skipped = set() if retry_failed else load_done(failed_path) - done
+    remaining = [code for code in codes
+                 if str(code) not in done and str(code) not in skipped]
+    logger.info(
+        f'{len(codes) - len(remaining) - len(skipped)} codes already done, {len(skipped)} codes failed before, '
+        f'{len(remaining)} codes to backfill.')
+
+    failed = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor, \
+            open(done_path, 'a') as done_file, \
+            open(failed_path, 'a') as failed_file, \
+            tqdm(total=len(remaining), unit='code') as progress:
+        def fail(code, exception):
+            # 1銘柄の失敗でバックフィル全体を止めず、記録して次に進む
+            logger.error(f'Failed to backfill {code}: {exception!r}')
+            failed.append(code)
+            failed_file.write(f'{code}\t{exception!r}\n')
+            failed_file.flush()
+            progress.update(1)
+
+        futures = {}
+        for start in range(0, len(remaining), max_pending):
+            chunk = remaining[start:start + max_pending]
+
+            # 取得は銘柄・年ごとに並行して行い、全年度がそろった銘柄から計算に回す
+            texts = {code: {} for code in chunk}
+            for code, year, text in stock_api.fetch_stocks(
+                    [(code, year) for code in chunk for year in years], raw=True, return_exceptions=True):
+                if code not in texts:
+                    # 他の年の取得に失敗した銘柄
+                    continue
+                if isinstance(text, Exception):
+                    del texts[code]
+                    fail(code, text)
+                    continue
+                texts[code][year] = text
+                if len(texts[code]) == len(years):
+                    parts = texts.pop(code)
+                    future = executor.submit(
+                        build_columns, [parts[year] for year in years])
+                    futures[future] = code
+
+            # 次の取得中に計算が溜まりすぎないよう、上限を超えた分は保存まで待つ
+            while len(futures) > max_pending:
+                completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    code = futures.pop(future)
+                    try:
+                        _save_result(future, code, price_store,
+                                     indicator_store, done_file, progress, started)
+                    except Exception as e:
+                        fail(code, e)
+
+        for future in list(futures):
+            code = futures.pop(future)
+            try:
+                _save_result(future, code, price_store,
+                             indicator_store, done_file, progress, started)
+            except Exception as e:
+                fail(code, e)
+
+    if failed:
+        logger.warning(
+            f'{len(failed)} codes failed (see {failed_path}): {", ".join(str(code) for code in failed)}')
+    return failed
+
+
+def _save_result(future, code, price_store, indicator_store, done_file, progress, started):
+    """
+    計算結果をストアに保存し、保存済みとして記録する
+
+    Parameters
+    ----------
+    future : Future
+        build_columnsの計算結果
+    code : str
+        銘柄コード
+    price_store : PriceStoreAPI
+        株価のストア
+    indicator_store : PriceStoreAPI
+        指標のストア
+    done_file : file
+        保存済みの銘柄コードを記録するファイル
+    progress : tqdm
+        進捗表示
+    started : float
+        開始時刻
+    """
+    prices, indicators = future.result()
+    price_store.write(code, prices)
+    indicator_store.write(code, indicators)
+    done_file.write(f'{code}\n')
+    done_file.flush()
+
+    progress.update(1)
+    elapsed = time.perf_counter() - started
+    progress.set_postfix(codes_per_sec=f'{progress.n / elapsed:.2f}')
+
+
+def main():
+    """
+    コマンドライン引数を読み込んでバックフィルを実行する
+    """
+    parser = argparse.ArgumentParser(
+        description='Backfill price history of the whole universe into a columnar store.')
+    parser.add_argument('--start-year', type=int, required=True)
+    parser.add_argument('--end-year', type=int, required=True)
+    parser.add_argument('--output', required=True)
+    parser.add_argument(
+        '--stocklist', default=environ.get('STOCKLIST_PATH', 'resources/stocklist.csv'))
+    parser.add_argument(
+        '--stock-api-path', default=environ.get('STOCK_API_PATH'))
+    parser.add_argument('--cache-dir', default=environ.get('STOCK_CACHE_DIR'))
+    parser.add_argument('--concurrency', type=int,
+                        default=StockAPI.MAX_CONCURRENCY)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--all', action='store_true',
+                        help='do not filter the universe by business type')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='backfill codes that failed in previous runs again')
+    args = parser.parse_args()
+
+    stock_list_api = StockListAPI(args.stocklist, filter_mode=not args.all)
+    cache = StockCache(args.cache_dir) if args.cache_dir is not None else None
+    stock_api = StockAPI(args.stock_api_path,
+                         max_concurrency=args.concurrency, cache=cache)
+    years = [str(year)
+             for year in range(args.start_year, args.end_year + 1)]
+
+    failed = backfill(stock_list_api.get_codes(), years, stock_api,
+                      args.output, processes=args.processes, retry_failed=args.retry_failed)
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import time
+from repository.store import PriceStoreAPI
+from analysis import Backtester
+
+from logging import getLogger, StreamHandler, DEBUG
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+
+"""
+列指向のストアに保存した全銘柄の株価でステージ遷移の売買をバックテストするコマンド
+
+$ python backtest.py --store ../data/store/prices --output ../data/stock_profit.csv
+"""
+
+
+def main():
+    """
+    コマンドライン引数を読み込んでバックテストを実行する
+    """
+    parser = argparse.ArgumentParser(
+        description='Backtest the stage-transition strategy over the price store.')
+    parser.add_argument('--store', required=True)
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--no-songiri', action='store_true',
+                        help='sell only when the price is at or below the average cost')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    backtester = Backtester(songiri=not args.no_songiri)
+    df = backtester.run_store(PriceStoreAPI(
+        args.store), start=args.start, end=args.end)
+    summary = Backtester.summarize(df.profit.to_numpy())
+    logger.info(
+        f'Backtested {len(df)} codes in {time.perf_counter() - started:.1f}s.')
+    logger.info(
+        f'中央値：{summary["median"]}、歪度：{summary["skew"]}、勝率：{summary["win_rate"]:.1%}')
+
+    if args.output is not None:
+        df[['code', 'profit']].dropna().to_csv(args.output, index=None)
+
+
+if __name__ == '__main__':
+    main()
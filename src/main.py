@@ -1,6 +1,5 @@
 from os import environ
 from dotenv import load_dotenv
-from runner import Runner
 
 config = 'resources/.env'
 load_dotenv(config, verbose=True)
@@ -10,6 +9,8 @@ def main(event, context):
     """
     google functionで実行される関数
 
+    依存ライブラリの読み込みはコールドスタートを短くするため、最初の実行まで遅らせる。
+
     Parameters
     ----------
     event : event
@@ -25,9 +26,36 @@ def main(event, context):
     service_account_key_path = environ.get('SERVICE_ACCOUNT_KEY_PATH')
     stock_api_path = environ.get('STOCK_API_PATH')
     sheet_id = environ.get('SHEET_ID')
-    runner = Runner(cached_host, cached_username, cached_password,
-                    stocklist_path, drive_key, service_account_key_path, stock_api_path, sheet_id)
-    runner.start(insert_flag=False)
+    time_budget = environ.get('TIME_BUDGET')
+    cache_dir = environ.get('STOCK_CACHE_DIR')
+    incremental = environ.get('INCREMENTAL') == 'true'
+    store_dir = environ.get('PRICE_STORE_DIR')
+    worker_mode = environ.get('WORKER_MODE') == 'true'
+    pipeline_mode = environ.get('PIPELINE_MODE') == 'true'
+    indicators = environ.get('INDICATORS')
+    signal_conditions = environ.get('SIGNAL_CONDITIONS')
+    upload_format = environ.get('DRIVE_FORMAT', 'csv')
+    profile_dir = environ.get('PROFILE_DIR')
+
+    from runner import Runner
+    from metrics import Profiler
+    with Profiler(profile_dir):
+        runner = Runner(cached_host, cached_username, cached_password,
+                        stocklist_path, drive_key, service_account_key_path, stock_api_path, sheet_id,
+                        cache_dir=cache_dir, incremental=incremental,
+                        store_dir=store_dir, indicators=indicators,
+                        signal_conditions=signal_conditions,
+                        upload_format=upload_format)
+        if worker_mode:
+            runner.start_worker(insert_flag=False, time_budget=float(
+                time_budget or Runner.TIME_BUDGET), worker_id=environ.get('WORKER_ID'))
+        elif pipeline_mode:
+            runner.start_pipeline(insert_flag=False, time_budget=float(
+                time_budget or Runner.TIME_BUDGET))
+        elif time_budget is None:
+            runner.start(insert_flag=False)
+        else:
+            runner.start_batch(insert_flag=False, time_budget=float(time_budget))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,4 @@
+from .registry import Metrics, Timer, METRICS
+from .profiler import Profiler
+
+__all__ = ['Metrics', 'Timer', 'METRICS', 'Profiler']
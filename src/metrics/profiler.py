@@ -0,0 +1,56 @@
+from datetime import datetime
+import cProfile
+import os
+
+
+class Profiler:
+    """
+    withで囲んだ処理をcProfileで計測し、実行ごとに1つのファイルに保存するクラス
+
+    ディレクトリを指定しない場合は何もしない。
+    cProfileは開始したスレッドだけを計測するため、パイプライン実行の各段階のスレッドは含まれない。
+    保存したファイルは `python -m pstats` などで確認する。
+
+    Attributes
+    -------
+    directory : str
+        保存先のディレクトリ。Noneの場合は計測しない
+    name : str
+        ファイル名の接頭辞
+    path : str
+        保存したファイルのパス。保存前はNone
+    """
+
+    def __init__(self, directory: str = None, name='runner'):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        directory : str, optional
+            保存先のディレクトリ, by default None (計測しない)
+        name : str, optional
+            ファイル名の接頭辞, by default 'runner'
+        """
+        self.directory = directory
+        self.name = name
+        self.path = None
+        self.__profile = None
+
+    def __enter__(self):
+        if self.directory is not None:
+            self.__profile = cProfile.Profile()
+            self.__profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.__profile is None:
+            return False
+        self.__profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(
+            self.directory, f'{self.name}-{stamp}-{os.getpid()}.prof')
+        self.__profile.dump_stats(self.path)
+        self.__profile = None
+        return False
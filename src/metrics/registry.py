@@ -0,0 +1,231 @@
+from functools import wraps
+from threading import Lock
+import json
+import time
+
+
+class Metrics:
+    """
+    処理時間・回数・バイト数を集計するクラス
+
+    本番で常に有効にしておけるよう、1回の計測は時刻の取得2回とロック内の加算だけにする。
+    複数のスレッドから同時に記録してよい。
+
+    Attributes
+    -------
+    HITS_SUFFIX : str
+        ヒット数のカウンターの接尾辞。MISSES_SUFFIXのカウンターと組でヒット率を計算する
+    MISSES_SUFFIX : str
+        ミス数のカウンターの接尾辞
+    timers : dict
+        計測名をキー、[回数, 合計時間(秒), 最大時間(秒), 失敗数]を値とした辞書
+    counters : dict
+        カウンター名をキー、合計値を値とした辞書
+    """
+    HITS_SUFFIX = '.hits'
+    MISSES_SUFFIX = '.misses'
+
+    def __init__(self):
+        """
+        コンストラクタ
+        """
+        self.timers = {}
+        self.counters = {}
+        self.__lock = Lock()
+
+    def timer(self, name: str):
+        """
+        withで囲んだ処理の時間を計測する
+
+        Parameters
+        ----------
+        name : str
+            計測名
+
+        Returns
+        -------
+        Timer
+            コンテキストマネージャ
+        """
+        return Timer(self, name)
+
+    def timed(self, name: str):
+        """
+        関数の呼び出しごとに処理時間を計測するデコレータ
+
+        Parameters
+        ----------
+        name : str
+            計測名
+
+        Returns
+        -------
+        callable
+            デコレータ
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                failed = True
+                try:
+                    result = func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    self.observe(name, time.perf_counter() - started, failed)
+            return wrapper
+        return decorator
+
+    def observe(self, name: str, elapsed: float, failed=False):
+        """
+        処理時間を記録する
+
+        Parameters
+        ----------
+        name : str
+            計測名
+        elapsed : float
+            処理時間(秒)
+        failed : bool, optional
+            例外で終了したかどうか, by default False
+        """
+        with self.__lock:
+            stat = self.timers.get(name)
+            if stat is None:
+                stat = self.timers[name] = [0, 0.0, 0.0, 0]
+            stat[0] += 1
+            stat[1] += elapsed
+            if elapsed > stat[2]:
+                stat[2] = elapsed
+            if failed:
+                stat[3] += 1
+
+    def count(self, name: str, value=1):
+        """
+        カウンターに加算する
+
+        Parameters
+        ----------
+        name : str
+            カウンター名
+        value : int, optional
+            加算する値, by default 1
+        """
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def hit(self, name: str, hit: bool):
+        """
+        キャッシュのヒット・ミスを記録する
+
+        Parameters
+        ----------
+        name : str
+            キャッシュ名
+        hit : bool
+            ヒットした場合True
+        """
+        self.count(name + (self.HITS_SUFFIX if hit else self.MISSES_SUFFIX))
+
+    def reset(self):
+        """
+        集計をリセットする
+        """
+        with self.__lock:
+            self.timers = {}
+            self.counters = {}
+
+    def snapshot(self):
+        """
+        集計結果の取得
+
+        Returns
+        -------
+        dict
+            timers(計測名ごとのcount, total, mean, max, errors), counters, hit_ratios(キャッシュ名ごとのヒット率)
+        """
+        with self.__lock:
+            timers = {name: list(stat) for name, stat in self.timers.items()}
+            counters = dict(self.counters)
+
+        hit_ratios = {}
+        for name, hits in counters.items():
+            if not name.endswith(self.HITS_SUFFIX):
+                continue
+            cache = name[:-len(self.HITS_SUFFIX)]
+            total = hits + counters.get(cache + self.MISSES_SUFFIX, 0)
+            hit_ratios[cache] = round(hits / total, 4) if total > 0 else 0.0
+        for name in counters:
+            if name.endswith(self.MISSES_SUFFIX):
+                hit_ratios.setdefault(name[:-len(self.MISSES_SUFFIX)], 0.0)
+
+        return {
+            'timers': {
+                name: {'count': count, 'total': round(total, 6),
+                       'mean': round(total / count, 6), 'max': round(longest, 6),
+                       'errors': errors}
+                for name, (count, total, longest, errors) in sorted(timers.items())},
+            'counters': dict(sorted(counters.items())),
+            'hit_ratios': dict(sorted(hit_ratios.items())),
+        }
+
+    def to_json(self, **fields):
+        """
+        集計結果を1行のjsonにする
+
+        Parameters
+        ----------
+        **fields
+            集計結果に加えて出力する項目
+
+        Returns
+        -------
+        str
+            json文字列
+        """
+        record = dict(fields)
+        record.update(self.snapshot())
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class Timer:
+    """
+    withで囲んだ処理の時間をMetricsに記録するコンテキストマネージャ
+
+    Attributes
+    -------
+    metrics : Metrics
+        記録先
+    name : str
+        計測名
+    """
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics: Metrics, name: str):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        metrics : Metrics
+            記録先
+        name : str
+            計測名
+        """
+        self.metrics = metrics
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.started,
+                             exc_type is not None)
+        return False
+
+
+# プロセス全体で共有する集計。リポジトリの呼び出しとRunnerの各段階をここに記録する
+METRICS = Metrics()
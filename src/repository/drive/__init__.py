@@ -1,3 +1,5 @@
 from .google_drive import GoogleDriveAPI
+from .index import DriveFileIndex
+from .batch import GoogleDriveBatchAPI
 
-__all__ = ['GoogleDriveAPI']
+__all__ = ['GoogleDriveAPI', 'DriveFileIndex', 'GoogleDriveBatchAPI']
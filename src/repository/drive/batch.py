@@ -0,0 +1,122 @@
+"""
+https://developers.google.com/drive/api/v3/batch
+"""
+
+from metrics import METRICS
+import time
+
+
+class GoogleDriveBatchAPI:
+    """
+    google driveのメタデータ操作をバッチリクエストでまとめて行うAPI
+
+    1回のバッチリクエストに含められるのは最大100件のため、それを超える場合は分割して送る。
+    失敗は件ごとに返し、1件の失敗で他の件の結果は失われない。
+    レート制限・再試行はGoogleDriveAPIと同じクライアントで行い、429/5xxで失敗した件は待ってから送り直す。
+
+    バッチにするのはファイルの削除だけとする。ファイルの検索はバッチ実行では対応表(DriveFileIndex)を
+    使うため銘柄ごとのリクエストがなく、ファイル名の変更はファイルの内容のアップロードと同時に行うが、
+    バッチリクエストにはアップロードを含められない。
+
+    Attributes
+    -------
+    BATCH_SIZE : int
+        1回のバッチリクエストに含める件数
+    drive_api : GoogleDriveAPI
+        google driveのAPI
+    """
+    BATCH_SIZE = 100
+
+    def __init__(self, drive_api):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        drive_api : GoogleDriveAPI
+            google driveのAPI
+        """
+        self.drive_api = drive_api
+
+    @METRICS.timed('drive_batch.delete_files')
+    def delete_files(self, fileids: list):
+        """
+        複数のファイルを削除する
+
+        Parameters
+        ----------
+        fileids : list
+            削除するファイルのキー値のリスト
+
+        Returns
+        -------
+        dict
+            ファイルのキー値をキー、失敗した場合は例外、成功した場合はNoneを値とした辞書
+        """
+        files = self.drive_api.service.files()
+        results = self.__execute(
+            [(fileid, files.delete(fileId=fileid)) for fileid in fileids])
+
+        index = self.drive_api.index
+        errors = {}
+        for fileid, (_, exception) in results.items():
+            errors[fileid] = exception
+            if exception is None and index is not None:
+                index.remove(fileid)
+        return errors
+
+    def __execute(self, requests: list):
+        """
+        リクエストをBATCH_SIZE件ずつバッチで実行する
+
+        Parameters
+        ----------
+        requests : list
+            (リクエストID, リクエスト)のリスト
+
+        Returns
+        -------
+        dict
+            リクエストIDをキー、(レスポンス, 例外)を値とした辞書
+        """
+        outbound = self.drive_api.outbound
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (response, exception)
+
+        def send(chunk):
+            batch = self.drive_api.service.new_batch_http_request(
+                callback=callback)
+            for request_id, request in chunk:
+                batch.add(request, request_id=request_id)
+            batch.execute()
+
+        pending = requests
+        for attempt in range(1, outbound.retry.max_attempts + 1):
+            for start in range(0, len(pending), self.BATCH_SIZE):
+                outbound.call(send, pending[start:start + self.BATCH_SIZE])
+
+            # 429/5xxで失敗した件だけを送り直す
+            retries = []
+            delay = 0.0
+            throttled_any = False
+            for request_id, request in pending:
+                exception = results[request_id][1]
+                if exception is None:
+                    continue
+                retryable, throttled, retry_after = outbound.retry.classify(
+                    exception)
+                if retryable:
+                    retries.append((request_id, request))
+                    delay = max(delay, outbound.retry.get_delay(
+                        attempt, retry_after))
+                    throttled_any |= throttled
+            if throttled_any:
+                outbound.bucket.throttle()
+            if not retries or attempt == outbound.retry.max_attempts:
+                break
+            METRICS.count('outbound.drive.retries', len(retries))
+            time.sleep(delay)
+            pending = retries
+        return results
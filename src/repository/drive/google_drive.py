@@ -2,10 +2,13 @@
 http://googleapis.github.io/google-api-python-client/docs/dyn/drive_v3.files.html
 """
 
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from oauth2client.service_account import ServiceAccountCredentials
+from ..google import GoogleClientFactory
+from ..outbound import OutboundClient
+from .index import DriveFileIndex
+from tempfile import SpooledTemporaryFile
+import gzip
 import io
+from metrics import METRICS
 
 
 class GoogleDriveAPI:
@@ -20,13 +23,45 @@ class GoogleDriveAPI:
         サービスアカウント情報が記載されたローカルのパス
     MIME_TYPE : str
         ファイル形式
+    EXTENSION : str
+        ファイル名の拡張子
+    FORMATS : dict
+        アップロード形式をキー、(拡張子, ファイル形式)を値とした辞書
+    PAGE_SIZE : int
+        ファイル一覧を取得する際の1ページの件数
+    RESUMABLE_THRESHOLD : int
+        再開可能なアップロードを使うファイルサイズの下限(バイト)。これ以下は1回のリクエストで送る
+    CHUNK_SIZE : int
+        再開可能なアップロードで1回に送るバイト数。256KBの倍数
+    SPOOL_SIZE : int
+        アップロードする内容をメモリに置くサイズの上限(バイト)。超えた分は一時ファイルに書く
+    GZIP_LEVEL : int
+        gzip形式の圧縮レベル
+    upload_format : str
+        アップロード形式
     file_key : str
         google driveのフォルダーのキー
     service : service
-        gcpのサービスアカウント
+        gcpのサービスアカウント。他のクライアントと認証情報・HTTP接続を共有する
+    index : DriveFileIndex
+        フォルダー内のファイル名とキー値の対応表。Noneの場合は都度検索する
+    outbound : OutboundClient
+        レート制限・再試行を行うクライアント
     """
+    PAGE_SIZE = 1000
+    # csv: そのまま、gzip: csvをgzipで圧縮、npz: 列ごとの型付き配列をnumpyのnpzで圧縮
+    FORMATS = {
+        'csv': ('.csv', 'text/csv'),
+        'gzip': ('.csv.gz', 'application/gzip'),
+        'npz': ('.npz', 'application/octet-stream'),
+    }
+    # 1銘柄のcsvは数百KBのため、通常は再開可能なアップロードのセッション作成の往復を省く
+    RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+    CHUNK_SIZE = 1024 * 1024
+    SPOOL_SIZE = 8 * 1024 * 1024
+    GZIP_LEVEL = 6
 
-    def __init__(self, file_key: str, service_account_key_path: str):
+    def __init__(self, file_key: str, service_account_key_path: str, upload_format: str = 'csv'):
         """
         コンストラクタ
 
@@ -36,14 +71,54 @@ class GoogleDriveAPI:
             google driveのフォルダーのキー
         service_account_key_path : str
             サービスアカウントのキー情報が記載されたローカルパス
+        upload_format : str, optional
+            アップロード形式(FORMATSのキー), by default 'csv'
+
+        Raises
+        ------
+        Exception
+            アップロード形式がFORMATSにない場合
         """
+        if upload_format not in self.FORMATS:
+            raise Exception(f'Unknown upload format: {upload_format}')
         self.GOOGLE_PATH = 'https://www.googleapis.com/auth/drive.file'
         self.KEY_FILE = service_account_key_path
-        self.MIME_TYPE = "text/csv"
+        self.EXTENSION, self.MIME_TYPE = self.FORMATS[upload_format]
+        self.upload_format = upload_format
         self.file_key = file_key
-        self.service = self.__get_google_service()
+        self.index = None
+        self.outbound = OutboundClient.get_instance('drive')
+
+    @property
+    def service(self):
+        """
+        gcpのサービスアカウントの取得。最初に使うときに作成し、以降は共有したものを返す
+
+        Returns
+        -------
+        service
+            サービスアカウントクラス
+        """
+        return self.__get_google_service()
+
+    def get_filename(self, code: str):
+        """
+        銘柄のファイル名の取得
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        str
+            アップロード形式の拡張子を付けたファイル名
+        """
+        return f'{code}{self.EXTENSION}'
 
-    def upload_file(self, filename: str, text: str):
+    @METRICS.timed('drive.upload_file')
+    def upload_file(self, filename: str, content):
         """
         google driveへのファイルアップロード
 
@@ -51,45 +126,54 @@ class GoogleDriveAPI:
         ----------
         filename : str
             アップロードするファイル名
-        text : str
-            ファイルの内容(銘柄情報のcsvフォーマット)
+        content : str, bytes, iterable, file object or dict
+            ファイルの内容。csv/gzip形式は銘柄情報のcsvフォーマットの文字列・バイト列か、
+            それを順に返すイテレータ・ファイル。npz形式はカラム名をキー、配列を値とした辞書
 
         Returns
         -------
         str
             ファイルキー値
         """
-        fh = io.BytesIO(text.encode('utf8'))
-
         file_metadata = {"name": filename, "mimeType": self.MIME_TYPE,
                          "parents": [self.file_key]}
-        media = MediaIoBaseUpload(
-            fh, mimetype=self.MIME_TYPE, resumable=True)
-        file_info = self.service.files().create(
-            body=file_metadata, media_body=media, fields='id').execute()
+        with self.__encode(content) as data:
+            # 再試行すると同名のファイルが重複して作成されるため、5xx・タイムアウトは再試行しない
+            file_info = self.outbound.call(lambda: self.service.files().create(
+                body=file_metadata, media_body=self.__get_media(data), fields='id').execute(),
+                idempotent=False)
+        if self.index is not None:
+            self.index.put(filename, file_info['id'])
         return file_info['id']
 
-    def update_file(self, text: str, fileid: str):
+    @METRICS.timed('drive.update_file')
+    def update_file(self, content, fileid: str, filename: str = None):
         """
         ファイル更新
 
         Parameters
         ----------
-        text : str
-            更新するcsvのファイル内容
+        content : str, bytes, iterable, file object or dict
+            更新するファイルの内容。upload_fileと同じ
         fileid : str
             更新するファイルのキー値
+        filename : str, optional
+            変更後のファイル名。アップロード形式を変えた場合に拡張子を合わせる, by default None (変更しない)
         """
-        fh = io.BytesIO(text.encode('utf8'))
-
-        media = MediaIoBaseUpload(
-            fh, mimetype=self.MIME_TYPE, resumable=True)
-        self.service.files().update(fileId=fileid, media_body=media).execute()
+        file_metadata = None if filename is None else {
+            "name": filename, "mimeType": self.MIME_TYPE}
+        with self.__encode(content) as data:
+            self.outbound.call(lambda: self.service.files().update(
+                fileId=fileid, body=file_metadata, media_body=self.__get_media(data)).execute())
+        if filename is not None and self.index is not None:
+            self.index.put(filename, fileid)
 
     def get_file(self, code: str):
         """
         google driveからファイルのキー値を取得する
 
+        対応表がある場合は検索せずに対応表から返す。同名のファイルが複数ある場合は更新日時の新しい方を返す。
+
         Parameters
         ----------
         code : str
@@ -100,8 +184,14 @@ class GoogleDriveAPI:
         str
             ファイルのキー値
         """
-        results = self.service.files().list(
-            q=f"name contains '{code}'", fields='nextPageToken, files(id, name, mimeType)').execute()
+        filename = self.get_filename(code)
+        if self.index is not None:
+            return self.index.get(filename)
+
+        with METRICS.timer('drive.get_file'):
+            results = self.outbound.call(lambda: self.service.files().list(
+                q=f"name = '{filename}' and '{self.file_key}' in parents and trashed = false",
+                fields='files(id, name)', orderBy='modifiedTime desc').execute())
         items = results.get('files', [])
 
         if not items:
@@ -109,6 +199,41 @@ class GoogleDriveAPI:
         else:
             return items[0]['id']
 
+    def list_files(self):
+        """
+        フォルダー内のファイルを更新日時の新しい順に全ページ取得する
+
+        Yields
+        -------
+        dict
+            id, nameを持つファイル情報
+        """
+        page_token = None
+        while True:
+            results = self.outbound.call(lambda: self.service.files().list(
+                q=f"'{self.file_key}' in parents and trashed = false",
+                fields='nextPageToken, files(id, name)', orderBy='modifiedTime desc',
+                pageSize=self.PAGE_SIZE, pageToken=page_token).execute())
+            yield from results.get('files', [])
+
+            page_token = results.get('nextPageToken')
+            if page_token is None:
+                break
+
+    @METRICS.timed('drive.build_index')
+    def build_index(self):
+        """
+        フォルダー内のファイルから対応表を作成し、以降の検索に使う
+
+        Returns
+        -------
+        DriveFileIndex
+            ファイル名とキー値の対応表
+        """
+        self.index = DriveFileIndex.from_items(self.list_files())
+        return self.index
+
+    @METRICS.timed('drive.delete_file')
     def delete_file(self, fileid: str):
         """
         google driveのファイル削除
@@ -118,7 +243,91 @@ class GoogleDriveAPI:
         fileid : str
             ファイルのキー値
         """
-        self.service.files().delete(fileId=fileid).execute()
+        self.outbound.call(
+            lambda: self.service.files().delete(fileId=fileid).execute())
+        if self.index is not None:
+            self.index.remove(fileid)
+
+    def __encode(self, content):
+        """
+        アップロードする内容をアップロード形式のバイト列にする
+
+        イテレータ・ファイルは少しずつ読みながら変換し、全体の文字列を作らない。
+        変換後のバイト列はSPOOL_SIZEまではメモリ、超えた分は一時ファイルに置く。
+
+        Parameters
+        ----------
+        content : str, bytes, iterable, file object or dict
+            ファイルの内容
+
+        Returns
+        -------
+        file object
+            変換後のバイト列を読み出すファイル
+        """
+        if self.upload_format == 'csv' and isinstance(content, (str, bytes)):
+            raw = content.encode('utf8') if isinstance(content, str) else content
+            METRICS.count('drive.upload_bytes', len(raw))
+            return io.BytesIO(raw)
+
+        data = SpooledTemporaryFile(self.SPOOL_SIZE)
+        if self.upload_format == 'npz':
+            import numpy as np
+            np.savez_compressed(data, **content)
+        elif self.upload_format == 'gzip':
+            # 同じ内容が同じバイト列になるよう、圧縮時刻は書き込まない
+            with gzip.GzipFile(fileobj=data, mode='wb', compresslevel=self.GZIP_LEVEL, mtime=0) as f:
+                self.__write_chunks(f, content)
+        else:
+            self.__write_chunks(data, content)
+        METRICS.count('drive.upload_bytes', data.tell())
+        return data
+
+    def __write_chunks(self, f, content):
+        """
+        csvの内容を少しずつutf8でファイルに書き込む
+
+        Parameters
+        ----------
+        f : file object
+            書き込み先のファイル
+        content : str, bytes, iterable or file object
+            csvの内容
+        """
+        if isinstance(content, (str, bytes)):
+            chunks = [content]
+        elif hasattr(content, 'read'):
+            chunks = iter(lambda: content.read(self.CHUNK_SIZE), content.read(0))
+        else:
+            chunks = content
+        for chunk in chunks:
+            f.write(chunk.encode('utf8') if isinstance(chunk, str) else chunk)
+
+    def __get_media(self, data):
+        """
+        アップロードする内容の作成。RESUMABLE_THRESHOLDを超える場合だけ再開可能なアップロードにする
+
+        再試行の際はアップロードを最初からやり直すため、リクエストごとに作成する。
+
+        Parameters
+        ----------
+        data : file object
+            アップロード形式のバイト列を読み出すファイル
+
+        Returns
+        -------
+        MediaIoBaseUpload
+            アップロードする内容
+        """
+        from googleapiclient.http import MediaIoBaseUpload
+
+        size = data.seek(0, io.SEEK_END)
+        data.seek(0)
+        resumable = size > self.RESUMABLE_THRESHOLD
+        if resumable:
+            METRICS.count('drive.resumable_uploads')
+        return MediaIoBaseUpload(data, mimetype=self.MIME_TYPE,
+                                 chunksize=self.CHUNK_SIZE, resumable=resumable)
 
     def __get_google_service(self):
         """
@@ -129,12 +338,8 @@ class GoogleDriveAPI:
         service
             サービスアカウントクラス
         """
-        scope = [self.GOOGLE_PATH]
-        keyFile = self.KEY_FILE
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            keyFile, scopes=scope)
-
-        return build("drive", "v3", credentials=credentials, cache_discovery=False)
+        factory = GoogleClientFactory.get_instance(self.KEY_FILE)
+        return factory.get_service("drive", "v3")
 
 
 if __name__ == "__main__":
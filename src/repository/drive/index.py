@@ -0,0 +1,181 @@
+import json
+
+
+class DriveFileIndex:
+    """
+    google driveのフォルダー内のファイル名とキー値の対応表
+
+    複数のワーカーが同じキャッシュの対応表を更新するため、読み込んでからの変更をchangesに記録し、
+    保存時はキャッシュの最新の対応表にmergeで変更だけを反映する。
+
+    Attributes
+    -------
+    files : dict
+        ファイル名をキー、ファイルのキー値を値とした辞書
+    dirty : bool
+        読み込んでから変更があったかどうか
+    changes : dict
+        読み込んでから変更したファイル名をキー、(キー値, 追加ならTrue・削除ならFalse)を値とした辞書
+    duplicates : list
+        ファイル一覧から作成した際に見つかった、同名の古いファイルのキー値のリスト
+    """
+
+    def __init__(self, files=None):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        files : dict, optional
+            ファイル名とキー値の辞書, by default None
+        """
+        self.files = dict(files) if files is not None else {}
+        self.dirty = False
+        self.changes = {}
+        self.duplicates = []
+        self.__names = {fileid: name for name, fileid in self.files.items()}
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        google driveのファイル一覧から対応表を作成する。同名のファイルは先に見つかった方を使う
+
+        途中で終了した実行が残した同名のファイルは、duplicatesに入れる。
+
+        Parameters
+        ----------
+        items : iterable
+            id, nameを持つファイル情報。更新日時の新しい順
+
+        Returns
+        -------
+        DriveFileIndex
+            対応表
+        """
+        files = {}
+        duplicates = []
+        for item in items:
+            if item['name'] in files:
+                duplicates.append(item['id'])
+            else:
+                files[item['name']] = item['id']
+        index = cls(files)
+        # 一覧から作成した対応表は全てのファイルをキャッシュに反映する
+        index.changes = {name: (fileid, True) for name, fileid in files.items()}
+        index.dirty = True
+        index.duplicates = duplicates
+        return index
+
+    @classmethod
+    def from_json(cls, text: str):
+        """
+        json文字列から対応表を復元する
+
+        Parameters
+        ----------
+        text : str
+            to_jsonで作成した文字列
+
+        Returns
+        -------
+        DriveFileIndex
+            対応表
+        """
+        return cls(json.loads(text))
+
+    def to_json(self):
+        """
+        対応表をjson文字列にする
+
+        Returns
+        -------
+        str
+            json文字列
+        """
+        return json.dumps(self.files, separators=(',', ':'))
+
+    def merge(self, text: str):
+        """
+        キャッシュの最新の対応表に、読み込んでからの変更を反映する
+
+        反映した対応表を自身の対応表にもする。保存に成功したらcommitを呼ぶ。
+
+        Parameters
+        ----------
+        text : str
+            キャッシュの対応表のjson文字列。キャッシュにない場合はNone
+
+        Returns
+        -------
+        str
+            変更を反映した対応表のjson文字列
+        """
+        if text is not None:
+            files = json.loads(text)
+            for filename, (fileid, present) in self.changes.items():
+                if present:
+                    files[filename] = fileid
+                elif files.get(filename) == fileid:
+                    # 他のワーカーが同名の新しいファイルに差し替えていた場合は残す
+                    del files[filename]
+            self.files = files
+            self.__names = {fileid: name for name, fileid in files.items()}
+        return self.to_json()
+
+    def commit(self):
+        """
+        変更をキャッシュに保存したことを記録する
+        """
+        self.changes = {}
+        self.dirty = False
+
+    def get(self, filename: str):
+        """
+        ファイルのキー値の取得
+
+        Parameters
+        ----------
+        filename : str
+            ファイル名
+
+        Returns
+        -------
+        str
+            ファイルのキー値。ない場合はNone
+        """
+        return self.files.get(filename)
+
+    def put(self, filename: str, fileid: str):
+        """
+        ファイルを追加する
+
+        Parameters
+        ----------
+        filename : str
+            ファイル名
+        fileid : str
+            ファイルのキー値
+        """
+        if self.files.get(filename) != fileid:
+            self.files[filename] = fileid
+            self.__names[fileid] = filename
+            self.changes[filename] = (fileid, True)
+            self.dirty = True
+
+    def remove(self, fileid: str):
+        """
+        ファイルを削除する
+
+        Parameters
+        ----------
+        fileid : str
+            ファイルのキー値
+        """
+        filename = self.__names.pop(fileid, None)
+        if filename is not None and self.files.get(filename) == fileid:
+            del self.files[filename]
+            self.changes[filename] = (fileid, False)
+            self.dirty = True
+
+    def __len__(self):
+        return len(self.files)
@@ -0,0 +1,3 @@
+from .service import GoogleClientFactory
+
+__all__ = ['GoogleClientFactory']
@@ -0,0 +1,202 @@
+"""
+google apiのクライアントの作成
+
+認証情報・認証済みのHTTP接続・サービスはサービスアカウントのキーごとに1つだけ作成し、
+google drive/spread sheetのクライアントで共有する。モジュールに保持するため、同じプロセスで
+再実行された(google functionsのウォームスタート)場合も使い回す。
+googleapiclient/oauth2clientの読み込みは最初に使うときまで遅らせる。
+"""
+
+from datetime import datetime
+from threading import Lock
+
+
+class DiscoveryCache:
+    """
+    discovery documentをプロセス内に保持するキャッシュ
+
+    googleapiclientのdiscovery_cache.base.Cacheと同じget/setを持つ。
+    """
+
+    def __init__(self):
+        """
+        コンストラクタ
+        """
+        self.documents = {}
+
+    def get(self, url: str):
+        """
+        discovery documentの取得
+
+        Parameters
+        ----------
+        url : str
+            discovery documentのURL
+
+        Returns
+        -------
+        str
+            discovery document。ない場合はNone
+        """
+        return self.documents.get(url)
+
+    def set(self, url: str, content: str):
+        """
+        discovery documentの保存
+
+        Parameters
+        ----------
+        url : str
+            discovery documentのURL
+        content : str
+            discovery document
+        """
+        self.documents[url] = content
+
+
+class GoogleClientFactory:
+    """
+    google apiのサービスを作成・共有するファクトリ
+
+    認証情報はdrive/spread sheetの両方のスコープで1度だけ読み込み、トークンの取得も1回で済ませる。
+    サービスは1つのkeep-aliveのHTTP接続を共有し、トークンは期限のREFRESH_MARGIN秒前に更新する。
+
+    Attributes
+    -------
+    SCOPES : list
+        認証のスコープ
+    REFRESH_MARGIN : int
+        トークンの期限の何秒前に更新するか
+    key_path : str
+        サービスアカウントのキー情報が記載されたローカルパス
+    scopes : list
+        認証のスコープ
+    """
+    SCOPES = ['https://spreadsheets.google.com/feeds',
+              'https://www.googleapis.com/auth/drive.file']
+    REFRESH_MARGIN = 60 * 5
+
+    def __init__(self, key_path: str, scopes=SCOPES):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        key_path : str
+            サービスアカウントのキー情報が記載されたローカルパス
+        scopes : list, optional
+            認証のスコープ, by default SCOPES
+        """
+        self.key_path = key_path
+        self.scopes = list(scopes)
+        self.__credentials = None
+        self.__http = None
+        self.__services = {}
+        self.__lock = Lock()
+
+    @classmethod
+    def get_instance(cls, key_path: str):
+        """
+        サービスアカウントのキーごとに共有するファクトリの取得
+
+        Parameters
+        ----------
+        key_path : str
+            サービスアカウントのキー情報が記載されたローカルパス
+
+        Returns
+        -------
+        GoogleClientFactory
+            ファクトリ
+        """
+        with _lock:
+            if key_path not in _factories:
+                _factories[key_path] = cls(key_path)
+            return _factories[key_path]
+
+    def get_service(self, name: str, version: str):
+        """
+        google apiのサービスの取得
+
+        作成済みのサービスがあれば、トークンの期限を確認した上で使い回す。
+
+        Parameters
+        ----------
+        name : str
+            apiの名前
+        version : str
+            apiのバージョン
+
+        Returns
+        -------
+        service
+            サービス
+        """
+        with self.__lock:
+            http = self.__get_http()
+            key = (name, version)
+            if key not in self.__services:
+                from googleapiclient.discovery import build
+                self.__services[key] = build(
+                    name, version, http=http, cache=_discovery_cache)
+            return self.__services[key]
+
+    def __get_http(self):
+        """
+        認証済みのHTTP接続の取得。トークンが期限切れ間近の場合は更新する
+
+        Returns
+        -------
+        httplib2.Http
+            認証済みのHTTP接続
+        """
+        credentials = self.__get_credentials()
+        if self.__http is None:
+            import httplib2
+            self.__http = credentials.authorize(httplib2.Http())
+        if self.__is_expiring(credentials):
+            # 認証済みの接続はリクエストにトークンを付与するため、更新には素の接続を使う
+            import httplib2
+            credentials.refresh(httplib2.Http())
+        return self.__http
+
+    def __get_credentials(self):
+        """
+        サービスアカウントの認証情報の取得。キーファイルは1度だけ読み込む
+
+        Returns
+        -------
+        ServiceAccountCredentials
+            認証情報
+        """
+        if self.__credentials is None:
+            from oauth2client.service_account import ServiceAccountCredentials
+            self.__credentials = ServiceAccountCredentials.from_json_keyfile_name(
+                self.key_path, scopes=self.scopes)
+        return self.__credentials
+
+    def __is_expiring(self, credentials):
+        """
+        トークンが未取得か、期限切れ間近かどうか
+
+        Parameters
+        ----------
+        credentials : ServiceAccountCredentials
+            認証情報
+
+        Returns
+        -------
+        bool
+            更新が必要な場合True
+        """
+        if credentials.access_token is None or credentials.invalid:
+            return True
+        if credentials.token_expiry is None:
+            return False
+        remaining = credentials.token_expiry - datetime.utcnow()
+        return remaining.total_seconds() < self.REFRESH_MARGIN
+
+
+_factories = {}
+_lock = Lock()
+_discovery_cache = DiscoveryCache()
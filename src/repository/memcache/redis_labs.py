@@ -1,4 +1,5 @@
-import bmemcached
+from threading import local
+from metrics import METRICS
 
 """
 https://redislabs.com/lp/python-memcached/ 
@@ -15,8 +16,32 @@ class MemcachedAPI:
         キャッシュのキー
     EXPIRE_TIME : str
         キャッシュが切れるまでの時間(秒)
+    DRIVE_KEY_PREFIX : str
+        google driveの保存状態のキーの接頭辞
+    DRIVE_EXPIRE_TIME : int
+        google driveの保存状態が切れるまでの時間(秒)。手動で削除されたファイルなどはこの間隔で検索し直す
+    STATE_KEY_PREFIX : str
+        指標の状態のキーの接頭辞
+    FINGERPRINT_KEY_PREFIX : str
+        取得した株価のハッシュ値のキーの接頭辞
+    SHEET_KEY_PREFIX : str
+        spread sheetに書き込み済みの行のキーの接頭辞
+    SHEET_EXPIRE_TIME : int
+        書き込み済みの行の記録が切れるまでの時間(秒)
+    SHEET_CLAIM_TIME : int
+        書き込み中の行の確保が切れるまでの時間(秒)
+    SHEET_SENT : int
+        書き込み済みの行のキャッシュの値
+    SHEET_CLAIMED : int
+        書き込み中の行のキャッシュの値
+    INDEX_KEY : str
+        google driveのファイルの対応表のキー
+    INDEX_EXPIRE_TIME : int
+        google driveのファイルの対応表が切れるまでの時間(秒)
+    CAS_RETRIES : int
+        CASで更新する際に競合した場合の試行回数
     db : Client
-        キャッシュのconnection pool
+        キャッシュのconnection pool。スレッドごとに最初に使うときに作成する
 
     Raises
     ------
@@ -25,6 +50,18 @@ class MemcachedAPI:
     """
     MEMCACHE_KEY = 'code'
     EXPIRE_TIME = 60 * 30
+    DRIVE_KEY_PREFIX = 'drive:'
+    DRIVE_EXPIRE_TIME = 60 * 60 * 24
+    STATE_KEY_PREFIX = 'state:'
+    FINGERPRINT_KEY_PREFIX = 'fingerprint:'
+    SHEET_KEY_PREFIX = 'sheet:'
+    SHEET_EXPIRE_TIME = 60 * 60 * 24 * 7
+    SHEET_CLAIM_TIME = 60 * 10
+    SHEET_SENT = 1
+    SHEET_CLAIMED = 0
+    INDEX_KEY = 'drive_index'
+    INDEX_EXPIRE_TIME = 60 * 60 * 24
+    CAS_RETRIES = 10
 
     def __init__(self, host: str, username: str, password: str):
         """
@@ -39,9 +76,32 @@ class MemcachedAPI:
         password : str
             memcacheのパスワード
         """
-        self.db = bmemcached.Client(
-            [host], username=username, password=password)
+        self.__host = host
+        self.__username = username
+        self.__password = password
+        self.__local = local()
 
+    @property
+    def db(self):
+        """
+        キャッシュのconnection poolの取得。スレッドごとに最初に使うときに作成する
+
+        bmemcachedのClientは1つのソケットを使い回すため、スレッド間で共有しない。
+
+        Returns
+        -------
+        Client
+            キャッシュのconnection pool
+        """
+        db = getattr(self.__local, 'db', None)
+        if db is None:
+            import bmemcached
+            db = bmemcached.Client(
+                [self.__host], username=self.__username, password=self.__password)
+            self.__local.db = db
+        return db
+
+    @METRICS.timed('memcache.set_stock_code')
     def set_stock_code(self, code: str):
         """
         銘柄コードをキャッシュにセットする
@@ -60,6 +120,7 @@ class MemcachedAPI:
         if not is_healthy:
             raise Exception('Failed set cache.')
 
+    @METRICS.timed('memcache.get_stock_code')
     def get_stock_code(self):
         """
         銘柄コードを取得する
@@ -79,3 +140,390 @@ class MemcachedAPI:
             raise Exception('Failed fetch cache')
         else:
             return code
+
+    @METRICS.timed('memcache.set_drive_state')
+    def set_drive_state(self, code: str, fileid: str, last_date: str):
+        """
+        google driveに保存したファイルのキー値と最終日付をキャッシュにセットする
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        fileid : str
+            google driveのファイルのキー値
+        last_date : str
+            保存済みの最終日付(YYYY-MM-DD)
+
+        Raises
+        ------
+        Exception
+            保存状態のsetに失敗した場合
+        """
+        is_healthy = self.db.set(
+            f'{self.DRIVE_KEY_PREFIX}{code}', f'{fileid},{last_date}', self.DRIVE_EXPIRE_TIME)
+        if not is_healthy:
+            raise Exception('Failed set cache.')
+
+    @METRICS.timed('memcache.delete_drive_state')
+    def delete_drive_state(self, code: str):
+        """
+        google driveに保存したファイルのキー値と最終日付を削除する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        """
+        self.db.delete(f'{self.DRIVE_KEY_PREFIX}{code}')
+
+    @METRICS.timed('memcache.get_drive_state')
+    def get_drive_state(self, code: str):
+        """
+        google driveに保存したファイルのキー値と最終日付を取得する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        tuple
+            (ファイルのキー値, 保存済みの最終日付)。キャッシュにない場合はNone
+        """
+        state = self.db.get(f'{self.DRIVE_KEY_PREFIX}{code}')
+        METRICS.hit('memcache.drive_state', state is not None)
+        if state is None:
+            return None
+        fileid, last_date = state.split(',')
+        return fileid, last_date
+
+    @METRICS.timed('memcache.set_indicator_state')
+    def set_indicator_state(self, code: str, state: bytes):
+        """
+        指標の状態をキャッシュにセットする
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        state : bytes
+            シリアライズした指標の状態
+
+        Raises
+        ------
+        Exception
+            指標の状態のsetに失敗した場合
+        """
+        is_healthy = self.db.set(f'{self.STATE_KEY_PREFIX}{code}', state)
+        if not is_healthy:
+            raise Exception('Failed set cache.')
+
+    @METRICS.timed('memcache.get_indicator_state')
+    def get_indicator_state(self, code: str):
+        """
+        指標の状態を取得する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        bytes
+            シリアライズした指標の状態。キャッシュにない場合はNone
+        """
+        state = self.db.get(f'{self.STATE_KEY_PREFIX}{code}')
+        METRICS.hit('memcache.indicator_state', state is not None)
+        return state
+
+    @METRICS.timed('memcache.set_fingerprint')
+    def set_fingerprint(self, code: str, digest: str, last_date: str):
+        """
+        取得した株価のハッシュ値と処理済みの最終日付をキャッシュにセットする
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        digest : str
+            取得した株価のハッシュ値
+        last_date : str
+            処理済みの最終日付(YYYY-MM-DD)
+
+        Raises
+        ------
+        Exception
+            ハッシュ値のsetに失敗した場合
+        """
+        is_healthy = self.db.set(
+            f'{self.FINGERPRINT_KEY_PREFIX}{code}', f'{digest},{last_date}')
+        if not is_healthy:
+            raise Exception('Failed set cache.')
+
+    @METRICS.timed('memcache.get_fingerprint')
+    def get_fingerprint(self, code: str):
+        """
+        取得した株価のハッシュ値と処理済みの最終日付を取得する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        tuple
+            (ハッシュ値, 処理済みの最終日付)。キャッシュにない場合はNone
+        """
+        fingerprint = self.db.get(f'{self.FINGERPRINT_KEY_PREFIX}{code}')
+        if fingerprint is None:
+            return None
+        digest, last_date = fingerprint.split(',')
+        return digest, last_date
+
+    @METRICS.timed('memcache.update_drive_index')
+    def update_drive_index(self, merge):
+        """
+        google driveのファイルの対応表をキャッシュの最新の値と合わせて更新する
+
+        複数のワーカーが同時に更新しても他のワーカーの変更を上書きしないよう、CASで再試行する。
+
+        Parameters
+        ----------
+        merge : callable
+            キャッシュの対応表のjson文字列(ない場合はNone)を受け取り、保存するjson文字列を返す関数
+
+        Raises
+        ------
+        Exception
+            競合が続いて更新できなかった場合
+        """
+        for _ in range(self.CAS_RETRIES):
+            index, cas = self.db.gets(self.INDEX_KEY)
+            if index is None:
+                if self.db.add(self.INDEX_KEY, merge(None), self.INDEX_EXPIRE_TIME):
+                    return
+                continue
+            if self.db.cas(self.INDEX_KEY, merge(index), cas, self.INDEX_EXPIRE_TIME):
+                return
+        raise Exception('Failed set cache.')
+
+    @METRICS.timed('memcache.get_drive_index')
+    def get_drive_index(self):
+        """
+        google driveのファイルの対応表を取得する
+
+        Returns
+        -------
+        str
+            json形式の対応表。キャッシュにない場合はNone
+        """
+        return self.db.get(self.INDEX_KEY)
+
+    @METRICS.timed('memcache.set_sheet_rows')
+    def set_sheet_rows(self, keys: list):
+        """
+        spread sheetに書き込み済みの行を記録する
+
+        Parameters
+        ----------
+        keys : list
+            (日付, 銘柄コード)のリスト
+
+        Raises
+        ------
+        Exception
+            書き込み済みの行のsetに失敗した場合
+        """
+        mapping = {self.__get_sheet_key(key): self.SHEET_SENT for key in keys}
+        is_healthy = self.db.set_multi(mapping, self.SHEET_EXPIRE_TIME)
+        if not is_healthy:
+            raise Exception('Failed set cache.')
+
+    @METRICS.timed('memcache.claim_sheet_rows')
+    def claim_sheet_rows(self, keys: list):
+        """
+        spread sheetに書き込む行を確保する
+
+        書き込み済みの行と同じキーをaddで作るため、他のインスタンスが確保した行や書き込み済みの行は確保できない。
+        書き込む前に終了した場合でも、SHEET_CLAIM_TIMEで確保が切れる。
+
+        Parameters
+        ----------
+        keys : list
+            (日付, 銘柄コード)のリスト
+
+        Returns
+        -------
+        list
+            keysのうち確保できた(日付, 銘柄コード)のリスト
+        """
+        return [key for key in keys
+                if self.db.add(self.__get_sheet_key(key), self.SHEET_CLAIMED, self.SHEET_CLAIM_TIME)]
+
+    @METRICS.timed('memcache.release_sheet_rows')
+    def release_sheet_rows(self, keys: list):
+        """
+        書き込めなかった行の確保を解除する
+
+        Parameters
+        ----------
+        keys : list
+            claim_sheet_rowsで確保した(日付, 銘柄コード)のリスト
+        """
+        for key in keys:
+            self.db.delete(self.__get_sheet_key(key))
+
+    @METRICS.timed('memcache.get_sheet_rows')
+    def get_sheet_rows(self, keys: list):
+        """
+        spread sheetに書き込み済みの行を取得する。claim_sheet_rowsで確保しただけの行は含まない
+
+        Parameters
+        ----------
+        keys : list
+            (日付, 銘柄コード)のリスト
+
+        Returns
+        -------
+        list
+            keysのうち書き込み済みの(日付, 銘柄コード)のリスト
+        """
+        found = self.db.get_multi([self.__get_sheet_key(key) for key in keys])
+        return [key for key in keys if found.get(self.__get_sheet_key(key)) == self.SHEET_SENT]
+
+    def __get_sheet_key(self, key: tuple):
+        """
+        書き込み済みの行のキャッシュのキーの取得
+
+        Parameters
+        ----------
+        key : tuple
+            (日付, 銘柄コード)
+
+        Returns
+        -------
+        str
+            キャッシュのキー
+        """
+        date, code = key
+        return f'{self.SHEET_KEY_PREFIX}{date}:{code}'
+
+    @METRICS.timed('memcache.get_value')
+    def get_value(self, key: str):
+        """
+        値を取得する
+
+        Parameters
+        ----------
+        key : str
+            キー
+
+        Returns
+        -------
+        object
+            値。キャッシュにない場合はNone
+        """
+        return self.db.get(key)
+
+    @METRICS.timed('memcache.add_value')
+    def add_value(self, key: str, value, expire=0):
+        """
+        キーが存在しない場合だけ値をセットする
+
+        Parameters
+        ----------
+        key : str
+            キー
+        value : object
+            値
+        expire : int, optional
+            キャッシュが切れるまでの時間(秒), by default 0 (期限なし)
+
+        Returns
+        -------
+        bool
+            セットできた場合True、キーが既に存在した場合False
+        """
+        return self.db.add(key, value, expire)
+
+    @METRICS.timed('memcache.incr_value')
+    def incr_value(self, key: str, delta=1):
+        """
+        整数の値をアトミックに加算する
+
+        Parameters
+        ----------
+        key : str
+            キー。add_valueなどで整数をセット済みであること
+        delta : int, optional
+            加算する値, by default 1
+
+        Returns
+        -------
+        int
+            加算後の値
+        """
+        return self.db.incr(key, delta)
+
+    @METRICS.timed('memcache.gets_value')
+    def gets_value(self, key: str):
+        """
+        値とCAS値を取得する
+
+        Parameters
+        ----------
+        key : str
+            キー
+
+        Returns
+        -------
+        tuple
+            (値, CAS値)。キャッシュにない場合は(None, None)
+        """
+        return self.db.gets(key)
+
+    @METRICS.timed('memcache.cas_value')
+    def cas_value(self, key: str, value, cas, expire=0):
+        """
+        CAS値が一致する場合だけ値をセットする
+
+        Parameters
+        ----------
+        key : str
+            キー
+        value : object
+            値
+        cas : int
+            gets_valueで取得したCAS値
+        expire : int, optional
+            キャッシュが切れるまでの時間(秒), by default 0 (期限なし)
+
+        Returns
+        -------
+        bool
+            セットできた場合True、他で更新されていた場合False
+        """
+        return self.db.cas(key, value, cas, expire)
+
+    @METRICS.timed('memcache.delete_value')
+    def delete_value(self, key: str, cas=0):
+        """
+        値を削除する
+
+        Parameters
+        ----------
+        key : str
+            キー
+        cas : int, optional
+            gets_valueで取得したCAS値。指定した場合は一致するときだけ削除する, by default 0 (常に削除する)
+
+        Returns
+        -------
+        bool
+            削除した(キーがなかった場合を含む)場合True、CAS値が一致しなかった場合False
+        """
+        return self.db.delete(key, cas)
@@ -0,0 +1,5 @@
+from .client import OutboundClient, CircuitOpenError
+from .policy import TokenBucket, CircuitBreaker, RetryPolicy
+
+__all__ = ['OutboundClient', 'CircuitOpenError',
+           'TokenBucket', 'CircuitBreaker', 'RetryPolicy']
@@ -0,0 +1,181 @@
+"""
+外部APIへのリクエストの送信を制御するクライアント
+
+APIごとにトークンバケットでレートを制限し、失敗したリクエストは待ち時間を伸ばしながら再試行する。
+連続して失敗したAPIはサーキットブレーカーで一定時間止め、その間のリクエストはすぐにCircuitOpenErrorにする。
+クライアントはAPI名ごとにプロセス内で共有する。
+"""
+
+from threading import Lock
+import time
+from metrics import METRICS
+from .policy import TokenBucket, CircuitBreaker, RetryPolicy
+
+
+class CircuitOpenError(Exception):
+    """
+    サーキットブレーカーが開いているためリクエストを送らなかった場合の例外
+
+    Attributes
+    -------
+    name : str
+        API名
+    retry_after : float
+        次にリクエストを通せるまでの時間(秒)
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        name : str
+            API名
+        retry_after : float
+            次にリクエストを通せるまでの時間(秒)
+        """
+        super().__init__(
+            f'Circuit for {name} is open. Retry after {retry_after:.1f}s.')
+        self.name = name
+        self.retry_after = retry_after
+
+
+class OutboundClient:
+    """
+    1つの外部APIへのリクエストをレート制限・再試行・サーキットブレーカー付きで実行するクライアント
+
+    Attributes
+    -------
+    LIMITS : dict
+        API名をキー、(1秒あたりのリクエスト数, 連続して送れるリクエスト数)を値とした辞書
+    DEFAULT_LIMIT : tuple
+        LIMITSにないAPIの(1秒あたりのリクエスト数, 連続して送れるリクエスト数)
+    name : str
+        API名
+    bucket : TokenBucket
+        レート制限
+    breaker : CircuitBreaker
+        サーキットブレーカー
+    retry : RetryPolicy
+        再試行の回数と待ち時間
+    """
+    # 株価APIは上限が公開されていないため実質的に制限せず、スロットリングを受けた場合だけ下げる。
+    # google driveは1ユーザーあたり12000リクエスト/分、spread sheetは書き込み60リクエスト/分の上限
+    LIMITS = {
+        'stock': (1000, 1000),
+        'drive': (200, 200),
+        'sheets': (1, 5),
+    }
+    DEFAULT_LIMIT = (10, 10)
+
+    def __init__(self, name: str, bucket=None, breaker=None, retry=None):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        name : str
+            API名
+        bucket : TokenBucket, optional
+            レート制限, by default None (LIMITSの値)
+        breaker : CircuitBreaker, optional
+            サーキットブレーカー, by default None (既定の設定)
+        retry : RetryPolicy, optional
+            再試行の回数と待ち時間, by default None (既定の設定)
+        """
+        self.name = name
+        self.bucket = bucket if bucket is not None else TokenBucket(
+            *self.LIMITS.get(name, self.DEFAULT_LIMIT))
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.retry = retry if retry is not None else RetryPolicy()
+
+    @classmethod
+    def get_instance(cls, name: str):
+        """
+        API名ごとに共有するクライアントの取得
+
+        Parameters
+        ----------
+        name : str
+            API名
+
+        Returns
+        -------
+        OutboundClient
+            クライアント
+        """
+        with _lock:
+            if name not in _clients:
+                _clients[name] = cls(name)
+            return _clients[name]
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        """
+        リクエストを実行する。再試行すべき例外の場合は待ってから再試行する
+
+        作成・追加のように繰り返すと結果が重複するリクエストは、idempotentをFalseにする。
+        その場合はリクエストが処理されていないことが分かるスロットリング(429とレート超過の403)だけを再試行し、
+        5xx・タイムアウトは処理されたかどうか分からないため再試行せずに例外を投げる。
+
+        Parameters
+        ----------
+        func : callable
+            リクエストを送る関数。再試行ごとに呼び直すため、リクエストの作成から行うこと
+        *args
+            funcの引数
+        idempotent : bool, optional
+            繰り返しても結果が変わらないリクエストかどうか, by default True
+        **kwargs
+            funcのキーワード引数
+
+        Returns
+        -------
+        object
+            funcの戻り値
+
+        Raises
+        ------
+        CircuitOpenError
+            サーキットブレーカーが開いている場合
+        Exception
+            再試行しない例外、または試行回数の上限に達した場合の最後の例外
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow():
+                METRICS.count(f'outbound.{self.name}.rejected')
+                raise CircuitOpenError(self.name, self.breaker.retry_after())
+            waited = self.bucket.acquire()
+            if waited > 0:
+                METRICS.observe(f'outbound.{self.name}.rate_wait', waited)
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                retryable, throttled, retry_after = self.retry.classify(e)
+                if not retryable:
+                    # 404などのリクエスト自体の誤りはAPIの障害として数えない
+                    self.breaker.record_success()
+                    raise
+                if throttled:
+                    self.bucket.throttle()
+                    METRICS.count(f'outbound.{self.name}.throttled')
+                if self.breaker.record_failure():
+                    METRICS.count(f'outbound.{self.name}.circuit_opened')
+                if attempt >= self.retry.max_attempts or not (idempotent or throttled):
+                    raise
+                METRICS.count(f'outbound.{self.name}.retries')
+                delay = self.retry.get_delay(attempt, retry_after)
+                METRICS.observe(f'outbound.{self.name}.backoff', delay)
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            self.bucket.recover()
+            return result
+
+
+_clients = {}
+_lock = Lock()
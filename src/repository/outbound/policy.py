@@ -0,0 +1,386 @@
+from threading import Lock
+import json
+import random
+import time
+
+
+class TokenBucket:
+    """
+    1秒あたりのリクエスト数を制限するトークンバケット
+
+    スロットリング(429)を受けた場合はレートを下げ、成功が続くと元のレートまで少しずつ戻す。
+
+    Attributes
+    -------
+    MIN_RATE_RATIO : float
+        下げたレートの下限(元のレートに対する割合)
+    RECOVERY_RATIO : float
+        成功ごとに戻すレート(元のレートに対する割合)
+    max_rate : float
+        1秒あたりのリクエスト数の上限
+    rate : float
+        現在の1秒あたりのリクエスト数
+    capacity : float
+        溜められるトークン数(連続して送れるリクエスト数)
+    """
+    MIN_RATE_RATIO = 0.05
+    RECOVERY_RATIO = 0.05
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        rate : float
+            1秒あたりのリクエスト数の上限
+        capacity : float, optional
+            溜められるトークン数, by default None (rateと同じ)
+        """
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.__tokens = self.capacity
+        self.__updated = time.monotonic()
+        self.__lock = Lock()
+
+    def acquire(self):
+        """
+        トークンを1つ取得する。トークンがない場合は溜まるまで待つ
+
+        Returns
+        -------
+        float
+            待った時間(秒)
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                self.__refill()
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return waited
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def throttle(self):
+        """
+        スロットリングを受けたため、レートを半分に下げる
+        """
+        with self.__lock:
+            self.__refill()
+            self.rate = max(self.rate / 2, self.max_rate * self.MIN_RATE_RATIO)
+            self.__tokens = min(self.__tokens, 0.0)
+
+    def recover(self):
+        """
+        成功したため、レートを元のレートに近づける
+        """
+        if self.rate >= self.max_rate:
+            return
+        with self.__lock:
+            self.__refill()
+            self.rate = min(self.max_rate, self.rate +
+                            self.max_rate * self.RECOVERY_RATIO)
+
+    def __refill(self):
+        """
+        経過時間分のトークンを足す。ロックを取得してから呼ぶ
+        """
+        now = time.monotonic()
+        self.__tokens = min(self.capacity, self.__tokens +
+                            (now - self.__updated) * self.rate)
+        self.__updated = now
+
+
+class CircuitBreaker:
+    """
+    連続して失敗したAPIへのリクエストを一定時間止めるサーキットブレーカー
+
+    失敗がfailure_thresholdに達すると開き、reset_timeout秒の間はリクエストを通さない。
+    経過後は1つだけ試しに通し、成功すれば閉じ、失敗すれば再び開く。
+
+    Attributes
+    -------
+    CLOSED : str
+        リクエストを通す状態
+    OPEN : str
+        リクエストを止める状態
+    HALF_OPEN : str
+        試しに1つだけ通す状態
+    FAILURE_THRESHOLD : int
+        開くまでの連続失敗数
+    RESET_TIMEOUT : float
+        開いてから試しに通すまでの時間(秒)
+    state : str
+        現在の状態
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    FAILURE_THRESHOLD = 5
+    RESET_TIMEOUT = 30
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        failure_threshold : int, optional
+            開くまでの連続失敗数, by default FAILURE_THRESHOLD
+        reset_timeout : float, optional
+            開いてから試しに通すまでの時間(秒), by default RESET_TIMEOUT
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.__failures = 0
+        self.__opened = None
+        self.__trial = False
+        self.__lock = Lock()
+
+    def allow(self):
+        """
+        リクエストを通してよいかどうか
+
+        Returns
+        -------
+        bool
+            通してよい場合True
+        """
+        with self.__lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.__opened < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.__trial = False
+            # 試しに通すのは1つだけ
+            if self.__trial:
+                return False
+            self.__trial = True
+            return True
+
+    def retry_after(self):
+        """
+        次にリクエストを通せるまでの時間の取得
+
+        Returns
+        -------
+        float
+            時間(秒)。通せる場合は0
+        """
+        with self.__lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.__opened))
+
+    def record_success(self):
+        """
+        成功を記録し、閉じる
+        """
+        with self.__lock:
+            self.state = self.CLOSED
+            self.__failures = 0
+            self.__trial = False
+
+    def record_failure(self):
+        """
+        失敗を記録し、連続失敗数がしきい値に達した場合や試しに通したものが失敗した場合は開く
+
+        Returns
+        -------
+        bool
+            開いた場合True
+        """
+        with self.__lock:
+            self.__failures += 1
+            if self.state == self.HALF_OPEN or self.__failures >= self.failure_threshold:
+                opened = self.state != self.OPEN
+                self.state = self.OPEN
+                self.__opened = time.monotonic()
+                self.__trial = False
+                return opened
+            return False
+
+
+class RetryPolicy:
+    """
+    再試行の回数と待ち時間を決めるクラス
+
+    待ち時間は指数的に伸ばした上限までの一様乱数(full jitter)とし、
+    サーバーがRetry-Afterを返した場合はそれ以上待つ。
+
+    Attributes
+    -------
+    MAX_ATTEMPTS : int
+        最初のリクエストを含めた試行回数の上限
+    BASE_DELAY : float
+        1回目の再試行の待ち時間の上限(秒)
+    MAX_DELAY : float
+        待ち時間の上限(秒)
+    RETRY_STATUSES : set
+        再試行するHTTPステータス
+    THROTTLE_STATUSES : set
+        スロットリングとみなすHTTPステータス
+    THROTTLE_REASONS : set
+        403でもスロットリングとみなすエラーの理由。google driveはユーザー・プロジェクトごとの
+        レート超過を403で返す
+    """
+    MAX_ATTEMPTS = 5
+    BASE_DELAY = 0.5
+    MAX_DELAY = 30
+    RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+    THROTTLE_STATUSES = {429}
+    THROTTLE_REASONS = {'userRateLimitExceeded',
+                        'rateLimitExceeded', 'RATE_LIMIT_EXCEEDED'}
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        max_attempts : int, optional
+            最初のリクエストを含めた試行回数の上限, by default MAX_ATTEMPTS
+        base_delay : float, optional
+            1回目の再試行の待ち時間の上限(秒), by default BASE_DELAY
+        max_delay : float, optional
+            待ち時間の上限(秒), by default MAX_DELAY
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt: int, retry_after: float = None):
+        """
+        再試行までの待ち時間の取得
+
+        Parameters
+        ----------
+        attempt : int
+            失敗した試行の番号(1始まり)
+        retry_after : float, optional
+            サーバーが指定した待ち時間(秒), by default None
+
+        Returns
+        -------
+        float
+            待ち時間(秒)
+        """
+        delay = random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def classify(self, exception: Exception):
+        """
+        例外が再試行すべきものかどうかを判定する
+
+        requestsのHTTPError(response)とgoogleapiclientのHttpError(resp)のステータス、
+        接続・タイムアウトの例外を再試行の対象とする。403はエラーの理由がレート超過の場合だけ
+        スロットリングとして再試行し、権限がないなどそれ以外の403は再試行しない。
+
+        Parameters
+        ----------
+        exception : Exception
+            リクエストで起きた例外
+
+        Returns
+        -------
+        tuple
+            (再試行するかどうか, スロットリングかどうか, Retry-Afterの秒数またはNone)
+        """
+        status, headers = self.__get_status(exception)
+        if status is None:
+            retryable = isinstance(exception, (ConnectionError, TimeoutError)) or \
+                type(exception).__name__ in ('ConnectionError', 'Timeout', 'ConnectTimeout',
+                                             'ReadTimeout', 'ChunkedEncodingError')
+            return retryable, False, None
+        retry_after = self.__parse_retry_after(
+            headers.get('retry-after') or headers.get('Retry-After')) if headers else None
+        if status == 403 and self.__get_reasons(exception) & self.THROTTLE_REASONS:
+            return True, True, retry_after
+        return status in self.RETRY_STATUSES, status in self.THROTTLE_STATUSES, retry_after
+
+    def __get_reasons(self, exception: Exception):
+        """
+        googleapiclientのHttpErrorのレスポンスの本文からエラーの理由を取り出す
+
+        Parameters
+        ----------
+        exception : Exception
+            リクエストで起きた例外
+
+        Returns
+        -------
+        set
+            errors[].reasonとdetails[].reasonの集合。取り出せない場合は空
+        """
+        content = getattr(exception, 'content', None)
+        if not isinstance(content, (bytes, str)):
+            return set()
+        try:
+            error = json.loads(content)['error']
+        except (ValueError, KeyError, TypeError):
+            return set()
+        if not isinstance(error, dict):
+            return set()
+        return {detail.get('reason') for key in ('errors', 'details')
+                for detail in error.get(key) or [] if isinstance(detail, dict)}
+
+    def __get_status(self, exception: Exception):
+        """
+        例外からHTTPステータスとヘッダーを取り出す
+
+        Parameters
+        ----------
+        exception : Exception
+            リクエストで起きた例外
+
+        Returns
+        -------
+        tuple
+            (ステータス, ヘッダー)。HTTPのレスポンスがない場合は(None, None)
+        """
+        # requests.HTTPError
+        response = getattr(exception, 'response', None)
+        if response is not None and hasattr(response, 'status_code'):
+            return response.status_code, response.headers
+        # googleapiclient.errors.HttpError (respはhttplib2.Response。ヘッダーは小文字のキーの辞書)
+        resp = getattr(exception, 'resp', None)
+        if resp is not None and hasattr(resp, 'status'):
+            return int(resp.status), resp
+        return None, None
+
+    def __parse_retry_after(self, value):
+        """
+        Retry-Afterヘッダーを秒数にする
+
+        Parameters
+        ----------
+        value : str
+            秒数またはHTTP日付
+
+        Returns
+        -------
+        float
+            秒数。解釈できない場合はNone
+        """
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
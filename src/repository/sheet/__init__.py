@@ -1,3 +1,4 @@
 from .sheet import SheetAPI
+from .buffer import BufferedSheetAPI
 
-__all__ = ['SheetAPI']
+__all__ = ['SheetAPI', 'BufferedSheetAPI']
@@ -0,0 +1,214 @@
+import json
+import time
+
+
+class BufferedSheetAPI:
+    """
+    google spread sheetへの行追加をまとめて行うAPI
+
+    追加する行を溜めておき、行数か経過時間のしきい値を超えたら1回のappendで書き込む。
+    (日付, 銘柄コード)が同じ行は1度しか書き込まない。
+    キャッシュがある場合、溜めた行は書き込むまでキャッシュにも保存し、書き込みに失敗したり
+    途中で終了したりした行は次の書き込みの際に合わせて書き込む。複数のインスタンスが同時に
+    書き込む場合に同じ行を書き込まないよう、書き込む前に行をキャッシュで確保する。
+
+    Attributes
+    -------
+    MAX_ROWS : int
+        書き込みを行う溜めた行数のしきい値
+    MAX_WAIT : float
+        書き込みを行う最初の行を溜めてからの経過時間(秒)のしきい値
+    PENDING_KEY : str
+        書き込み待ちの行を保存するキャッシュのキー
+    PENDING_EXPIRE_TIME : int
+        書き込み待ちの行が切れるまでの時間(秒)
+    CAS_RETRIES : int
+        書き込み待ちの行の更新が他のインスタンスと競合した場合の試行回数
+    sheet_api : SheetAPI
+        書き込み先のspread sheetのAPI
+    memcache_api : MemcachedAPI
+        書き込み済みの行を記録するキャッシュのAPI。Noneの場合は同じプロセス内でのみ重複を除く
+    """
+    MAX_ROWS = 100
+    MAX_WAIT = 60
+    PENDING_KEY = 'sheet_pending'
+    PENDING_EXPIRE_TIME = 60 * 60 * 24 * 7
+    CAS_RETRIES = 10
+
+    def __init__(self, sheet_api, memcache_api=None, max_rows=MAX_ROWS, max_wait=MAX_WAIT):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        sheet_api : SheetAPI
+            書き込み先のspread sheetのAPI
+        memcache_api : MemcachedAPI, optional
+            書き込み済みの行を記録するキャッシュのAPI, by default None
+        max_rows : int, optional
+            書き込みを行う溜めた行数のしきい値, by default MAX_ROWS
+        max_wait : float, optional
+            書き込みを行う経過時間(秒)のしきい値, by default MAX_WAIT
+        """
+        self.sheet_api = sheet_api
+        self.memcache_api = memcache_api
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.__rows = {}
+        self.__sent = set()
+        self.__first_added = None
+
+    def append(self, cells: list):
+        """
+        行を溜め、しきい値を超えた場合は書き込む
+
+        Parameters
+        ----------
+        cells : list
+            追加する行のリスト。各行の先頭は日付、2番目は銘柄コード
+        """
+        added = []
+        for row in cells:
+            key = self.__get_key(row)
+            if key in self.__sent:
+                continue
+            self.__rows[key] = row
+            added.append(row)
+
+        if added and self.memcache_api is not None:
+            # 呼び出し元が処理済みの位置を進める前に、書き込み待ちの行をキャッシュに残す
+            self.__update_pending(added=added)
+
+        if self.__rows and self.__first_added is None:
+            self.__first_added = time.monotonic()
+
+        if len(self.__rows) >= self.max_rows or self.__is_expired():
+            self.flush()
+
+    def flush(self):
+        """
+        溜めた行と、以前の実行で書き込めなかった行をまとめて書き込む
+
+        Raises
+        ------
+        Exception
+            書き込みに失敗した場合。行は溜めたまま、キャッシュにも残る
+        """
+        if self.memcache_api is not None:
+            value = self.memcache_api.get_value(self.PENDING_KEY)
+            for row in json.loads(value) if value else []:
+                key = self.__get_key(row)
+                if key not in self.__sent:
+                    self.__rows.setdefault(key, row)
+
+        if not self.__rows:
+            return
+
+        keys = list(self.__rows)
+        if self.memcache_api is None:
+            self.sheet_api.append([self.__rows[key] for key in keys])
+        else:
+            # 以前の実行で書き込み済みの行と、他のインスタンスが書き込み中の行は除く
+            claimed = self.memcache_api.claim_sheet_rows(keys)
+            if claimed:
+                try:
+                    self.sheet_api.append([self.__rows[key] for key in claimed])
+                except Exception:
+                    self.memcache_api.release_sheet_rows(claimed)
+                    raise
+                self.memcache_api.set_sheet_rows(claimed)
+            # 確保できなかった行のうち、他のインスタンスが書き込み中の行はそのインスタンスが書き込めなかった
+            # 場合に備えてキャッシュに残し、書き込み済みの行だけキャッシュから除く
+            claimed_keys = set(claimed)
+            sent = self.memcache_api.get_sheet_rows(
+                [key for key in keys if key not in claimed_keys])
+            self.__update_pending(removed=claimed_keys | set(sent))
+            keys = claimed + sent
+
+        self.__sent.update(keys)
+        self.__rows = {}
+        self.__first_added = None
+
+    def __update_pending(self, added=(), removed=()):
+        """
+        キャッシュの書き込み待ちの行を更新する。他のインスタンスと競合した場合はCASで再試行する
+
+        Parameters
+        ----------
+        added : list, optional
+            追加する行のリスト, by default ()
+        removed : set, optional
+            削除する行の(日付, 銘柄コード)の集合, by default ()
+
+        Raises
+        ------
+        Exception
+            競合が続いて更新できなかった場合
+        """
+        for _ in range(self.CAS_RETRIES):
+            self.memcache_api.add_value(
+                self.PENDING_KEY, '[]', self.PENDING_EXPIRE_TIME)
+            value, cas = self.memcache_api.gets_value(self.PENDING_KEY)
+            rows = {self.__get_key(row): row for row in json.loads(value or '[]')}
+            for row in added:
+                rows[self.__get_key(row)] = row
+            for key in removed:
+                rows.pop(key, None)
+            if self.memcache_api.cas_value(self.PENDING_KEY, json.dumps(list(rows.values()), default=self.__to_json),
+                                           cas, self.PENDING_EXPIRE_TIME):
+                return
+        raise Exception('Failed set cache.')
+
+    @staticmethod
+    def __to_json(value):
+        """
+        jsonにできない値の変換。numpyの数値は同じ型のpythonの値にする
+
+        spread sheetに直接書き込む行と同じ値になるよう、真偽値や整数をfloatにしない。
+
+        Parameters
+        ----------
+        value : object
+            変換する値
+
+        Returns
+        -------
+        object
+            jsonにできる値
+
+        Raises
+        ------
+        TypeError
+            変換できない値の場合
+        """
+        if hasattr(value, 'item'):
+            return value.item()
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+    def __is_expired(self):
+        """
+        最初の行を溜めてからしきい値の時間が経過したかどうか
+
+        Returns
+        -------
+        bool
+            経過した場合True
+        """
+        return self.__first_added is not None and \
+            time.monotonic() - self.__first_added >= self.max_wait
+
+    def __get_key(self, row: list):
+        """
+        重複判定に使う行のキーの取得
+
+        Parameters
+        ----------
+        row : list
+            追加する行
+
+        Returns
+        -------
+        tuple
+            (日付, 銘柄コード)
+        """
+        return str(row[0]), str(row[1])
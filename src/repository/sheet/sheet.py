@@ -1,5 +1,6 @@
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
+from ..google import GoogleClientFactory
+from ..outbound import OutboundClient
+from metrics import METRICS
 
 
 """
@@ -22,7 +23,9 @@ class SheetAPI:
     file_key : str
         google driveのフォルダーのキー
     service : service
-        gcpのサービスアカウント
+        gcpのサービスアカウント。他のクライアントと認証情報・HTTP接続を共有する
+    outbound : OutboundClient
+        レート制限・再試行を行うクライアント
     """
 
     def __init__(self, service_account_key_path: str, sheet_id: str):
@@ -39,13 +42,28 @@ class SheetAPI:
         self.GOOGLE_PATH = 'https://www.googleapis.com/auth/drive.file'
         self.GOOGLE_SHEET_PATH = 'https://spreadsheets.google.com/feeds'
         self.KEY_FILE = service_account_key_path
-        self.service = self.__get_google_service()
         self.SHEET_ID = '1MetA2G9ifOZLecWjQ-Lu-P4NGMCb0UBiy2VMXS_edlM'
+        self.outbound = OutboundClient.get_instance('sheets')
 
+    @property
+    def service(self):
+        """
+        gcpのサービスアカウントの取得。最初に使うときに作成し、以降は共有したものを返す
+
+        Returns
+        -------
+        service
+            サービスアカウントクラス
+        """
+        return self.__get_google_service()
+
+    @METRICS.timed('sheet.append')
     def append(self, cells: list):
         """
         google spread sheetに行追加
 
+        再試行すると行が重複して追加されるため、5xx・タイムアウトは再試行せずに例外を投げる。
+
         Parameters
         ----------
         text : str
@@ -54,9 +72,12 @@ class SheetAPI:
         body = {
             'values': cells
         }
-        self.service.spreadsheets().values().append(
-            spreadsheetId=self.SHEET_ID, range='A1',
-            valueInputOption='USER_ENTERED', body=body, insertDataOption='INSERT_ROWS').execute()
+        METRICS.count('sheet.rows', len(cells))
+        self.outbound.call(
+            lambda: self.service.spreadsheets().values().append(
+                spreadsheetId=self.SHEET_ID, range='A1',
+                valueInputOption='USER_ENTERED', body=body, insertDataOption='INSERT_ROWS').execute(),
+            idempotent=False)
 
     def __get_google_service(self):
         """
@@ -67,9 +88,5 @@ class SheetAPI:
         service
             サービスアカウントクラス
         """
-        scope = [self.GOOGLE_SHEET_PATH, self.GOOGLE_PATH]
-        keyFile = self.KEY_FILE
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
-            keyFile, scopes=scope)
-
-        return build("sheets", "v4", credentials=credentials, cache_discovery=False)
+        factory = GoogleClientFactory.get_instance(self.KEY_FILE)
+        return factory.get_service("sheets", "v4")
@@ -1,3 +1,5 @@
 from .stock import StockAPI
+from .cache import StockCache
+from .parser import parse_stock_csv, concat_columns
 
-__all__ = ['StockAPI']
+__all__ = ['StockAPI', 'StockCache', 'parse_stock_csv', 'concat_columns']
@@ -0,0 +1,270 @@
+from threading import Lock
+import math
+import os
+import time
+from metrics import METRICS
+
+
+class StockCache:
+    """
+    確定した過去年の株価csvをローカルに保存するキャッシュ
+
+    株式分割があると過去年の終値調整も変わるため、保存からMAX_AGE秒を過ぎたものは使わない。
+    また、今年の株価の終値調整と終値の比が前回と変わった銘柄は過去年のキャッシュを削除する。
+
+    Attributes
+    -------
+    MAX_BYTES : int
+        キャッシュの合計サイズの上限(バイト)
+    MAX_AGE : float
+        保存してからキャッシュを使う期間(秒)
+    SUFFIX : str
+        キャッシュファイルの拡張子
+    RATIO_SUFFIX : str
+        終値調整と終値の比を保存するファイルの拡張子
+    RATIO_TOLERANCE : float
+        比が変わったとみなす相対誤差
+    directory : str
+        キャッシュを保存するディレクトリ
+    max_bytes : int
+        キャッシュの合計サイズの上限(バイト)
+    max_age : float
+        保存してからキャッシュを使う期間(秒)
+    hits : int
+        キャッシュヒット数
+    misses : int
+        キャッシュミス数
+    """
+    MAX_BYTES = 256 * 1024 * 1024
+    MAX_AGE = 30 * 24 * 60 * 60
+    SUFFIX = '.csv'
+    RATIO_SUFFIX = '.ratio'
+    RATIO_TOLERANCE = 1e-6
+
+    def __init__(self, directory: str, max_bytes=MAX_BYTES, max_age=MAX_AGE):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        directory : str
+            キャッシュを保存するディレクトリ
+        max_bytes : int, optional
+            キャッシュの合計サイズの上限(バイト), by default MAX_BYTES
+        max_age : float, optional
+            保存してからキャッシュを使う期間(秒), by default MAX_AGE
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.__lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.__total_bytes = sum(size for _, size, _ in self.__scan())
+
+    def get(self, code: str, year: str, raw=False):
+        """
+        キャッシュから株価を取得する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        year : str
+            取得する年(西暦)
+        raw : bool, optional
+            デコードせずにバイト列で返す, by default False
+
+        Returns
+        -------
+        str or bytes
+            csvフォーマットの株価情報。キャッシュにない場合はNone
+        """
+        path = self.__get_path(code, year)
+        with self.__lock:
+            try:
+                written = os.stat(path).st_mtime
+                if time.time() - written > self.max_age:
+                    # 期限切れのものは削除し、APIから取得し直す
+                    self.__remove(path)
+                    raise FileNotFoundError(path)
+                if raw:
+                    with open(path, 'rb') as f:
+                        text = f.read()
+                else:
+                    with open(path, encoding='utf8', errors='replace') as f:
+                        text = f.read()
+            except FileNotFoundError:
+                self.misses += 1
+                METRICS.hit('stock_cache', False)
+                return None
+            # 最終アクセス日時だけを更新し、LRUの順序に反映する。更新日時は保存した日時のまま残す
+            os.utime(path, (time.time(), written))
+            self.hits += 1
+            METRICS.hit('stock_cache', True)
+            return text
+
+    def put(self, code: str, year: str, text: str):
+        """
+        株価をキャッシュに保存し、上限を超えた分を古い順に削除する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        year : str
+            取得する年(西暦)
+        text : str or bytes
+            csvフォーマットの株価情報。バイト列の場合はそのまま保存する
+        """
+        path = self.__get_path(code, year)
+        tmp_path = f'{path}.tmp'
+        with self.__lock:
+            if isinstance(text, bytes):
+                with open(tmp_path, 'wb') as f:
+                    f.write(text)
+            else:
+                with open(tmp_path, 'w', encoding='utf8') as f:
+                    f.write(text)
+            if os.path.exists(path):
+                self.__total_bytes -= os.path.getsize(path)
+            self.__total_bytes += os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+
+            if self.__total_bytes > self.max_bytes:
+                self.__evict()
+
+    def purge(self, code: str):
+        """
+        銘柄のキャッシュを全て削除する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        """
+        with self.__lock:
+            self.__purge(code)
+
+    def validate(self, code: str, ratio: float):
+        """
+        今年の株価の終値調整と終値の比を前回と比べ、変わっていれば銘柄のキャッシュを削除する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        ratio : float
+            今年の最初の日の終値調整と終値の比
+
+        Returns
+        -------
+        bool
+            比が変わり、キャッシュを削除した場合True
+        """
+        path = os.path.join(self.directory, f'{code}{self.RATIO_SUFFIX}')
+        with self.__lock:
+            try:
+                with open(path) as f:
+                    stored = float(f.read())
+            except (FileNotFoundError, ValueError):
+                stored = None
+            if stored is not None and math.isclose(stored, ratio, rel_tol=self.RATIO_TOLERANCE):
+                return False
+
+            changed = stored is not None
+            if changed:
+                self.__purge(code)
+            with open(path, 'w') as f:
+                f.write(repr(ratio))
+            return changed
+
+    def hit_ratio(self):
+        """
+        キャッシュヒット率の取得
+
+        Returns
+        -------
+        float
+            キャッシュヒット率。参照がない場合は0
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def __evict(self):
+        """
+        合計サイズが上限に収まるまで、最終アクセスが古いファイルから削除する
+        """
+        for _, size, path in sorted(self.__scan()):
+            if self.__total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            self.__total_bytes -= size
+
+    def __purge(self, code: str):
+        """
+        銘柄のキャッシュファイルを全て削除する。ロックを取得してから呼ぶ
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        """
+        prefix = f'{code}_'
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(prefix) and entry.name.endswith(self.SUFFIX):
+                self.__remove(entry.path)
+        ratio_path = os.path.join(self.directory, f'{code}{self.RATIO_SUFFIX}')
+        if os.path.exists(ratio_path):
+            os.remove(ratio_path)
+
+    def __remove(self, path: str):
+        """
+        キャッシュファイルを削除する。ロックを取得してから呼ぶ
+
+        Parameters
+        ----------
+        path : str
+            キャッシュファイルのパス
+        """
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.__total_bytes -= size
+
+    def __scan(self):
+        """
+        キャッシュファイルの一覧を取得する
+
+        Returns
+        -------
+        list
+            (最終アクセス日時, サイズ, パス)のリスト
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+        return entries
+
+    def __get_path(self, code: str, year: str):
+        """
+        キャッシュファイルのパスの取得
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        year : str
+            取得する年(西暦)
+
+        Returns
+        -------
+        str
+            キャッシュファイルのパス
+        """
+        return os.path.join(self.directory, f'{code}_{year}{self.SUFFIX}')
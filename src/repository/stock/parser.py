@@ -0,0 +1,154 @@
+from io import BytesIO
+import numpy as np
+
+"""
+株価APIのレスポンス(ヘッダー2行 + 日付,始値,高値,安値,終値,出来高,終値調整)を
+文字列を経由せずに型付きの列の配列にするパーサー
+"""
+
+COLUMNS = ('date', 'open', 'high', 'low', 'closing', 'volume', 'closed_adj')
+DTYPES = {
+    'date': np.int32,
+    'open': np.float32,
+    'high': np.float32,
+    'low': np.float32,
+    'closing': np.float32,
+    'volume': np.int64,
+    'closed_adj': np.float64,
+}
+# 出来高は欠損(空欄)があっても読めるようにfloatで読み、欠損を0にしてから整数にする
+READ_DTYPES = dict(DTYPES, volume=np.float64)
+HEADER_LINES = 2
+NEWLINE = ord('\n')
+ZERO = ord('0')
+
+
+def parse_stock_csv(data: bytes):
+    """
+    1年分のレスポンスを列ごとの配列にする
+
+    日付(YYYY-MM-DD)は行頭の固定位置のバイトから直接計算し、数値はpandasのCパーサーで
+    型を指定して読むため、行や値ごとの文字列を作らない。
+
+    Parameters
+    ----------
+    data : bytes
+        株価APIのレスポンスのバイト列
+
+    Returns
+    -------
+    dict
+        カラム名と配列の辞書。日付は1970-01-01からの経過日数(int32)。
+        欠損は価格の列はNaN、出来高は0
+
+    Raises
+    ------
+    Exception
+        日付と数値の行数が一致しない場合
+    """
+    if isinstance(data, str):
+        data = data.encode('utf8')
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buffer == NEWLINE)
+    if len(newlines) < HEADER_LINES:
+        return empty_columns()
+    starts = newlines[HEADER_LINES - 1:] + 1
+    starts = starts[starts + len('YYYY-MM-DD') <= len(buffer)]
+    # 空行(行頭が数字でない行)は読み飛ばす
+    starts = starts[(buffer[starts] >= ZERO) & (buffer[starts] <= ZERO + 9)]
+    if len(starts) == 0:
+        return empty_columns()
+
+    dates = _parse_dates(buffer, starts)
+
+    # 起動時に読み込まないよう、最初にパースするときにimportする
+    import pandas as pd
+
+    # ヘッダーはShift_JISの場合があるため、コピーせずに読み込み位置をデータ行の先頭に進める
+    stream = BytesIO(data)
+    stream.seek(newlines[HEADER_LINES - 1] + 1)
+    values = pd.read_csv(
+        stream, header=None, names=COLUMNS,
+        usecols=COLUMNS[1:], dtype={name: READ_DTYPES[name] for name in COLUMNS[1:]},
+        engine='c')
+    if len(values) != len(dates):
+        raise Exception('Failed to parse stock csv.')
+
+    columns = {'date': dates}
+    for name in COLUMNS[1:]:
+        columns[name] = values[name].to_numpy()
+    columns['volume'] = np.nan_to_num(
+        columns['volume'], nan=0.0).astype(DTYPES['volume'])
+    return columns
+
+
+def concat_columns(parts: list):
+    """
+    年ごとの配列を1回のコピーで結合し、日付順に並べる
+
+    Parameters
+    ----------
+    parts : list
+        parse_stock_csvの結果のリスト
+
+    Returns
+    -------
+    dict
+        カラム名と日付順の配列の辞書
+    """
+    parts = [part for part in parts if len(part['date']) > 0]
+    if not parts:
+        return empty_columns()
+    # 年の古い順に並べてから結合すれば、通常は並べ替えが不要になる
+    parts.sort(key=lambda part: part['date'][0])
+
+    columns = {name: np.concatenate([part[name] for part in parts])
+               for name in COLUMNS}
+    dates = columns['date']
+    if np.any(dates[1:] <= dates[:-1]):
+        _, order = np.unique(dates, return_index=True)
+        columns = {name: values[order] for name, values in columns.items()}
+    return columns
+
+
+def empty_columns():
+    """
+    行のない列の配列の取得
+
+    Returns
+    -------
+    dict
+        カラム名と長さ0の配列の辞書
+    """
+    return {name: np.empty(0, dtype=DTYPES[name]) for name in COLUMNS}
+
+
+def _parse_dates(buffer: np.ndarray, starts: np.ndarray):
+    """
+    行頭のYYYY-MM-DDのバイトから経過日数を計算する
+
+    Parameters
+    ----------
+    buffer : np.ndarray
+        レスポンスのバイト列
+    starts : np.ndarray
+        データ行の先頭位置
+
+    Returns
+    -------
+    np.ndarray
+        1970-01-01からの経過日数(int32)
+    """
+    def digits(offset, width):
+        value = np.zeros(len(starts), dtype=np.int64)
+        for i in range(width):
+            value = value * 10 + (buffer[starts + offset + i] - ZERO)
+        return value
+
+    years = digits(0, 4)
+    months = digits(5, 2)
+    days = digits(8, 2)
+    first_days = ((years - 1970) * 12 + months - 1).astype(
+        'datetime64[M]').astype('datetime64[D]')
+    return (first_days.astype(np.int64) + days - 1).astype(np.int32)
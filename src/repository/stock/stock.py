@@ -1,4 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+from datetime import date
 import requests
+from requests.adapters import HTTPAdapter
+from metrics import METRICS
+from ..outbound import OutboundClient
 
 
 class StockAPI:
@@ -11,40 +18,267 @@ class StockAPI:
         APIのエンドポイント
     header : str
         リクエストに付与するヘッダー
+    MAX_CONCURRENCY : int
+        ホストごとの同時リクエスト数の上限
+    session : requests.Session
+        コネクションを使い回すためのセッション
+    outbound : OutboundClient
+        レート制限・再試行を行うクライアント
+    cache : StockCache
+        確定した過去年の株価のキャッシュ。Noneの場合はキャッシュしない
     """
+    MAX_CONCURRENCY = 4
 
-    def __init__(self, path):
+    def __init__(self, path, max_concurrency=MAX_CONCURRENCY, cache=None):
         """
         コンストラクタ
+
+        Parameters
+        ----------
+        path : str
+            APIのエンドポイント
+        max_concurrency : int, optional
+            ホストごとの同時リクエスト数の上限, by default MAX_CONCURRENCY
+        cache : StockCache, optional
+            確定した過去年の株価のキャッシュ, by default None
         """
         self.KABUOJI_PATH = path
         self.HEADER = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/56.0.2924.76 Safari/537.36'}
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.outbound = OutboundClient.get_instance('stock')
+        self.session = self.__get_session()
+        self.__host_semaphores = {}
+        self.__lock = Lock()
 
-    def fetch_stock(self, code: str, year: str):
+    @METRICS.timed('stock.fetch_stock')
+    def fetch_stock(self, code: str, year: str, raw=False):
         """
         リクエストを投げて株価を取得する
 
+        確定した過去年の株価はキャッシュがあればキャッシュから返す。
+        今年の株価を取得した場合は、株式分割で終値調整が変わっていないかキャッシュに確認させる。
+
         Parameters
         ----------
         code : str
             銘柄コード
         year : str
             取得する年(西暦)
+        raw : bool, optional
+            デコードせずにレスポンスのバイト列を返す, by default False
 
         Returns
         -------
-        str
+        str or bytes
             csvフォーマットの株価情報
         """
+        cacheable = self.cache is not None and self.__is_closed_year(year)
+        if cacheable:
+            text = self.cache.get(code, year, raw=raw)
+            if text is not None:
+                return text
+
         payload = self.__get_payload(code, year)
+        r = self.outbound.call(self.__post, payload)
+        METRICS.count('stock.requests')
+        METRICS.count('stock.bytes', len(r.content))
+
+        text = r.content if raw else r.text
+        if cacheable:
+            self.cache.put(code, year, text)
+        elif self.cache is not None and self.__is_current_year(year):
+            ratio = self.__get_adjust_ratio(r.content)
+            if ratio is not None and self.cache.validate(code, ratio):
+                METRICS.count('stock_cache.invalidated')
+
+        return text
+
+    def fetch_stocks(self, targets: list, raw=False, return_exceptions=False):
+        """
+        複数の(銘柄コード, 年)の株価を並行して取得し、取得できた順に返す
+
+        キャッシュがある場合、今年も取得する銘柄の過去年は、今年の株価で株式分割を確認してから取得する。
+
+        Parameters
+        ----------
+        targets : list
+            (銘柄コード, 取得する年)のタプルのリスト
+        raw : bool, optional
+            デコードせずにレスポンスのバイト列を返す, by default False
+        return_exceptions : bool, optional
+            失敗したリクエストは例外を送出せず、株価情報の代わりに例外を返して残りの取得を続ける, by default False
+
+        Yields
+        -------
+        tuple
+            (銘柄コード, 取得する年, csvフォーマットの株価情報または例外)
+
+        Raises
+        ------
+        requests.HTTPError
+            return_exceptionsがFalseで、いずれかのリクエストが失敗した場合
+        """
+        if not targets:
+            return
+
+        held = {}
+        if self.cache is not None:
+            current = {code for code, year in targets if self.__is_current_year(year)}
+            for code, year in targets:
+                if code in current and self.__is_closed_year(year):
+                    held.setdefault(code, []).append(year)
+
+        workers = min(self.max_concurrency, len(targets))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.fetch_stock, code, year, raw): (code, year)
+                for code, year in targets if year not in held.get(code, ())}
+            try:
+                while futures:
+                    completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        code, year = futures.pop(future)
+                        try:
+                            text = future.result()
+                        except Exception as e:
+                            if not return_exceptions:
+                                raise
+                            text = e
+                        if self.__is_current_year(year):
+                            for closed_year in held.pop(code, []):
+                                futures[executor.submit(
+                                    self.fetch_stock, code, closed_year, raw)] = (code, closed_year)
+                        yield code, year, text
+            finally:
+                for future in futures:
+                    future.cancel()
 
-        r = requests.post(self.KABUOJI_PATH, data=payload,
-                          headers=self.HEADER)
+    def close(self):
+        """
+        セッションを閉じる
+        """
+        self.session.close()
+
+    def __post(self, payload: dict):
+        """
+        リクエストを1回送る
+
+        Parameters
+        ----------
+        payload : dict
+            POSTパラメータ
 
+        Returns
+        -------
+        requests.Response
+            レスポンス
+
+        Raises
+        ------
+        requests.HTTPError
+            ステータスがエラーの場合
+        """
+        # 再試行の待ちの間はセマフォを持たない
+        with self.__get_host_semaphore(self.KABUOJI_PATH):
+            r = self.session.post(self.KABUOJI_PATH, data=payload,
+                                  headers=self.HEADER)
         r.raise_for_status()
+        return r
+
+    def __get_session(self):
+        """
+        コネクションプールを持つセッションの取得
+
+        Returns
+        -------
+        requests.Session
+            セッション
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def __get_host_semaphore(self, url: str):
+        """
+        ホストごとの同時リクエスト数を制限するセマフォの取得
+
+        Parameters
+        ----------
+        url : str
+            リクエスト先のURL
+
+        Returns
+        -------
+        BoundedSemaphore
+            ホストに紐づくセマフォ
+        """
+        host = urlsplit(url).netloc
+        with self.__lock:
+            if host not in self.__host_semaphores:
+                self.__host_semaphores[host] = BoundedSemaphore(
+                    self.max_concurrency)
+            return self.__host_semaphores[host]
+
+    def __is_closed_year(self, year: str):
+        """
+        株価が確定した過去年かどうか
+
+        Parameters
+        ----------
+        year : str
+            取得する年(西暦)
+
+        Returns
+        -------
+        bool
+            今年より前の年の場合True
+        """
+        return int(year) < date.today().year
 
-        return r.text
+    def __is_current_year(self, year: str):
+        """
+        今年かどうか
+
+        Parameters
+        ----------
+        year : str
+            取得する年(西暦)
+
+        Returns
+        -------
+        bool
+            今年の場合True
+        """
+        return int(year) == date.today().year
+
+    def __get_adjust_ratio(self, data: bytes):
+        """
+        最初の日の終値調整と終値の比の取得
+
+        Parameters
+        ----------
+        data : bytes
+            株価APIのレスポンスのバイト列
+
+        Returns
+        -------
+        float
+            終値調整 / 終値。行がない・解釈できない場合はNone
+        """
+        lines = data.split(b'\n', 3)
+        if len(lines) < 3:
+            return None
+        # 日付,始値,高値,安値,終値,出来高,終値調整
+        values = lines[2].split(b',')
+        try:
+            closing, closed_adj = float(values[4]), float(values[6])
+        except (IndexError, ValueError):
+            return None
+        return closed_adj / closing if closing > 0 else None
 
     def __get_payload(self, code: str, year: str):
         """
@@ -1,20 +1,29 @@
-import pandas as pd
+import numpy as np
 
 
 class StockListAPI:
     """
     株価リストをローカル取得するAPI
 
+    銘柄コードはcsvと同じ順(実行順)の整数配列で持ち、銘柄コードから位置への変換は
+    昇順に並べた別の配列の二分探索で行うため、辞書を作らずに済む。
+    業種分類はカテゴリの番号の配列、銘柄名は文字列の配列で持つ。
+    銘柄コードは数字のみとし、英字を含む銘柄コードは読み込み時に例外にする。
+
     Attributes
     -------
     CODE_COLUMN : str
         CSVの銘柄が記載されたカラム
-    first_code : str
-        実行する最初の銘柄コード
-    queue : dict
-        銘柄コードの実行待ち順。銘柄コードに入力した際に、次回実行する銘柄コードが出力される。
-    stock_info : dict
-        銘柄コードに紐づく情報(銘柄名、業種分布)
+    SNAPSHOT_SUFFIX : str
+        pandasを使わずに読み込める事前変換済みファイルの拡張子
+    codes : np.ndarray
+        実行順(csvの順)の銘柄コード
+    names : np.ndarray
+        銘柄コードと同じ順の銘柄名
+    biz_types : np.ndarray
+        業種分類の一覧
+    biz_type_ids : np.ndarray
+        銘柄コードと同じ順の業種分類の番号(biz_typesの位置)
     """
     CODE_COLUMN = '銘柄コード'
     CODE_NAME = '銘柄名'
@@ -22,6 +31,7 @@ class StockListAPI:
     INFO_COLUMNS = ['銘柄名', '業種分類']
     BIZ_TYPE_FILTER = ['情報・通信', '倉庫・運輸関連業',
                        'その他製品', '医薬品', '精密機器', '建設業', 'サービス業']
+    SNAPSHOT_SUFFIX = '.npz'
 
     def __init__(self, filepath: str, filter_mode=False):
         """
@@ -30,44 +40,68 @@ class StockListAPI:
         Parameters
         ----------
         filepath : str
-            ローカルのcsvファイルのパス
+            ローカルのcsvファイル、またはsave_snapshotで保存したファイルのパス
         filter_mode: bool
             業種フィルタの有無
-        """
 
-        df = pd.read_csv(filepath)
+        Raises
+        ------
+        Exception
+            数字以外を含む銘柄コードがある場合
+        """
+        if filepath.endswith(self.SNAPSHOT_SUFFIX):
+            codes, names, biz_types, biz_type_ids = self.__load_snapshot(
+                filepath)
+        else:
+            codes, names, biz_types, biz_type_ids = self.__load_csv(filepath)
 
         if filter_mode:
-            df = df[df[self.BIZ_TYPE].isin(self.BIZ_TYPE_FILTER)]
+            targets = np.flatnonzero(np.isin(biz_types, self.BIZ_TYPE_FILTER))
+            mask = np.isin(biz_type_ids, targets)
+            codes, names, biz_type_ids = codes[mask], names[mask], biz_type_ids[mask]
 
-        stocks = df[self.CODE_COLUMN].tolist()
-        self.__first_code = stocks[0]
-        self.__queue = self.__get_stock_queue(stocks)
-        self.__stock_info = self.__get_stock_info(df)
+        self.codes = codes
+        self.names = names
+        self.biz_types = biz_types
+        self.biz_type_ids = biz_type_ids
+        # 位置の検索用に、昇順に並べた銘柄コードとcsvでの位置を持つ
+        self.__order = np.argsort(codes, kind='stable')
+        self.__sorted_codes = codes[self.__order]
 
-    def __get_stock_queue(self, stocks: list):
+    def save_snapshot(self, filepath: str):
         """
-        銘柄コードの実行待ち順を取得する。
+        読み込んだ株価リストをpandasなしで読み込める形式で保存する
 
         Parameters
         ----------
-        stocks : list
-            csvから取得した銘柄コード情報
+        filepath : str
+            保存先のファイルパス(拡張子はSNAPSHOT_SUFFIX)
+        """
+        np.savez(filepath, codes=self.codes, names=self.names,
+                 biz_types=self.biz_types, biz_type_ids=self.biz_type_ids)
+
+    def get_next_code(self, code: str):
+        """
+        次回実行する銘柄コードを取得する。
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
 
         Returns
         -------
-        dict
-            銘柄コードの実行待ち順
+        str
+            次回実行する銘柄コード。リストにない銘柄コードの場合はNone
         """
-        queue = {}
-        for i in range(len(stocks) - 1):
-            queue[stocks[i]] = stocks[i + 1]
-        queue[stocks[-1]] = stocks[0]
-        return queue
+        position = self.get_position(code)
+        if position is None:
+            return None
+        return int(self.codes[(position + 1) % len(self.codes)])
 
-    def get_next_code(self, code: str):
+    def get_prev_code(self, code: str):
         """
-        次回実行する銘柄コードを取得する。
+        前回実行した銘柄コードを取得する。
 
         Parameters
         ----------
@@ -77,12 +111,35 @@ class StockListAPI:
         Returns
         -------
         str
-            次回実行する銘柄コード
+            前回実行した銘柄コード。リストにない銘柄コードの場合はNone
         """
-        if code in self.__queue:
-            return self.__queue[code]
-        else:
+        position = self.get_position(code)
+        if position is None:
+            return None
+        return int(self.codes[position - 1])
+
+    def get_position(self, code: str):
+        """
+        銘柄コードの実行順の位置を取得する。
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        int
+            位置。リストにない銘柄コードの場合はNone
+        """
+        try:
+            code = int(code)
+        except (TypeError, ValueError):
             return None
+        i = int(np.searchsorted(self.__sorted_codes, code))
+        if i >= len(self.__sorted_codes) or self.__sorted_codes[i] != code:
+            return None
+        return int(self.__order[i])
 
     def get_first_code(self):
         """
@@ -93,23 +150,36 @@ class StockListAPI:
         str
             first_code
         """
-        return self.__first_code
+        return int(self.codes[0])
 
-    def __get_stock_info(self, df: pd.DataFrame):
+    def get_codes(self, start=0, stop=None):
         """
-        株価情報の辞書を作成する
+        実行順の銘柄コードを範囲指定で取得する。
 
         Parameters
         ----------
-        df : pd.DataFrame
-            pandasのDataFrame
+        start : int, optional
+            開始位置, by default 0
+        stop : int, optional
+            終了位置(含まない), by default None (最後まで)
 
         Returns
         -------
-        dict
-            銘柄コードに紐づいた情報
+        list
+            銘柄コードのリスト
         """
-        return df.set_index(self.CODE_COLUMN).loc[:, self.INFO_COLUMNS].to_dict(orient='index')
+        return self.codes[start:stop].tolist()
+
+    def get_size(self):
+        """
+        銘柄数の取得。
+
+        Returns
+        -------
+        int
+            銘柄数
+        """
+        return len(self.codes)
 
     def get_stock_info_by_code(self, code: str):
         """
@@ -122,7 +192,72 @@ class StockListAPI:
 
         Returns
         -------
-        str
-            銘柄情報
+        dict
+            銘柄情報(銘柄名、業種分類)
+
+        Raises
+        ------
+        KeyError
+            リストにない銘柄コードの場合
+        """
+        position = self.get_position(code)
+        if position is None:
+            raise KeyError(code)
+        return {
+            self.CODE_NAME: str(self.names[position]),
+            self.BIZ_TYPE: str(self.biz_types[self.biz_type_ids[position]]),
+        }
+
+    def __load_csv(self, filepath: str):
+        """
+        csvファイルから株価リストを読み込む
+
+        Parameters
+        ----------
+        filepath : str
+            ローカルのcsvファイルのパス
+
+        Returns
+        -------
+        tuple
+            (銘柄コード, 銘柄名, 業種分類の一覧, 業種分類の番号)
+
+        Raises
+        ------
+        Exception
+            数字以外を含む銘柄コードがある場合
+        """
+        # 事前変換済みファイルを使う場合はpandasを読み込まずに済むよう、ここでimportする
+        import pandas as pd
+
+        df = pd.read_csv(filepath, usecols=[
+                         self.CODE_COLUMN] + self.INFO_COLUMNS, dtype={self.CODE_COLUMN: str})
+        codes = df[self.CODE_COLUMN].str.strip()
+        invalid = codes[~codes.str.fullmatch('[0-9]+', na=False)]
+        if len(invalid) > 0:
+            raise Exception(f'Invalid stock code: {invalid.iloc[0]}')
+        biz_type = df[self.BIZ_TYPE].astype('category')
+        return (
+            codes.to_numpy().astype(np.int64),
+            df[self.CODE_NAME].to_numpy(dtype=str),
+            biz_type.cat.categories.to_numpy(dtype=str),
+            biz_type.cat.codes.to_numpy(dtype=np.int16),
+        )
+
+    def __load_snapshot(self, filepath: str):
+        """
+        save_snapshotで保存したファイルから株価リストを読み込む
+
+        Parameters
+        ----------
+        filepath : str
+            ローカルのファイルパス
+
+        Returns
+        -------
+        tuple
+            (銘柄コード, 銘柄名, 業種分類の一覧, 業種分類の番号)
         """
-        return self.__stock_info[code]
+        with np.load(filepath) as snapshot:
+            return (snapshot['codes'], snapshot['names'],
+                    snapshot['biz_types'], snapshot['biz_type_ids'])
@@ -0,0 +1,3 @@
+from .price_store import PriceStoreAPI
+
+__all__ = ['PriceStoreAPI']
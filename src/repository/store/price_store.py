@@ -0,0 +1,370 @@
+import numpy as np
+import os
+from metrics import METRICS
+from ..stock.parser import DTYPES
+
+
+class PriceStoreAPI:
+    """
+    株価を銘柄・年ごとに列指向のファイルでローカル保存するAPI
+
+    {directory}/{銘柄コード}/{年}.npz に列ごとの配列を保存する。
+    日付は1970-01-01からの経過日数(int32)で保持する。
+    型はパーサー(parse_stock_csv)の型のまま保存し、始値・高値・安値・終値はfloat32、終値調整はfloat64とする。
+    以前の型で保存したファイルは、読み込み時にschemaの型にそろえる。
+
+    Attributes
+    -------
+    SCHEMA : dict
+        カラム名と型
+    DATE_COLUMN : str
+        日付のカラム名
+    SUFFIX : str
+        ファイルの拡張子
+    directory : str
+        保存先のディレクトリ
+    schema : dict
+        保存するカラム名と型。日付のカラムを含む
+    """
+    SCHEMA = dict(DTYPES)
+    DATE_COLUMN = 'date'
+    SUFFIX = '.npz'
+
+    def __init__(self, directory: str, schema=None):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        directory : str
+            保存先のディレクトリ
+        schema : dict, optional
+            保存するカラム名と型, by default None (SCHEMA)
+        """
+        self.directory = directory
+        self.schema = dict(schema) if schema is not None else dict(self.SCHEMA)
+        os.makedirs(directory, exist_ok=True)
+
+    @METRICS.timed('store.write')
+    def write(self, code: str, columns: dict):
+        """
+        株価を追記する。同じ日付の行がある場合は新しい値で上書きする。
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        columns : dict
+            カラム名と配列の辞書。schemaの全カラムを含む
+        """
+        columns = self.__cast(columns)
+        years = self.__to_years(columns[self.DATE_COLUMN])
+
+        for year in np.unique(years):
+            mask = years == year
+            rows = {name: values[mask] for name, values in columns.items()}
+            existing = self.__load(code, int(year))
+            if existing is not None:
+                rows = self.__merge(existing, rows)
+            self.__save(code, int(year), rows)
+
+    @METRICS.timed('store.read')
+    def read(self, code: str, start=None, end=None, columns=None):
+        """
+        株価を読み込む。期間外の年のファイルは読まない。
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        start : str, optional
+            開始日(YYYY-MM-DD, 境界を含む), by default None
+        end : str, optional
+            終了日(YYYY-MM-DD, 境界を含む), by default None
+        columns : list, optional
+            読み込むカラム, by default None (全カラム)
+
+        Returns
+        -------
+        dict
+            カラム名と日付順の配列の辞書
+        """
+        names = list(self.schema) if columns is None else list(columns)
+        start_day = self.__to_day(start)
+        end_day = self.__to_day(end)
+
+        parts = {name: [] for name in names}
+        for year in self.get_years(code):
+            if start_day is not None and year < int(self.__to_years(start_day)):
+                continue
+            if end_day is not None and year > int(self.__to_years(end_day)):
+                continue
+
+            with np.load(self.__get_path(code, year)) as npz:
+                dates = npz[self.DATE_COLUMN]
+                lo = 0 if start_day is None else np.searchsorted(
+                    dates, start_day, side='left')
+                hi = len(dates) if end_day is None else np.searchsorted(
+                    dates, end_day, side='right')
+                for name in names:
+                    parts[name].append(
+                        npz[name][lo:hi].astype(self.schema[name], copy=False))
+
+        return {
+            name: np.concatenate(values) if values else np.empty(
+                0, dtype=self.schema[name])
+            for name, values in parts.items()}
+
+    def read_frame(self, code: str, start=None, end=None, columns=None):
+        """
+        株価をDataFrameで読み込む
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        start : str, optional
+            開始日(YYYY-MM-DD, 境界を含む), by default None
+        end : str, optional
+            終了日(YYYY-MM-DD, 境界を含む), by default None
+        columns : list, optional
+            読み込むカラム, by default None (全カラム)
+
+        Returns
+        -------
+        pd.DataFrame
+            日付をindexにしたDataFrame
+        """
+        import pandas as pd
+
+        if columns is not None and self.DATE_COLUMN not in columns:
+            columns = [self.DATE_COLUMN] + list(columns)
+        data = self.read(code, start, end, columns)
+        dates = data.pop(self.DATE_COLUMN).astype('datetime64[D]')
+        df = pd.DataFrame(data, index=pd.DatetimeIndex(dates, name='date'))
+        df.insert(0, 'code', code)
+        return df
+
+    def get_codes(self):
+        """
+        保存済みの銘柄コードの取得
+
+        Returns
+        -------
+        list
+            銘柄コードのリスト
+        """
+        return sorted(entry.name for entry in os.scandir(self.directory)
+                      if entry.is_dir())
+
+    def get_years(self, code: str):
+        """
+        銘柄の保存済みの年の取得
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        list
+            年(西暦)のリスト
+        """
+        directory = os.path.join(self.directory, str(code))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(name[:-len(self.SUFFIX)]) for name in os.listdir(directory)
+                      if name.endswith(self.SUFFIX))
+
+    def get_last_date(self, code: str):
+        """
+        銘柄の保存済みの最終日付の取得
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        str
+            最終日付(YYYY-MM-DD)。保存されていない場合はNone
+        """
+        years = self.get_years(code)
+        if not years:
+            return None
+        with np.load(self.__get_path(code, years[-1])) as npz:
+            dates = npz[self.DATE_COLUMN]
+        return str(dates[-1].astype('datetime64[D]')) if len(dates) else None
+
+    def get_last_row(self, code: str):
+        """
+        銘柄の保存済みの最終日の行の取得
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        dict
+            カラム名と値の辞書。日付は1970-01-01からの経過日数。保存されていない場合はNone
+        """
+        years = self.get_years(code)
+        if not years:
+            return None
+        rows = self.__load(code, years[-1])
+        if len(rows[self.DATE_COLUMN]) == 0:
+            return None
+        return {name: values[-1] for name, values in rows.items()}
+
+    def __merge(self, existing: dict, rows: dict):
+        """
+        保存済みの行と新しい行を日付順に結合する
+
+        Parameters
+        ----------
+        existing : dict
+            保存済みのカラム名と配列の辞書
+        rows : dict
+            追記するカラム名と配列の辞書
+
+        Returns
+        -------
+        dict
+            結合したカラム名と配列の辞書
+        """
+        old_dates = existing[self.DATE_COLUMN]
+        new_dates = rows[self.DATE_COLUMN]
+
+        # 追記する行がすべて保存済みの行より新しい場合は連結するだけでよい
+        if len(old_dates) == 0 or (
+                new_dates[0] > old_dates[-1] and np.all(np.diff(new_dates) > 0)):
+            return {name: np.concatenate([existing[name], rows[name]])
+                    for name in self.schema}
+
+        merged = {name: np.concatenate([rows[name], existing[name]])
+                  for name in self.schema}
+        # 新しい行を先に並べ、日付の重複は最初の行(新しい値)を残す
+        _, index = np.unique(merged[self.DATE_COLUMN], return_index=True)
+        return {name: values[index] for name, values in merged.items()}
+
+    def __cast(self, columns: dict):
+        """
+        schemaの型にそろえ、日付順に並べる
+
+        Parameters
+        ----------
+        columns : dict
+            カラム名と配列の辞書
+
+        Returns
+        -------
+        dict
+            カラム名と配列の辞書
+        """
+        cast = {}
+        for name, dtype in self.schema.items():
+            values = np.asarray(columns[name])
+            if name == self.DATE_COLUMN and values.dtype.kind in 'UOM':
+                values = values.astype('datetime64[D]').astype(np.int64)
+            cast[name] = values.astype(dtype, copy=False)
+
+        order = np.argsort(cast[self.DATE_COLUMN], kind='stable')
+        return {name: values[order] for name, values in cast.items()}
+
+    def __load(self, code: str, year: int):
+        """
+        1年分のファイルを読み込む
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        year : int
+            年(西暦)
+
+        Returns
+        -------
+        dict
+            カラム名と配列の辞書。ファイルがない場合はNone
+        """
+        path = self.__get_path(code, year)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as npz:
+            return {name: npz[name].astype(dtype, copy=False) for name, dtype in self.schema.items()}
+
+    def __save(self, code: str, year: int, rows: dict):
+        """
+        1年分のファイルを書き込む
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        year : int
+            年(西暦)
+        rows : dict
+            カラム名と配列の辞書
+        """
+        path = self.__get_path(code, year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **rows)
+        os.replace(tmp_path, path)
+
+    def __get_path(self, code: str, year: int):
+        """
+        ファイルのパスの取得
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        year : int
+            年(西暦)
+
+        Returns
+        -------
+        str
+            ファイルのパス
+        """
+        return os.path.join(self.directory, str(code), f'{year}{self.SUFFIX}')
+
+    def __to_years(self, days):
+        """
+        経過日数から年(西暦)への変換
+
+        Parameters
+        ----------
+        days : np.ndarray or int
+            1970-01-01からの経過日数
+
+        Returns
+        -------
+        np.ndarray or int
+            年(西暦)
+        """
+        return np.asarray(days).astype('datetime64[D]').astype('datetime64[Y]').astype(int) + 1970
+
+    def __to_day(self, value):
+        """
+        日付文字列から経過日数への変換
+
+        Parameters
+        ----------
+        value : str
+            日付(YYYY-MM-DD)
+
+        Returns
+        -------
+        int
+            1970-01-01からの経過日数。Noneの場合はNone
+        """
+        if value is None:
+            return None
+        return int(np.datetime64(value, 'D').astype(np.int64))
@@ -1,11 +1,17 @@
 from repository.memcache import MemcachedAPI
 from repository.stock_list import StockListAPI
-from repository.stock import StockAPI
-from repository.drive import GoogleDriveAPI
-from repository.sheet import SheetAPI
+from repository.stock import StockAPI, StockCache, parse_stock_csv, concat_columns
+from repository.drive import GoogleDriveAPI, DriveFileIndex, GoogleDriveBatchAPI
+from repository.sheet import SheetAPI, BufferedSheetAPI
+from repository.store import PriceStoreAPI
+from repository.outbound import CircuitOpenError
+from analysis import IndicatorState, IndicatorSet
+from scheduler import LeaseScheduler, Pipeline
+from metrics import METRICS
 import traceback
-from io import StringIO
-import pandas as pd
+import hashlib
+import time
+import numpy as np
 
 from logging import getLogger, StreamHandler, DEBUG
 logger = getLogger(__name__)
@@ -38,6 +44,18 @@ class Runner:
         株価取得APIのインスタンス
     drive_api: GoogleDriveAPI
         google driveのAPIのインスタンス
+    drive_batch_api: GoogleDriveBatchAPI
+        google driveのメタデータ操作をまとめて行うAPIのインスタンス
+    pending_deletes: list
+        バッチ実行中にまとめて削除するgoogle driveのファイルのキー値。Noneの場合はすぐに削除する
+    sheet_api: BufferedSheetAPI
+        google spread sheetへまとめて書き込むAPIのインスタンス
+    store_api: PriceStoreAPI
+        列指向で株価を保存するAPIのインスタンス
+    indicator_set: IndicatorSet
+        買いシグナルのある銘柄について追加で計算し、spread sheetに書き込む指標。Noneの場合は計算しない
+    TIME_BUDGET: int
+        バッチ実行時の制限時間(秒)。google functionsのタイムアウトより短くする
     """
     YEARS = ["2020", "2019", "2018"]
     CSV_HEADER = "code,date,open,high,low,closing,volume,closed_adj"
@@ -45,6 +63,7 @@ class Runner:
     SHORT_TERM = 5
     MIDDLE_TERM = 25
     LONG_TERM = 75
+    TIME_BUDGET = 240
 
     def __init__(
             self,
@@ -55,7 +74,13 @@ class Runner:
             drivepath: str,
             service_account_key_path: str,
             stock_api_path: str,
-            sheet_id: str):
+            sheet_id: str,
+            cache_dir: str = None,
+            incremental: bool = False,
+            store_dir: str = None,
+            indicators: str = None,
+            signal_conditions: str = None,
+            upload_format: str = 'csv'):
         """
         コンストラクタ
 
@@ -77,13 +102,43 @@ class Runner:
             株価取得APIのURL
         sheet_id : str
             スプレッドシートのid
+        cache_dir : str, optional
+            過去年の株価をキャッシュするローカルのディレクトリ。Noneの場合はキャッシュしない
+        incremental : bool, optional
+            google driveのファイルを作り直さず、新しい日付がある場合だけ更新する, by default False
+        store_dir : str, optional
+            株価を列指向で保存するローカルのディレクトリ。Noneの場合は保存しない
+        indicators : str, optional
+            追加で計算する指標の指定(例: "bollinger:20:2,volume_cycle")。Noneの場合は計算しない
+        signal_conditions : str, optional
+            買いシグナルの条件に加える指標の出力の指定(例: "bollinger_20_2_lower_alert_closed_adj")。
+            Noneの場合は条件に加えない
+        upload_format : str, optional
+            google driveへのアップロード形式(csv, gzip, npz), by default 'csv'
         """
         self.memcache_api = MemcachedAPI(
             cached_host, cached_user, cached_password)
         self.stock_list_api = StockListAPI(filepath, filter_mode=True)
-        self.stock_api = StockAPI(stock_api_path)
-        self.drive_api = GoogleDriveAPI(drivepath, service_account_key_path)
-        self.sheet_api = SheetAPI(service_account_key_path, sheet_id)
+        cache = StockCache(cache_dir) if cache_dir is not None else None
+        self.stock_api = StockAPI(stock_api_path, cache=cache)
+        self.drive_api = GoogleDriveAPI(
+            drivepath, service_account_key_path, upload_format)
+        self.drive_batch_api = GoogleDriveBatchAPI(self.drive_api)
+        self.pending_deletes = None
+        self.pending_fingerprints = []
+        self.sheet_api = BufferedSheetAPI(
+            SheetAPI(service_account_key_path, sheet_id), self.memcache_api)
+        self.incremental = incremental
+        self.store_api = PriceStoreAPI(
+            store_dir) if store_dir is not None else None
+        self.indicator_set = IndicatorSet.parse(
+            indicators or '', signal_conditions) if indicators or signal_conditions else None
+        # 処理の設定が変わった場合は、取得した株価が同じでも処理し直すためハッシュ値に含める
+        self.__settings = repr((self.YEARS, self.SHORT_TERM, self.MIDDLE_TERM, self.LONG_TERM,
+                                self.STAGE_TRANSITION, incremental, store_dir is not None,
+                                indicators, signal_conditions, upload_format)).encode('utf8')
+        # 計測値は実行ごとに集計する
+        METRICS.reset()
 
     def start(self, insert_flag=True):
         """
@@ -94,16 +149,510 @@ class Runner:
         insert_flag : bool, optional
             google driveへの保存実行フラグ, by default True
         """
+        started = time.perf_counter()
+        processed = 0
         try:
             code = self.__get_stock_code()
-            csv = self.__fetch_stock(code)
             if insert_flag:
-                self.__drive_insert(csv, code)
-            self.__append_purchace_sign(csv)
+                self.__load_drive_index(build=False)
+            self.__process(code, insert_flag)
+            processed += 1
+        except CircuitOpenError as e:
+            # 障害中のAPIにリクエストを送り続けず、処理済みの銘柄を残して終了する
+            logger.warning(str(e))
+        except Exception:
+            logger.error(traceback.format_exc())
+            exit()
+        finally:
+            self.__save_fingerprints(self.__flush_sheet())
+            self.__save_drive_index()
+            self.__report_metrics(
+                'single', processed, time.perf_counter() - started)
+
+    def start_batch(self, insert_flag=True, time_budget=TIME_BUDGET):
+        """
+        制限時間内に収まるだけの銘柄をまとめて実行する
+
+        1銘柄ごとにキャッシュの銘柄コードを更新するため、タイムアウトしても処理済みの銘柄は失われない。
+
+        Parameters
+        ----------
+        insert_flag : bool, optional
+            google driveへの保存実行フラグ, by default True
+        time_budget : float, optional
+            制限時間(秒), by default TIME_BUDGET
+        """
+        started = time.perf_counter()
+        processed = 0
+        start_code = None
+        try:
+            if insert_flag:
+                self.pending_deletes = []
+                self.__load_drive_index(build=True)
+
+            while True:
+                elapsed = time.perf_counter() - started
+                # 1銘柄あたりの平均時間から、次の銘柄が制限時間内に終わらない場合は打ち切る
+                if processed > 0 and elapsed + elapsed / processed > time_budget:
+                    break
+
+                code = self.__get_stock_code()
+                # 銘柄リストを一巡した場合は終了する
+                if code == start_code:
+                    break
+                if start_code is None:
+                    start_code = code
+
+                self.__process(code, insert_flag)
+                processed += 1
+        except CircuitOpenError as e:
+            # 障害中のAPIにリクエストを送り続けず、処理済みの銘柄を残して終了する
+            logger.warning(str(e))
+        except Exception:
+            logger.error(traceback.format_exc())
+            exit()
+        finally:
+            flushed = self.__flush_sheet()
+            flushed = self.__flush_drive_deletes() and flushed
+            self.pending_deletes = None
+            self.__save_fingerprints(flushed)
+            self.__save_drive_index()
+            elapsed = time.perf_counter() - started
+            self.__report_throughput(processed, elapsed)
+            self.__report_metrics('batch', processed, elapsed)
+
+    def start_worker(self, insert_flag=True, time_budget=TIME_BUDGET, worker_id=None):
+        """
+        他のワーカーと重ならない銘柄リストの区間を確保しながら、制限時間内で実行する
+
+        キャッシュの単一の銘柄コードの代わりにLeaseSchedulerで区間を払い出すため、
+        複数のインスタンスを同時に実行しても同じ銘柄を処理しない。
+
+        Parameters
+        ----------
+        insert_flag : bool, optional
+            google driveへの保存実行フラグ, by default True
+        time_budget : float, optional
+            制限時間(秒), by default TIME_BUDGET
+        worker_id : str, optional
+            ワーカーの識別子, by default None (ランダムに作成する)
+        """
+        scheduler = LeaseScheduler(
+            self.memcache_api, self.stock_list_api, worker_id=worker_id)
+        started = time.perf_counter()
+        processed = 0
+        lease = None
+        try:
+            if insert_flag:
+                self.pending_deletes = []
+                self.__load_drive_index(build=True)
+
+            while True:
+                lease = scheduler.claim()
+                if lease is None:
+                    logger.info('No shard to claim.')
+                    break
+
+                finished = True
+                for code in scheduler.get_codes(lease):
+                    elapsed = time.perf_counter() - started
+                    if processed > 0 and elapsed + elapsed / processed > time_budget:
+                        finished = False
+                        break
+
+                    self.__process_code(code, insert_flag)
+                    processed += 1
+                    if not scheduler.checkpoint(lease):
+                        logger.info(f'Lost lease of shard {lease.shard}.')
+                        lease = None
+                        finished = False
+                        break
+
+                if not finished:
+                    break
+                scheduler.complete(lease)
+                lease = None
+        except CircuitOpenError as e:
+            # 障害中のAPIにリクエストを送り続けず、処理済みの銘柄を残して終了する
+            logger.warning(str(e))
+        except Exception:
+            logger.error(traceback.format_exc())
+            exit()
+        finally:
+            if lease is not None:
+                # 途中で終了した区間は、リースの期限を待たずに他のワーカーに引き継ぐ
+                self.__release_lease(scheduler, lease)
+            flushed = self.__flush_sheet()
+            flushed = self.__flush_drive_deletes() and flushed
+            self.pending_deletes = None
+            self.__save_fingerprints(flushed)
+            self.__save_drive_index()
+            elapsed = time.perf_counter() - started
+            self.__report_throughput(processed, elapsed)
+            self.__report_metrics('worker', processed, elapsed)
+
+    def start_pipeline(self, insert_flag=True, time_budget=TIME_BUDGET, queue_size=Pipeline.QUEUE_SIZE):
+        """
+        取得・計算・アップロードを別スレッドで並行させながら、制限時間内に収まるだけの銘柄を実行する
+
+        銘柄Nの計算中に銘柄N+1を取得し、銘柄N-1をアップロードする。
+        google drive/spread sheetとキャッシュの銘柄コードの更新はアップロードの段階で銘柄順に行うため、
+        タイムアウトしても処理済みの銘柄は失われない。
+
+        Parameters
+        ----------
+        insert_flag : bool, optional
+            google driveへの保存実行フラグ, by default True
+        time_budget : float, optional
+            制限時間(秒), by default TIME_BUDGET
+        queue_size : int, optional
+            段階の間で待たせる銘柄数の上限, by default Pipeline.QUEUE_SIZE
+        """
+        started = time.perf_counter()
+        progress = {'queued': 0, 'processed': 0}
+
+        def codes(start_code):
+            code = start_code
+            while True:
+                elapsed = time.perf_counter() - started
+                processed = progress['processed']
+                # 1銘柄あたりの平均時間から、処理中の銘柄と次の銘柄が制限時間内に終わらない場合は打ち切る
+                if processed > 0 and elapsed + elapsed / processed * (
+                        progress['queued'] - processed + 1) > time_budget:
+                    return
+                progress['queued'] += 1
+                yield code
+                code = self.stock_list_api.get_next_code(code)
+                # 銘柄リストを一巡した場合は終了する
+                if code is None or code == start_code:
+                    return
+
+        def fetch(code):
+            return code, self.__fetch_stock(code)
+
+        def compute(item):
+            code, stocks = item
+            digest = self.__get_digest(stocks, insert_flag)
+            if self.__is_unchanged(code, digest):
+                return code, None, None, None, None
+            columns = self.__parse_stock(stocks)
+            if self.store_api is not None:
+                self.__store_insert(columns, code)
+            return code, stocks, columns, self.__get_purchace_sign_cells(columns, code), digest
+
+        def upload(item):
+            code, stocks, columns, cells, digest = item
+            if digest is not None:
+                if insert_flag:
+                    self.__drive_insert(stocks, columns, code)
+                if len(cells) > 0:
+                    self.sheet_api.append(cells)
+                self.__queue_fingerprint(code, digest, columns)
             self.memcache_api.set_stock_code(code)
+            progress['processed'] += 1
+
+        pipeline = Pipeline([('fetch', fetch), ('compute', compute), ('upload', upload)],
+                            queue_size=queue_size)
+        try:
+            if insert_flag:
+                self.pending_deletes = []
+                self.__load_drive_index(build=True)
+            pipeline.run(codes(self.__get_stock_code()))
+        except CircuitOpenError as e:
+            # 障害中のAPIにリクエストを送り続けず、処理済みの銘柄を残して終了する
+            logger.warning(str(e))
         except Exception:
             logger.error(traceback.format_exc())
             exit()
+        finally:
+            flushed = self.__flush_sheet()
+            flushed = self.__flush_drive_deletes() and flushed
+            self.pending_deletes = None
+            self.__save_fingerprints(flushed)
+            self.__save_drive_index()
+            elapsed = time.perf_counter() - started
+            self.__report_throughput(progress['processed'], elapsed)
+            for name, timing in pipeline.timings.items():
+                logger.info(
+                    f'Stage {name}: {timing["items"]} items, busy {timing["busy"]:.1f}s, wait {timing["wait"]:.1f}s.')
+            self.__report_metrics('pipeline', progress['processed'], elapsed,
+                                  stages=pipeline.timings)
+
+    def __process(self, code: str, insert_flag: bool):
+        """
+        1銘柄分の処理を実行し、キャッシュの銘柄コードを更新する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        insert_flag : bool
+            google driveへの保存実行フラグ
+        """
+        self.__process_code(code, insert_flag)
+        self.memcache_api.set_stock_code(code)
+
+    @METRICS.timed('runner.process_code')
+    def __process_code(self, code: str, insert_flag: bool):
+        """
+        1銘柄分の取得・保存・買いシグナルの計算を実行する
+
+        取得した株価が前回処理したものと同じ場合は、保存・買いシグナルの計算を行わない。
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        insert_flag : bool
+            google driveへの保存実行フラグ
+        """
+        stocks = self.__fetch_stock(code)
+        digest = self.__get_digest(stocks, insert_flag)
+        if self.__is_unchanged(code, digest):
+            return
+        columns = self.__parse_stock(stocks)
+        if insert_flag:
+            self.__drive_insert(stocks, columns, code)
+        if self.store_api is not None:
+            self.__store_insert(columns, code)
+        self.__append_purchace_sign(columns, code)
+        self.__queue_fingerprint(code, digest, columns)
+
+    def __get_digest(self, stocks: dict, insert_flag: bool):
+        """
+        取得した株価と処理の設定のハッシュ値を計算する
+
+        Parameters
+        ----------
+        stocks : dict
+            年をキー、株価APIのレスポンスのバイト列を値とした辞書
+        insert_flag : bool
+            google driveへの保存実行フラグ
+
+        Returns
+        -------
+        str
+            ハッシュ値
+        """
+        digest = hashlib.blake2b(self.__settings, digest_size=16)
+        digest.update(b'insert' if insert_flag else b'skip')
+        for year in self.YEARS:
+            # 年の境目がずれた場合に同じハッシュ値にならないよう、長さも含める
+            digest.update(len(stocks[year]).to_bytes(8, 'little'))
+            digest.update(stocks[year])
+        return digest.hexdigest()
+
+    def __is_unchanged(self, code: str, digest: str):
+        """
+        取得した株価が前回処理したものと同じかどうか
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        digest : str
+            取得した株価と処理の設定のハッシュ値
+
+        Returns
+        -------
+        bool
+            同じ場合True
+        """
+        fingerprint = self.memcache_api.get_fingerprint(code)
+        unchanged = fingerprint is not None and fingerprint[0] == digest
+        METRICS.hit('runner.fingerprint', unchanged)
+        if unchanged:
+            logger.info(f'No changes for {code} since {fingerprint[1]}.')
+        return unchanged
+
+    def __queue_fingerprint(self, code: str, digest: str, columns: dict):
+        """
+        処理した株価のハッシュ値と最終日付を、終了処理で保存するまで溜める
+
+        spread sheetの行とgoogle driveの古いファイルの削除は終了処理でまとめて行うため、
+        それらが終わる前に保存すると、失敗した場合に次の実行でその銘柄が処理し直されない。
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        digest : str
+            取得した株価と処理の設定のハッシュ値
+        columns : dict
+            日付順の株価のカラムの辞書
+        """
+        dates = columns['date']
+        last_date = self.__to_date_string(dates[-1]) if len(dates) > 0 else ''
+        self.pending_fingerprints.append((code, digest, last_date))
+
+    def __save_fingerprints(self, flushed: bool):
+        """
+        溜めたハッシュ値をキャッシュに保存する。終了処理で呼ぶため例外はログ出力のみ行う
+
+        Parameters
+        ----------
+        flushed : bool
+            spread sheetの行とgoogle driveの削除が全て成功したかどうか。
+            Falseの場合は保存せず、次の実行で処理し直す
+        """
+        fingerprints, self.pending_fingerprints = self.pending_fingerprints, []
+        if not flushed:
+            if fingerprints:
+                logger.warning(
+                    f'Fingerprints of {len(fingerprints)} codes are not saved and will be processed again.')
+            return
+        for code, digest, last_date in fingerprints:
+            try:
+                self.memcache_api.set_fingerprint(code, digest, last_date)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def __load_drive_index(self, build: bool):
+        """
+        キャッシュからgoogle driveのファイルの対応表を読み込む
+
+        Parameters
+        ----------
+        build : bool
+            キャッシュにない場合にフォルダー内のファイルから作成するかどうか
+        """
+        index = self.memcache_api.get_drive_index()
+        if index is not None:
+            self.drive_api.index = DriveFileIndex.from_json(index)
+        elif build:
+            index = self.drive_api.build_index()
+            # 途中で終了した実行が古いファイルを削除できずに残した場合は、新しい方を残して削除する
+            if index.duplicates and self.pending_deletes is not None:
+                logger.info(f'Deleting {len(index.duplicates)} duplicated files.')
+                self.pending_deletes.extend(index.duplicates)
+
+    def __save_drive_index(self):
+        """
+        google driveのファイルの対応表に変更があればキャッシュに保存する。終了処理で呼ぶため例外はログ出力のみ行う
+        """
+        index = self.drive_api.index
+        if index is None or not index.dirty:
+            return
+        try:
+            # 他のワーカーの変更を上書きしないよう、キャッシュの最新の対応表に変更だけを反映する
+            self.memcache_api.update_drive_index(index.merge)
+            index.commit()
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    def __release_lease(self, scheduler: LeaseScheduler, lease):
+        """
+        区間のリースを解放する。終了処理で呼ぶため例外はログ出力のみ行う
+
+        Parameters
+        ----------
+        scheduler : LeaseScheduler
+            区間を払い出したスケジューラ
+        lease : Lease
+            確保した区間
+        """
+        try:
+            scheduler.release(lease)
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    def __flush_drive_deletes(self):
+        """
+        削除待ちのgoogle driveのファイルをまとめて削除する。終了処理で呼ぶため例外はログ出力のみ行う
+
+        削除できなかったファイルは削除待ちに残し、次に呼ばれたときに削除し直す。
+
+        Returns
+        -------
+        bool
+            削除待ちのファイルが全て削除できた場合はTrue
+        """
+        if not self.pending_deletes:
+            return True
+        from googleapiclient.errors import HttpError
+
+        try:
+            errors = self.drive_batch_api.delete_files(self.pending_deletes)
+        except Exception:
+            logger.error(traceback.format_exc())
+            logger.error(f'Files left undeleted: {self.pending_deletes}')
+            return False
+
+        failed = []
+        for fileid, exception in errors.items():
+            if exception is None:
+                continue
+            if isinstance(exception, HttpError) and exception.resp.status == 404:
+                if self.drive_api.index is not None:
+                    self.drive_api.index.remove(fileid)
+                continue
+            logger.error(f'Failed to delete {fileid}: {exception}')
+            failed.append(fileid)
+        self.pending_deletes = failed
+        return not failed
+
+    def __flush_sheet(self):
+        """
+        溜めたspread sheetの行を書き込む。終了処理で呼ぶため例外はログ出力のみ行う
+
+        書き込めなかった行はキャッシュに残り、次の実行で書き込む。
+
+        Returns
+        -------
+        bool
+            書き込みに成功した(書き込む行がない場合を含む)場合はTrue
+        """
+        try:
+            self.sheet_api.flush()
+        except Exception:
+            logger.error(traceback.format_exc())
+            logger.error('Sheet rows are kept in cache and will be appended on the next run.')
+            return False
+        return True
+
+    def __report_throughput(self, processed: int, elapsed: float):
+        """
+        バッチ実行のスループットをログ出力する
+
+        Parameters
+        ----------
+        processed : int
+            処理した銘柄数
+        elapsed : float
+            経過時間(秒)
+        """
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            f'Processed {processed} codes in {elapsed:.1f}s ({rate:.3f} codes/sec).')
+        cache = self.stock_api.cache
+        if cache is not None:
+            logger.info(
+                f'Stock cache: {cache.hits} hits, {cache.misses} misses ({cache.hit_ratio():.1%}).')
+
+    def __report_metrics(self, mode: str, processed: int, elapsed: float, stages=None):
+        """
+        リポジトリの呼び出しと各段階の計測値を1行のjsonでログ出力する。終了処理で呼ぶため例外はログ出力のみ行う
+
+        Parameters
+        ----------
+        mode : str
+            実行方法(single, batch, worker, pipeline)
+        processed : int
+            処理した銘柄数
+        elapsed : float
+            経過時間(秒)
+        stages : dict, optional
+            パイプライン実行の段階ごとの処理時間, by default None
+        """
+        try:
+            fields = {'event': 'metrics', 'mode': mode, 'processed': processed,
+                      'elapsed': round(elapsed, 3)}
+            if stages is not None:
+                fields['stages'] = {name: {key: round(value, 6) for key, value in timing.items()}
+                                    for name, timing in stages.items()}
+            logger.info(METRICS.to_json(**fields))
+        except Exception:
+            logger.error(traceback.format_exc())
 
     def __get_stock_code(self):
         """
@@ -125,58 +674,125 @@ class Runner:
             code = self.stock_list_api.get_first_code()
         return code
 
-    def __append_purchace_sign(self, csv: str):
+    def __append_purchace_sign(self, columns: dict, code: str):
         """
         買シグナルのある銘柄を保存する
 
         Parameters
         ----------
-        csv : str
-            取得したcsvファイル
+        columns : dict
+            日付順の株価のカラムの辞書
+        code : str
+            銘柄コード
+        """
+        cells = self.__get_purchace_sign_cells(columns, code)
+        if len(cells) > 0:
+            self.sheet_api.append(cells)
+
+    @METRICS.timed('runner.signal')
+    def __get_purchace_sign_cells(self, columns: dict, code: str):
+        """
+        買シグナルを計算し、spread sheetに書き込む行を作成する
+
+        Parameters
+        ----------
+        columns : dict
+            日付順の株価のカラムの辞書
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        list
+            書き込む行のリスト。買いシグナルがない場合は空
         """
 
         # 買いシグナルを計算
-        df = pd.read_csv(StringIO(csv), index_col='date',
-                         parse_dates=True).sort_index()
-        df['short'] = df.closed_adj.rolling(self.SHORT_TERM).mean().round(1)
-        df['middle'] = df.closed_adj.rolling(self.MIDDLE_TERM).mean().round(1)
-        df['long'] = df.closed_adj.rolling(self.LONG_TERM).mean().round(1)
-        df['four_stage'] = (df.short < df.long) & (
-            df.short < df.middle) & (df.middle < df.long)
-        df['five_stage'] = (df.short < df.long) & (
-            df.short >= df.middle) & (df.middle < df.long)
-        df['stage'] = df.four_stage * 4 + df.five_stage * 5
-        df = df.dropna()
-        df['purchase_sign'] = df.stage.rolling(3).apply(
-            lambda x: list(x) == self.STAGE_TRANSITION)
-        df['dod'] = df.closed_adj.pct_change().round(3)
-        df['diff'] = df.closed_adj.diff()
+        dates = columns['date']
+        if len(dates) == 0:
+            return []
+        state = self.__update_indicator_state(
+            code, dates, columns['closed_adj'])
+        last_day = state.latest()
 
         cells = []
-        for last_day in df.tail(1).itertuples():
-            if last_day.purchase_sign:
-                # 銘柄情報を取得する
-                info = self.stock_list_api.get_stock_info_by_code(
-                    last_day.code)
-
-                cel = [
-                    last_day.Index.strftime('%Y-%m-%d'),
-                    last_day.code,
-                    info[self.stock_list_api.CODE_NAME],
-                    info[self.stock_list_api.BIZ_TYPE],
-                    last_day.closed_adj,
-                    last_day.short,
-                    last_day.middle,
-                    last_day.long,
-                    last_day.dod,
-                    last_day.diff
-                ]
-
-                cells.append(cel)
+        if last_day['purchase_sign']:
+            indicators = None
+            if self.indicator_set is not None:
+                indicators = self.indicator_set.latest(columns)
+                if not self.indicator_set.select(indicators):
+                    return cells
 
-        if len(cells) > 0:
-            self.sheet_api.append(cells)
+            # 銘柄情報を取得する
+            info = self.stock_list_api.get_stock_info_by_code(code)
+
+            cel = [
+                self.__to_date_string(dates[-1]),
+                code,
+                info[self.stock_list_api.CODE_NAME],
+                info[self.stock_list_api.BIZ_TYPE],
+                last_day['closed_adj'],
+                last_day['short'],
+                last_day['middle'],
+                last_day['long'],
+                last_day['dod'],
+                last_day['diff']
+            ]
+            if indicators is not None:
+                # 計算できない指標(NaN)は空欄にする
+                cel.extend(['' if value != value else value
+                            for value in indicators.values()])
 
+            cells.append(cel)
+
+        return cells
+
+    def __update_indicator_state(self, code: str, dates: np.ndarray, closes: np.ndarray):
+        """
+        キャッシュした指標の状態に新しい日付の株価だけを取り込む
+
+        状態がない場合や、株式分割などで保存済みの終値調整が変わっていた場合は全期間から作り直す。
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        dates : np.ndarray
+            日付順の1970-01-01からの経過日数
+        closes : np.ndarray
+            日付順の終値調整
+
+        Returns
+        -------
+        IndicatorState
+            最新日まで取り込んだ指標の状態
+        """
+        terms = (self.SHORT_TERM, self.MIDDLE_TERM,
+                 self.LONG_TERM, self.STAGE_TRANSITION)
+
+        data = self.memcache_api.get_indicator_state(code)
+        state = IndicatorState.from_bytes(data) if data is not None else None
+
+        position = None
+        if state is not None and state.is_compatible(*terms):
+            position = np.searchsorted(dates, state.last_date)
+            if position >= len(dates) or dates[position] != state.last_date \
+                    or closes[position] != state.get_last_close():
+                position = None
+
+        if position is None:
+            state = IndicatorState.from_closes(dates, closes, *terms)
+        elif position == len(dates) - 1:
+            # 新しい日付がない場合は状態をそのまま使う
+            return state
+        else:
+            for date, close in zip(dates[position + 1:], closes[position + 1:]):
+                state.update(int(date), float(close))
+
+        self.memcache_api.set_indicator_state(code, state.to_bytes())
+        return state
+
+    @METRICS.timed('runner.fetch')
     def __fetch_stock(self, code: str):
         """
         銘柄情報の取得
@@ -188,29 +804,237 @@ class Runner:
 
         Returns
         -------
+        dict
+            年をキー、株価APIのレスポンスのバイト列を値とした辞書
+        """
+        # 年ごとのリクエストは並行して投げ、デコードせずにバイト列のままパーサーへ渡す
+        stocks = {}
+        for _, year, stock in self.stock_api.fetch_stocks(
+                [(code, year) for year in self.YEARS], raw=True):
+            stocks[year] = stock
+        return stocks
+
+    @METRICS.timed('runner.parse')
+    def __parse_stock(self, stocks: dict):
+        """
+        株価APIのレスポンスを日付順のカラムにする
+
+        Parameters
+        ----------
+        stocks : dict
+            年をキー、株価APIのレスポンスのバイト列を値とした辞書
+
+        Returns
+        -------
+        dict
+            日付順の株価のカラムの辞書
+        """
+        return concat_columns(
+            [parse_stock_csv(stocks[year]) for year in self.YEARS])
+
+    def __build_content(self, stocks: dict, columns: dict, code: str):
+        """
+        google driveへアップロードする内容の作成
+
+        Parameters
+        ----------
+        stocks : dict
+            年をキー、株価APIのレスポンスのバイト列を値とした辞書
+        columns : dict
+            日付順の株価のカラムの辞書
+        code : str
+            銘柄コード
+
+        Returns
+        -------
+        generator or dict
+            npz形式の場合はカラムの辞書、それ以外はcsvを年ごとに返すジェネレータ
+        """
+        if self.drive_api.upload_format == 'npz':
+            return columns
+        return self.__iter_csv(stocks, code)
+
+    def __iter_csv(self, stocks: dict, code: str):
+        """
+        google driveへアップロードするcsvを年ごとに作成する
+
+        全体の文字列を作らず、アップロードの際に少しずつ書き込む。
+
+        Parameters
+        ----------
+        stocks : dict
+            年をキー、株価APIのレスポンスのバイト列を値とした辞書
+        code : str
+            銘柄コード
+
+        Yields
+        -------
         str
-            銘柄に関わるcsvフォーマットの文字列
+            銘柄に関わるcsvフォーマットの文字列の一部
         """
-        csv = self.CSV_HEADER
+        yield self.CSV_HEADER
         for year in self.YEARS:
-            stock = self.stock_api.fetch_stock(code, year)
-            csv += "\n" + "\n".join(
-                [f"{code},{stock_day}" for stock_day in stock.split('\n')[2:]])
-        return csv
+            lines = stocks[year].decode('utf8', errors='replace').split('\n')[2:]
+            yield "\n" + "\n".join(
+                [f"{code},{stock_day}" for stock_day in lines])
 
-    def __drive_insert(self, csv: str, code: str):
+    @METRICS.timed('runner.drive_insert')
+    def __drive_insert(self, stocks: dict, columns: dict, code: str):
         """
         google driveへのファイルアップロード
 
+        ファイルを作り直した場合は、差分更新が古いキー値を使わないよう保存状態も更新する。
+
         Parameters
         ----------
-        csv : str
-            アップロードするファイルの文字列
+        stocks : dict
+            年をキー、株価APIのレスポンスのバイト列を値とした辞書
+        columns : dict
+            日付順の株価のカラムの辞書
         code : str
             銘柄コード
         """
+        from googleapiclient.errors import HttpError
+
+        if self.incremental:
+            self.__drive_update(stocks, columns, code)
+            return
+
+        filename = self.drive_api.get_filename(code)
+        content = self.__build_content(stocks, columns, code)
         fileid = self.drive_api.get_file(code)
+        if fileid is not None and self.pending_deletes is not None:
+            # バッチ実行中は新しいファイルを先に作成し、古いファイルは最後にまとめて削除する
+            new_fileid = self.drive_api.upload_file(filename, content)
+            self.__set_drive_state(code, new_fileid, columns)
+            self.pending_deletes.append(fileid)
+            if len(self.pending_deletes) >= self.drive_batch_api.BATCH_SIZE:
+                self.__flush_drive_deletes()
+            return
+
         if fileid is not None:
-            self.drive_api.delete_file(fileid)
+            try:
+                self.drive_api.delete_file(fileid)
+            except HttpError as e:
+                # 対応表が古く、ファイルが既に削除されていた場合は無視する
+                if e.resp.status != 404:
+                    raise
+                if self.drive_api.index is not None:
+                    self.drive_api.index.remove(fileid)
 
-        self.drive_api.upload_file(f'{code}.csv', csv)
+        fileid = self.drive_api.upload_file(filename, content)
+        self.__set_drive_state(code, fileid, columns)
+
+    def __set_drive_state(self, code: str, fileid: str, columns: dict):
+        """
+        google driveに保存したファイルのキー値と最終日付をキャッシュに保存する
+
+        Parameters
+        ----------
+        code : str
+            銘柄コード
+        fileid : str
+            google driveのファイルのキー値
+        columns : dict
+            日付順の株価のカラムの辞書
+        """
+        dates = columns['date']
+        last_date = self.__to_date_string(dates[-1]) if len(dates) > 0 else ''
+        self.memcache_api.set_drive_state(code, fileid, last_date)
+
+    @METRICS.timed('runner.store_insert')
+    def __store_insert(self, columns: dict, code: str):
+        """
+        列指向のローカルストアへの保存
+
+        保存済みの最終日の終値調整が変わっていない場合は、それより新しい行だけを追記する。
+        株式分割で変わっていた場合は、調整し直された全期間を上書きする。
+
+        Parameters
+        ----------
+        columns : dict
+            日付順の株価のカラムの辞書
+        code : str
+            銘柄コード
+        """
+        last = self.store_api.get_last_row(code)
+        if last is not None:
+            dates = columns['date']
+            position = np.searchsorted(dates, last['date'], side='right')
+            if position > 0 and dates[position - 1] == last['date'] and \
+                    np.isclose(columns['closed_adj'][position - 1], last['closed_adj']):
+                if position == len(dates):
+                    return
+                columns = {name: values[position:]
+                           for name, values in columns.items()}
+        self.store_api.write(
+            code, {name: columns[name] for name in self.store_api.schema})
+
+    def __drive_update(self, stocks: dict, columns: dict, code: str):
+        """
+        google driveのファイルを差分がある場合だけ更新する
+
+        保存済みの最終日付より新しい行がない場合はアップロードしない。
+        ファイルは削除せずに同じキー値のまま内容を更新する。
+
+        Parameters
+        ----------
+        stocks : dict
+            年をキー、株価APIのレスポンスのバイト列を値とした辞書
+        columns : dict
+            日付順の株価のカラムの辞書
+        code : str
+            銘柄コード
+        """
+        from googleapiclient.errors import HttpError
+
+        dates = columns['date']
+        last_date = self.__to_date_string(dates[-1]) if len(dates) > 0 else ''
+        state = self.memcache_api.get_drive_state(code)
+
+        if state is None:
+            fileid = self.drive_api.get_file(code)
+        else:
+            fileid, stored_date = state
+            if last_date <= stored_date:
+                logger.info(f'No new rows for {code} after {stored_date}.')
+                return
+
+        # 更新が必要な場合だけアップロードする内容を作る
+        filename = self.drive_api.get_filename(code)
+
+        try:
+            if fileid is None:
+                fileid = self.drive_api.upload_file(
+                    filename, self.__build_content(stocks, columns, code))
+            else:
+                # アップロード形式を変えた場合も拡張子が合うよう、ファイル名も更新する
+                self.drive_api.update_file(
+                    self.__build_content(stocks, columns, code), fileid, filename)
+        except HttpError as e:
+            # キャッシュしたファイルが削除されていた場合は、古い保存状態を消して作り直す
+            if e.resp.status != 404:
+                raise
+            self.memcache_api.delete_drive_state(code)
+            if self.drive_api.index is not None:
+                self.drive_api.index.remove(fileid)
+            fileid = self.drive_api.upload_file(
+                filename, self.__build_content(stocks, columns, code))
+
+        self.memcache_api.set_drive_state(code, fileid, last_date)
+
+    def __to_date_string(self, day: int):
+        """
+        経過日数を日付の文字列にする
+
+        Parameters
+        ----------
+        day : int
+            1970-01-01からの経過日数
+
+        Returns
+        -------
+        str
+            日付(YYYY-MM-DD)
+        """
+        return str(np.datetime64(int(day), 'D'))
@@ -0,0 +1,4 @@
+from .lease import LeaseScheduler, Lease
+from .pipeline import Pipeline
+
+__all__ = ['LeaseScheduler', 'Lease', 'Pipeline']
@@ -0,0 +1,362 @@
+import math
+import uuid
+
+
+class Lease:
+    """
+    ワーカーが確保した銘柄リストの区間
+
+    Attributes
+    -------
+    sweep : int
+        銘柄リストを一巡する単位の番号
+    shard : int
+        区間の番号
+    start : int
+        区間の開始位置
+    stop : int
+        区間の終了位置(含まない)
+    progress : int
+        区間内の処理済みの銘柄数
+    """
+
+    def __init__(self, sweep: int, shard: int, start: int, stop: int, progress=0):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        sweep : int
+            銘柄リストを一巡する単位の番号
+        shard : int
+            区間の番号
+        start : int
+            区間の開始位置
+        stop : int
+            区間の終了位置(含まない)
+        progress : int, optional
+            区間内の処理済みの銘柄数, by default 0
+        """
+        self.sweep = sweep
+        self.shard = shard
+        self.start = start
+        self.stop = stop
+        self.progress = progress
+
+
+class LeaseScheduler:
+    """
+    複数のワーカーが銘柄リストの重ならない区間を確保して並列に処理するためのスケジューラ
+
+    銘柄リストをSHARD_SIZEごとの区間に分け、memcacheのincrで区間を1つずつ払い出す。
+    区間の確保はaddによる期限付きのリースで、期限までに完了しなかった区間は他のワーカーが
+    処理済みの位置から引き継ぐ。全区間が完了したら、CASで次の一巡に進める。
+
+    Attributes
+    -------
+    SHARD_SIZE : int
+        1区間の銘柄数
+    LEASE_TIME : int
+        リースが切れるまでの時間(秒)
+    SWEEP_EXPIRE_TIME : int
+        一巡分の管理情報が切れるまでの時間(秒)
+    KEY_PREFIX : str
+        キャッシュのキーの接頭辞
+    memcache_api : MemcachedAPI
+        キャッシュのAPI
+    stock_list_api : StockListAPI
+        銘柄リストのAPI
+    worker_id : str
+        ワーカーの識別子
+    """
+    SHARD_SIZE = 20
+    LEASE_TIME = 60 * 10
+    SWEEP_EXPIRE_TIME = 60 * 60 * 24 * 7
+    KEY_PREFIX = 'lease:'
+
+    def __init__(self, memcache_api, stock_list_api, worker_id=None, shard_size=SHARD_SIZE, lease_time=LEASE_TIME):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        memcache_api : MemcachedAPI
+            キャッシュのAPI
+        stock_list_api : StockListAPI
+            銘柄リストのAPI
+        worker_id : str, optional
+            ワーカーの識別子, by default None (ランダムに作成する)
+        shard_size : int, optional
+            1区間の銘柄数, by default SHARD_SIZE
+        lease_time : int, optional
+            リースが切れるまでの時間(秒), by default LEASE_TIME
+        """
+        self.memcache_api = memcache_api
+        self.stock_list_api = stock_list_api
+        self.worker_id = worker_id if worker_id is not None else uuid.uuid4().hex
+        self.shard_size = shard_size
+        self.lease_time = lease_time
+        self.num_shards = math.ceil(stock_list_api.get_size() / shard_size)
+
+    def claim(self):
+        """
+        未処理の区間を1つ確保する
+
+        Returns
+        -------
+        Lease
+            確保した区間。他のワーカーが全区間を確保している場合はNone
+        """
+        # 一巡が完了して次の一巡に進んだ場合に備えて、2回まで試す
+        for _ in range(2):
+            sweep = self.__get_sweep()
+
+            lease = self.__claim_next(sweep)
+            if lease is None:
+                lease = self.__claim_expired(sweep)
+            if lease is not None:
+                return lease
+
+            if not self.__advance_sweep(sweep):
+                return None
+        return None
+
+    def get_codes(self, lease: Lease):
+        """
+        区間内の未処理の銘柄コードの取得
+
+        Parameters
+        ----------
+        lease : Lease
+            確保した区間
+
+        Returns
+        -------
+        list
+            銘柄コードのリスト
+        """
+        return self.stock_list_api.get_codes(lease.start + lease.progress, lease.stop)
+
+    def checkpoint(self, lease: Lease, processed=1):
+        """
+        区間内の処理済みの銘柄数を進め、リースを延長する
+
+        Parameters
+        ----------
+        lease : Lease
+            確保した区間
+        processed : int, optional
+            新たに処理した銘柄数, by default 1
+
+        Returns
+        -------
+        bool
+            リースを保持している場合True。期限切れで他のワーカーに移っていた場合False
+        """
+        lease.progress += processed
+        if not self.__renew(lease):
+            return False
+        self.memcache_api.add_value(
+            self.__key(lease.sweep, lease.shard, 'progress'), 0, self.SWEEP_EXPIRE_TIME)
+        self.memcache_api.incr_value(
+            self.__key(lease.sweep, lease.shard, 'progress'), processed)
+        return True
+
+    def complete(self, lease: Lease):
+        """
+        区間の完了を記録し、リースを解放する
+
+        Parameters
+        ----------
+        lease : Lease
+            確保した区間
+        """
+        if self.memcache_api.add_value(
+                self.__key(lease.sweep, lease.shard, 'complete'), 1, self.SWEEP_EXPIRE_TIME):
+            self.memcache_api.add_value(
+                self.__key(lease.sweep, 'done'), 0, self.SWEEP_EXPIRE_TIME)
+            self.memcache_api.incr_value(self.__key(lease.sweep, 'done'))
+        self.__delete_lease(lease)
+
+    def release(self, lease: Lease):
+        """
+        区間を完了せずにリースを解放し、他のワーカーがすぐに処理済みの位置から引き継げるようにする
+
+        Parameters
+        ----------
+        lease : Lease
+            確保した区間
+        """
+        self.__delete_lease(lease)
+
+    def __delete_lease(self, lease: Lease):
+        """
+        自分が保持しているリースを削除する
+
+        期限切れで他のワーカーに移っていた場合は削除しない。取得してから削除するまでの間に
+        移った場合もCAS値が変わるため削除しない。
+
+        Parameters
+        ----------
+        lease : Lease
+            確保した区間
+
+        Returns
+        -------
+        bool
+            削除した場合True
+        """
+        key = self.__key(lease.sweep, lease.shard)
+        holder, cas = self.memcache_api.gets_value(key)
+        if holder != self.worker_id:
+            return False
+        return self.memcache_api.delete_value(key, cas)
+
+    def __claim_next(self, sweep: int):
+        """
+        まだ払い出していない区間を確保する
+
+        Parameters
+        ----------
+        sweep : int
+            一巡の番号
+
+        Returns
+        -------
+        Lease
+            確保した区間。全区間を払い出し済みの場合はNone
+        """
+        counter = self.__key(sweep, 'next')
+        self.memcache_api.add_value(counter, 0, self.SWEEP_EXPIRE_TIME)
+        while True:
+            shard = self.memcache_api.incr_value(counter) - 1
+            if shard >= self.num_shards:
+                return None
+            lease = self.__acquire(sweep, shard)
+            if lease is not None:
+                return lease
+
+    def __claim_expired(self, sweep: int):
+        """
+        リースが切れて未完了の区間を確保する
+
+        Parameters
+        ----------
+        sweep : int
+            一巡の番号
+
+        Returns
+        -------
+        Lease
+            確保した区間。ない場合はNone
+        """
+        for shard in range(self.num_shards):
+            if self.memcache_api.get_value(self.__key(sweep, shard, 'complete')) is not None:
+                continue
+            lease = self.__acquire(sweep, shard)
+            if lease is not None:
+                return lease
+        return None
+
+    def __acquire(self, sweep: int, shard: int):
+        """
+        区間のリースを取得する
+
+        Parameters
+        ----------
+        sweep : int
+            一巡の番号
+        shard : int
+            区間の番号
+
+        Returns
+        -------
+        Lease
+            確保した区間。他のワーカーがリースを持っている場合はNone
+        """
+        if not self.memcache_api.add_value(self.__key(sweep, shard), self.worker_id, self.lease_time):
+            return None
+
+        progress = self.memcache_api.get_value(
+            self.__key(sweep, shard, 'progress'))
+        start = shard * self.shard_size
+        stop = min(start + self.shard_size, self.stock_list_api.get_size())
+        return Lease(sweep, shard, start, stop, int(progress or 0))
+
+    def __renew(self, lease: Lease):
+        """
+        リースを保持していれば期限を延長する
+
+        Parameters
+        ----------
+        lease : Lease
+            確保した区間
+
+        Returns
+        -------
+        bool
+            延長できた場合True
+        """
+        key = self.__key(lease.sweep, lease.shard)
+        holder, cas = self.memcache_api.gets_value(key)
+        if holder != self.worker_id:
+            return False
+        return self.memcache_api.cas_value(key, self.worker_id, cas, self.lease_time)
+
+    def __get_sweep(self):
+        """
+        現在の一巡の番号の取得
+
+        Returns
+        -------
+        int
+            一巡の番号
+        """
+        key = f'{self.KEY_PREFIX}sweep'
+        self.memcache_api.add_value(key, 1, self.SWEEP_EXPIRE_TIME)
+        sweep = self.memcache_api.get_value(key)
+        return int(sweep) if sweep is not None else 1
+
+    def __advance_sweep(self, sweep: int):
+        """
+        全区間が完了していれば次の一巡に進める
+
+        Parameters
+        ----------
+        sweep : int
+            現在の一巡の番号
+
+        Returns
+        -------
+        bool
+            次の一巡に進んでいる場合True
+        """
+        done = self.memcache_api.get_value(self.__key(sweep, 'done'))
+        if done is None or int(done) < self.num_shards:
+            return False
+
+        key = f'{self.KEY_PREFIX}sweep'
+        current, cas = self.memcache_api.gets_value(key)
+        if current is None or int(current) != sweep:
+            # 他のワーカーが既に進めている
+            return True
+        return self.memcache_api.cas_value(key, sweep + 1, cas, self.SWEEP_EXPIRE_TIME) or \
+            int(self.memcache_api.get_value(key) or 0) != sweep
+
+    def __key(self, sweep: int, *names):
+        """
+        一巡ごとのキャッシュのキーの取得
+
+        Parameters
+        ----------
+        sweep : int
+            一巡の番号
+        names : tuple
+            キーの要素
+
+        Returns
+        -------
+        str
+            キャッシュのキー
+        """
+        return ':'.join([f'{self.KEY_PREFIX}{sweep}'] + [str(name) for name in names])
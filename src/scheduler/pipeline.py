@@ -0,0 +1,183 @@
+from queue import Queue, Empty, Full
+from threading import Thread, Event, Lock
+import time
+
+
+class Pipeline:
+    """
+    処理を段階に分け、段階ごとのスレッドで並行に実行するパイプライン
+
+    段階の間は上限付きのキューでつなぎ、後ろの段階が詰まっている場合は前の段階を待たせる。
+    各段階は1スレッドで順番に処理するため、段階内の処理順は投入順と同じになる。
+    いずれかの段階で例外が起きた場合は全段階を止め、runで例外を送出する。
+
+    Attributes
+    -------
+    QUEUE_SIZE : int
+        段階の間のキューの上限
+    POLL_INTERVAL : float
+        停止を確認する間隔(秒)
+    stages : list
+        (段階の名前, 処理する関数)のリスト。関数の戻り値が次の段階の入力になり、Noneの場合は次に渡さない
+    timings : dict
+        段階の名前をキー、busy(処理時間の合計), wait(入力・出力の待ち時間の合計), items(処理数)を値とした辞書
+    """
+    QUEUE_SIZE = 4
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, stages: list, queue_size=QUEUE_SIZE):
+        """
+        コンストラクタ
+
+        Parameters
+        ----------
+        stages : list
+            (段階の名前, 処理する関数)のリスト
+        queue_size : int, optional
+            段階の間のキューの上限, by default QUEUE_SIZE
+        """
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.timings = {name: {'busy': 0.0, 'wait': 0.0, 'items': 0}
+                        for name, _ in self.stages}
+        self.__stop = Event()
+        self.__lock = Lock()
+        self.__error = None
+
+    def run(self, items):
+        """
+        全ての入力をパイプラインで処理し、全段階が終わるまで待つ
+
+        Parameters
+        ----------
+        items : iterable
+            最初の段階への入力。最初の段階のスレッドで順に取り出す
+
+        Raises
+        ------
+        Exception
+            いずれかの段階で起きた例外
+        """
+        queues = [Queue(maxsize=self.queue_size)
+                  for _ in range(len(self.stages) - 1)]
+        threads = []
+        for i, (name, func) in enumerate(self.stages):
+            source = iter(items) if i == 0 else queues[i - 1]
+            target = queues[i] if i < len(queues) else None
+            threads.append(Thread(target=self.__work, name=f'pipeline-{name}',
+                                  args=(name, func, source, target), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.__error is not None:
+            raise self.__error
+
+    def stop(self):
+        """
+        新しい入力の取り出しを止め、処理中のものを終えたら終了させる
+        """
+        self.__stop.set()
+
+    def __work(self, name: str, func, source, target: Queue):
+        """
+        1つの段階の処理を行うスレッドの本体
+
+        Parameters
+        ----------
+        name : str
+            段階の名前
+        func : callable
+            処理する関数
+        source : iterator or Queue
+            入力。最初の段階はイテレータ、以降は前の段階のキュー
+        target : Queue
+            出力先のキュー。最後の段階はNone
+        """
+        timing = self.timings[name]
+        try:
+            while True:
+                started = time.perf_counter()
+                item = self.__take(source)
+                timing['wait'] += time.perf_counter() - started
+                if item is _END:
+                    break
+                if self.__error is not None:
+                    # 他の段階が失敗した場合は、残りの入力を処理せずに読み捨てる
+                    continue
+
+                started = time.perf_counter()
+                result = func(item)
+                timing['busy'] += time.perf_counter() - started
+                timing['items'] += 1
+
+                if target is not None and result is not None:
+                    started = time.perf_counter()
+                    self.__put(target, result)
+                    timing['wait'] += time.perf_counter() - started
+        except Exception as e:
+            with self.__lock:
+                if self.__error is None:
+                    self.__error = e
+            self.__stop.set()
+        finally:
+            if target is not None:
+                self.__put(target, _END, force=True)
+
+    def __take(self, source):
+        """
+        入力を1つ取り出す。停止された場合や入力が尽きた場合は_ENDを返す
+
+        Parameters
+        ----------
+        source : iterator or Queue
+            入力
+
+        Returns
+        -------
+        object
+            入力
+        """
+        if not isinstance(source, Queue):
+            if self.__stop.is_set():
+                return _END
+            return next(source, _END)
+
+        while True:
+            try:
+                return source.get(timeout=self.POLL_INTERVAL)
+            except Empty:
+                continue
+
+    def __put(self, target: Queue, item, force=False):
+        """
+        出力をキューに入れる。キューが一杯の場合は空くまで待つ
+
+        Parameters
+        ----------
+        target : Queue
+            出力先のキュー
+        item : object
+            出力
+        force : bool, optional
+            停止後も入れるかどうか(終了の通知用), by default False
+        """
+        while True:
+            if self.__error is not None and not force:
+                return
+            try:
+                target.put(item, timeout=self.POLL_INTERVAL)
+                return
+            except Full:
+                if force and self.__error is not None:
+                    # 後ろの段階が例外で止まっている場合は、空きを作ってから通知する
+                    try:
+                        target.get_nowait()
+                    except Empty:
+                        pass
+                continue
+
+
+# 入力の終わりを表す値
+_END = object()
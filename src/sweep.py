@@ -0,0 +1,94 @@
+import argparse
+import time
+from repository.store import PriceStoreAPI
+from analysis import Backtester, ParameterSweep
+
+from logging import getLogger, StreamHandler, DEBUG
+logger = getLogger(__name__)
+handler = StreamHandler()
+handler.setLevel(DEBUG)
+logger.setLevel(DEBUG)
+logger.addHandler(handler)
+logger.propagate = False
+
+"""
+移動平均の期間と買いシグナルのステージ遷移の組み合わせをバックテストで比較するコマンド
+
+$ python sweep.py --store ../data/store/prices --short 3,5,10 --middle 20,25 --long 60,75,100 \
+    --transitions 4-4-5,4-5-5 --output ../data/sweep.csv
+"""
+
+
+def parse_ints(text: str):
+    """
+    カンマ区切りの整数を読み込む
+
+    Parameters
+    ----------
+    text : str
+        カンマ区切りの整数
+
+    Returns
+    -------
+    list
+        整数のリスト
+    """
+    return [int(value) for value in text.split(',') if value]
+
+
+def parse_transitions(text: str):
+    """
+    カンマ区切りのステージ遷移(ハイフン区切り)を読み込む
+
+    Parameters
+    ----------
+    text : str
+        4-4-5,4-5-5のような文字列
+
+    Returns
+    -------
+    list
+        ステージ遷移のタプルのリスト
+    """
+    return [tuple(int(stage) for stage in transition.split('-'))
+            for transition in text.split(',') if transition]
+
+
+def main():
+    """
+    コマンドライン引数を読み込んでパラメータの比較を実行する
+    """
+    parser = argparse.ArgumentParser(
+        description='Sweep signal windows and stage transitions over the price store.')
+    parser.add_argument('--store', required=True)
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--short', type=parse_ints, default=[5])
+    parser.add_argument('--middle', type=parse_ints, default=[25])
+    parser.add_argument('--long', type=parse_ints, default=[75])
+    parser.add_argument('--transitions', type=parse_transitions,
+                        default=[(4, 4, 5)])
+    parser.add_argument('--sort', default=ParameterSweep.SORT_KEY)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--no-songiri', action='store_true',
+                        help='sell only when the price is at or below the average cost')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    codes, close = Backtester.load_panel(
+        PriceStoreAPI(args.store), start=args.start, end=args.end)
+    sweep = ParameterSweep(args.short, args.middle, args.long,
+                           args.transitions, songiri=not args.no_songiri)
+    df = sweep.run(close, processes=args.processes, sort_key=args.sort)
+    logger.info(
+        f'Evaluated {len(df)} combinations over {len(codes)} codes in {time.perf_counter() - started:.1f}s.')
+    logger.info(df.head(args.top).to_string(index=False))
+
+    if args.output is not None:
+        df.to_csv(args.output, index=None)
+
+
+if __name__ == '__main__':
+    main()
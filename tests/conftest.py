@@ -0,0 +1,6 @@
+import os
+import sys
+
+# スクリプトはsrcから実行する前提のため、src直下のパッケージとベンチマークの代替をimportできるようにする
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'src'), os.path.join(ROOT, 'benchmark')]
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+import fakes
+
+fakes.install_memcache()
+
+from repository.drive.index import DriveFileIndex  # noqa: E402
+from repository.memcache import MemcachedAPI  # noqa: E402
+
+
+@pytest.fixture
+def memcache_api():
+    fakes.FakeMemcacheClient.clear()
+    yield MemcachedAPI('localhost', 'user', 'password')
+    fakes.FakeMemcacheClient.clear()
+
+
+def load(memcache_api):
+    return DriveFileIndex.from_json(memcache_api.get_drive_index())
+
+
+def save(memcache_api, index):
+    memcache_api.update_drive_index(index.merge)
+    index.commit()
+
+
+def test_workers_keep_each_others_changes(memcache_api):
+    save(memcache_api, DriveFileIndex.from_items(
+        [{'name': '1301.csv', 'id': 'a'}, {'name': '1332.csv', 'id': 'b'}]))
+    first = load(memcache_api)
+    second = load(memcache_api)
+
+    first.put('1301.csv', 'a2')
+    first.remove('a')
+    second.put('1332.csv', 'b2')
+    second.put('1333.csv', 'c')
+    save(memcache_api, first)
+    save(memcache_api, second)
+
+    assert json.loads(memcache_api.get_drive_index()) == {
+        '1301.csv': 'a2', '1332.csv': 'b2', '1333.csv': 'c'}
+    assert not second.dirty and second.get('1301.csv') == 'a2'
+
+
+def test_remove_keeps_file_replaced_by_other_worker(memcache_api):
+    save(memcache_api, DriveFileIndex({'1301.csv': 'a'}))
+    first = load(memcache_api)
+    second = load(memcache_api)
+
+    first.put('1301.csv', 'a2')
+    second.remove('a')
+    save(memcache_api, first)
+    save(memcache_api, second)
+
+    assert json.loads(memcache_api.get_drive_index()) == {'1301.csv': 'a2'}
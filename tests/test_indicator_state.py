@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from analysis import IndicatorState, SignalEngine
+
+
+def assert_same_latest(actual, expected):
+    actual, expected = actual.latest(), expected.latest()
+    assert actual.keys() == expected.keys()
+    for name in expected:
+        np.testing.assert_array_equal(actual[name], expected[name], err_msg=name)
+
+
+@pytest.fixture
+def closes():
+    # 小数第1位までの株価。リングバッファ(75日)を何周もする日数にする
+    rng = np.random.default_rng(1)
+    return np.round(1000 + np.cumsum(rng.normal(0, 8, size=400)), 1)
+
+
+def test_round_trip_keeps_layout_and_state(closes):
+    state = IndicatorState.from_closes(np.arange(100), closes[:100])
+    data = state.to_bytes()
+    assert len(data) == IndicatorState.HEADER.size + 3 + 1 + 3 + 3 + 75 * 8
+
+    restored = IndicatorState.from_bytes(data)
+    assert restored.to_bytes() == data
+    assert (restored.count, restored.last_date) == (100, 99)
+    assert restored.is_compatible(5, 25, 75, (4, 4, 5))
+    assert_same_latest(restored, state)
+
+
+def test_round_trip_rejects_other_version(closes):
+    data = bytearray(IndicatorState.from_closes(np.arange(10), closes[:10]).to_bytes())
+    data[0] = IndicatorState.VERSION + 1
+    with pytest.raises(Exception):
+        IndicatorState.from_bytes(bytes(data))
+
+
+@pytest.mark.parametrize('start', [0, 3, 74, 80])
+def test_incremental_update_matches_full_recompute(closes, start):
+    state = IndicatorState.from_closes(np.arange(start), closes[:start])
+    for day in range(start, len(closes)):
+        # Runnerと同じく1日ごとにキャッシュへの保存と復元を挟む
+        state = IndicatorState.from_bytes(state.to_bytes())
+        state.update(day, float(closes[day]))
+        full = IndicatorState.from_closes(np.arange(day + 1), closes[:day + 1])
+        assert state.count == full.count == day + 1
+        assert_same_latest(state, full)
+        # 逐次更新を使わない累積和による計算とも一致する
+        engine = SignalEngine().latest(closes[:day + 1])
+        latest = state.latest()
+        for name in ['short', 'middle', 'long', 'stage', 'valid', 'purchase_sign', 'dod', 'diff']:
+            np.testing.assert_array_equal(latest[name], engine[name][0], err_msg=name)
+
+
+def test_incremental_update_without_round_trip(closes):
+    state = IndicatorState()
+    for day, close in enumerate(closes):
+        state.update(day, float(close))
+    assert_same_latest(state, IndicatorState.from_closes(np.arange(len(closes)), closes))
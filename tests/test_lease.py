@@ -0,0 +1,118 @@
+import pytest
+import fakes
+
+fakes.install_memcache()
+
+from repository.memcache import MemcachedAPI  # noqa: E402
+from scheduler import LeaseScheduler  # noqa: E402
+
+
+class StockList:
+    """
+    LeaseSchedulerが使う銘柄リストのAPIの代わり
+    """
+
+    def __init__(self, size):
+        self.codes = [str(1000 + i) for i in range(size)]
+
+    def get_size(self):
+        return len(self.codes)
+
+    def get_codes(self, start, stop):
+        return self.codes[start:stop]
+
+
+@pytest.fixture
+def clock():
+    now = [0.0]
+    fakes.FakeMemcacheClient.clear()
+    fakes.FakeMemcacheClient.clock = lambda: now[0]
+    yield now
+    fakes.FakeMemcacheClient.clock = staticmethod(fakes.time.monotonic)
+    fakes.FakeMemcacheClient.clear()
+
+
+def get_scheduler(worker_id):
+    return LeaseScheduler(MemcachedAPI('localhost', 'user', 'password'), StockList(40),
+                          worker_id=worker_id, shard_size=20, lease_time=60)
+
+
+def test_expired_lease_is_taken_over_from_progress(clock):
+    first = get_scheduler('first')
+    second = get_scheduler('second')
+
+    lease = first.claim()
+    assert lease.shard == 0
+    assert first.checkpoint(lease, 5)
+    assert second.claim().shard == 1
+    assert second.claim() is None
+
+    clock[0] += 61
+    taken = second.claim()
+    assert (taken.shard, taken.progress) == (0, 5)
+    assert second.get_codes(taken)[0] == '1005'
+    # 期限切れのリースは元のワーカーでは延長できない
+    assert not first.checkpoint(lease)
+
+
+def test_released_lease_is_taken_over_before_expiry(clock):
+    first = get_scheduler('first')
+    second = get_scheduler('second')
+
+    lease = first.claim()
+    assert first.checkpoint(lease, 3)
+    second.claim()
+    assert second.claim() is None
+
+    first.release(lease)
+    taken = second.claim()
+    assert (taken.shard, taken.progress) == (0, 3)
+
+
+def test_release_keeps_lease_taken_by_other_worker(clock):
+    first = get_scheduler('first')
+    second = get_scheduler('second')
+
+    lease = first.claim()
+    second.claim()
+    clock[0] += 61
+    taken = second.claim()
+    assert taken.shard == 0
+
+    first.release(lease)
+    assert second.checkpoint(taken)
+
+
+def test_release_keeps_lease_taken_over_after_reading_holder(clock):
+    first = get_scheduler('first')
+    second = get_scheduler('second')
+
+    lease = first.claim()
+    second.claim()
+    gets_value = first.memcache_api.gets_value
+    taken = []
+
+    def gets_then_expire(key):
+        # 保持者を読んだ直後にリースが切れ、他のワーカーに移る
+        result = gets_value(key)
+        clock[0] += 61
+        taken.append(second.claim())
+        return result
+
+    first.memcache_api.gets_value = gets_then_expire
+    first.release(lease)
+    assert taken[0].shard == 0
+    assert second.checkpoint(taken[0])
+
+
+def test_complete_keeps_lease_taken_by_other_worker(clock):
+    first = get_scheduler('first')
+    second = get_scheduler('second')
+
+    lease = first.claim()
+    second.claim()
+    clock[0] += 61
+    taken = second.claim()
+
+    first.complete(lease)
+    assert second.checkpoint(taken)
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from repository.outbound import OutboundClient, RetryPolicy
+
+
+class Response:
+    """
+    requests.HTTPErrorのresponseの代わり
+    """
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.response = Response(status_code)
+
+
+def failing(statuses):
+    """
+    statusesの順にHTTPErrorを投げ、その後は呼び出し回数を返す関数を作る
+    """
+    calls = []
+
+    def func():
+        calls.append(None)
+        if len(calls) <= len(statuses):
+            raise HTTPError(statuses[len(calls) - 1])
+        return len(calls)
+    return func, calls
+
+
+@pytest.fixture
+def client():
+    return OutboundClient('test', retry=RetryPolicy(base_delay=0, max_delay=0))
+
+
+def test_idempotent_call_retries_server_errors(client):
+    func, calls = failing([503, 500])
+    assert client.call(func) == 3
+
+
+def test_non_idempotent_call_does_not_retry_server_errors(client):
+    func, calls = failing([503])
+    with pytest.raises(HTTPError):
+        client.call(func, idempotent=False)
+    assert len(calls) == 1
+
+
+def test_non_idempotent_call_retries_throttling(client):
+    func, calls = failing([429])
+    assert client.call(func, idempotent=False) == 2
+
+
+def http_error(status, reason):
+    """
+    googleapiclientのHttpErrorを作る
+    """
+    from googleapiclient.errors import HttpError
+    from httplib2 import Response as HttpResponse
+
+    content = json.dumps({'error': {'code': status, 'message': reason,
+                                    'errors': [{'domain': 'usageLimits', 'reason': reason}]}})
+    return HttpError(HttpResponse({'status': status}), content.encode('utf8'))
+
+
+@pytest.mark.parametrize('reason', ['userRateLimitExceeded', 'rateLimitExceeded'])
+def test_rate_limit_403_is_throttling(reason):
+    assert RetryPolicy().classify(http_error(403, reason)) == (True, True, None)
+
+
+def test_other_403_is_not_retried():
+    assert RetryPolicy().classify(http_error(403, 'insufficientFilePermissions'))[0] is False
+
+
+def test_rate_limit_403_lowers_rate(client):
+    errors = [http_error(403, 'userRateLimitExceeded')]
+
+    def func():
+        if errors:
+            raise errors.pop()
+        return 'ok'
+
+    rate = client.bucket.rate
+    assert client.call(func, idempotent=False) == 'ok'
+    assert client.bucket.rate < rate
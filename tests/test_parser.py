@@ -0,0 +1,54 @@
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+import fakes
+
+from repository.stock.parser import COLUMNS, DTYPES, concat_columns, parse_stock_csv
+
+CSV_HEADER = 'code,date,open,high,low,closing,volume,closed_adj'
+
+
+def pandas_frame(code, bodies):
+    """
+    パーサーに置き換える前のRunnerと同じく、銘柄コードを付けたcsvをpandasで読む
+    """
+    csv = CSV_HEADER
+    for body in bodies:
+        csv += '\n' + '\n'.join(
+            f'{code},{line}' for line in body.decode(fakes.ENCODING).split('\n')[2:])
+    return pd.read_csv(StringIO(csv), index_col='date', parse_dates=True).sort_index()
+
+
+def assert_same_frame(columns, expected):
+    dates = columns['date'].astype('datetime64[D]').astype('datetime64[ns]')
+    np.testing.assert_array_equal(dates, expected.index.to_numpy())
+    for name in COLUMNS[1:]:
+        # 価格の列はパーサーの型(float32)に丸めたpandasの値と一致する
+        values = expected[name].to_numpy()
+        if name != 'volume':
+            values = values.astype(DTYPES[name])
+        np.testing.assert_array_equal(columns[name], values, err_msg=name)
+        assert columns[name].dtype == DTYPES[name]
+
+
+@pytest.mark.parametrize('code', ['1301', '7203'])
+def test_parser_matches_pandas(code):
+    server = fakes.StockServer()
+    bodies = [server.body(code, str(year)) for year in (2019, 2020, 2021)]
+    columns = concat_columns([parse_stock_csv(body) for body in reversed(bodies)])
+    assert_same_frame(columns, pandas_frame(code, bodies))
+
+
+def test_parser_reads_missing_values():
+    header = '1301 東証1部 テスト\n日付,始値,高値,安値,終値,出来高,終値調整\n'
+    body = (header + '2021-01-04,100,110,90,105,,105.5\n'
+            '2021-01-05,,112,95,,2000,106.25').encode(fakes.ENCODING)
+    columns = parse_stock_csv(body)
+    expected = pandas_frame('1301', [body])
+
+    assert np.isnan(expected['volume'].iloc[0])
+    np.testing.assert_array_equal(columns['volume'], [0, 2000])
+    assert np.isnan(columns['open'][1]) and np.isnan(columns['closing'][1])
+    np.testing.assert_array_equal(columns['closed_adj'], expected['closed_adj'].to_numpy())
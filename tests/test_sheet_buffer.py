@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+import fakes
+
+fakes.install_memcache()
+
+from repository.memcache import MemcachedAPI  # noqa: E402
+from repository.sheet.buffer import BufferedSheetAPI  # noqa: E402
+
+
+class Sheet:
+    """
+    書き込んだ行を記録するSheetAPIの代わり
+    """
+
+    def __init__(self, before_append=None):
+        self.rows = []
+        self.before_append = before_append
+
+    def append(self, cells):
+        if self.before_append is not None:
+            before_append, self.before_append = self.before_append, None
+            before_append()
+        self.rows.extend(cells)
+
+
+@pytest.fixture
+def memcache_api():
+    fakes.FakeMemcacheClient.clear()
+    yield MemcachedAPI('localhost', 'user', 'password')
+    fakes.FakeMemcacheClient.clear()
+
+
+def row(date, code):
+    return [date, code, '銘柄', '業種', np.float64(1000.5), np.bool_(True), np.int64(4)]
+
+
+def test_pending_rows_are_appended_once_after_restart(memcache_api):
+    sheet = Sheet()
+    # 書き込む前に終了した実行
+    BufferedSheetAPI(sheet, memcache_api).append([row('2021-01-04', '1301')])
+    assert sheet.rows == []
+
+    restarted = BufferedSheetAPI(sheet, memcache_api)
+    restarted.flush()
+    assert sheet.rows == [['2021-01-04', '1301', '銘柄', '業種', 1000.5, True, 4]]
+    assert [type(value) for value in sheet.rows[0][4:]] == [float, bool, int]
+
+    # 同じ(日付, 銘柄コード)の行は別の実行からも書き込まない
+    again = BufferedSheetAPI(sheet, memcache_api)
+    again.append([row('2021-01-04', '1301'), row('2021-01-05', '1301')])
+    again.flush()
+    assert [cells[:2] for cells in sheet.rows] == [
+        ['2021-01-04', '1301'], ['2021-01-05', '1301']]
+    assert memcache_api.get_value(BufferedSheetAPI.PENDING_KEY) == '[]'
+
+
+def test_concurrent_flush_appends_pending_rows_once(memcache_api):
+    BufferedSheetAPI(Sheet(), memcache_api).append([row('2021-01-04', '1301')])
+    other = BufferedSheetAPI(Sheet(), memcache_api)
+    # 1つ目のインスタンスが書き込んでいる最中に、別のインスタンスも書き込む
+    sheet = Sheet(before_append=other.flush)
+    BufferedSheetAPI(sheet, memcache_api).flush()
+
+    assert len(sheet.rows) == 1 and other.sheet_api.rows == []
+    assert memcache_api.get_value(BufferedSheetAPI.PENDING_KEY) == '[]'
+
+
+def test_failed_append_releases_rows(memcache_api):
+    def fail():
+        raise Exception('sheet down')
+
+    buffer = BufferedSheetAPI(Sheet(before_append=fail), memcache_api)
+    buffer.append([row('2021-01-04', '1301')])
+    with pytest.raises(Exception):
+        buffer.flush()
+
+    sheet = Sheet()
+    BufferedSheetAPI(sheet, memcache_api).flush()
+    assert len(sheet.rows) == 1
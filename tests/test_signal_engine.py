@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import IndicatorState, SignalEngine
+
+SHORT_TERM = 5
+MIDDLE_TERM = 25
+LONG_TERM = 75
+STAGE_TRANSITION = [4, 4, 5]
+
+
+def pandas_signals(closes):
+    """
+    SignalEngineに置き換える前のRunner.__append_purchace_signと同じ計算
+    """
+    df = pd.DataFrame({'closed_adj': closes})
+    df['short'] = df.closed_adj.rolling(SHORT_TERM).mean().round(1)
+    df['middle'] = df.closed_adj.rolling(MIDDLE_TERM).mean().round(1)
+    df['long'] = df.closed_adj.rolling(LONG_TERM).mean().round(1)
+    df['four_stage'] = (df.short < df.long) & (
+        df.short < df.middle) & (df.middle < df.long)
+    df['five_stage'] = (df.short < df.long) & (
+        df.short >= df.middle) & (df.middle < df.long)
+    df['stage'] = df.four_stage * 4 + df.five_stage * 5
+    df = df.dropna()
+    df['purchase_sign'] = df.stage.rolling(3).apply(
+        lambda x: list(x) == STAGE_TRANSITION)
+    df['dod'] = df.closed_adj.pct_change().round(3)
+    df['diff'] = df.closed_adj.diff()
+    return df
+
+
+def random_closes(rng, days):
+    """
+    整数の株価のランダムウォーク。整数なら移動平均が小数第2位で5になる丸めの境界に乗らない
+    """
+    steps = rng.integers(-30, 31, size=days)
+    return (1000 + np.cumsum(steps)).clip(1).astype(np.float64)
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    return [random_closes(rng, int(days)) for days in rng.integers(80, 400, size=100)]
+
+
+def test_engine_matches_pandas(series):
+    engine = SignalEngine(SHORT_TERM, MIDDLE_TERM, LONG_TERM, STAGE_TRANSITION)
+    signals = 0
+    for closes in series:
+        expected = pandas_signals(closes)
+        result = engine.compute(closes)
+        valid = result['valid'][:, 0]
+        assert np.array_equal(np.flatnonzero(valid), expected.index.to_numpy())
+
+        for name in ['short', 'middle', 'long', 'dod', 'diff']:
+            np.testing.assert_array_equal(result[name][valid, 0], expected[name].to_numpy())
+        np.testing.assert_array_equal(result['stage'][valid, 0], expected['stage'].to_numpy())
+        # 3日分のステージがそろう前は、pandasではNaN、SignalEngineではシグナルなし
+        sign = expected['purchase_sign'].to_numpy()
+        np.testing.assert_array_equal(result['purchase_sign'][valid, 0][2:], sign[2:] == 1)
+        signals += int(np.nansum(sign))
+    assert signals > 0
+
+
+def test_engine_matches_pandas_across_codes(series):
+    engine = SignalEngine(SHORT_TERM, MIDDLE_TERM, LONG_TERM, STAGE_TRANSITION)
+    latest = engine.latest(SignalEngine.make_panel(series))
+    for i, closes in enumerate(series):
+        expected = pandas_signals(closes).iloc[-1]
+        for name in ['short', 'middle', 'long', 'stage']:
+            assert latest[name][i] == expected[name]
+        assert bool(latest['purchase_sign'][i]) == (expected['purchase_sign'] == 1)
+
+
+def test_indicator_state_matches_pandas(series):
+    for closes in series:
+        expected = pandas_signals(closes).iloc[-1]
+        latest = IndicatorState.from_closes(np.arange(len(closes)), closes).latest()
+        for name in ['short', 'middle', 'long', 'stage', 'closed_adj']:
+            assert latest[name] == expected[name]
+        assert latest['purchase_sign'] == (expected['purchase_sign'] == 1)
+        np.testing.assert_array_equal([latest['dod'], latest['diff']],
+                                      [expected['dod'], expected['diff']])
+
+
+@pytest.mark.parametrize('days', [LONG_TERM, LONG_TERM + 1])
+def test_fewer_than_three_stages_is_no_signal(days):
+    closes = random_closes(np.random.default_rng(days), days)
+    # pandasではNaNになり、Runnerのif文では真として扱われていた
+    assert np.isnan(pandas_signals(closes)['purchase_sign'].iloc[-1])
+
+    engine = SignalEngine(SHORT_TERM, MIDDLE_TERM, LONG_TERM, STAGE_TRANSITION)
+    assert not engine.latest(closes)['purchase_sign'][0]
+    assert not IndicatorState.from_closes(np.arange(days), closes).latest()['purchase_sign']
@@ -0,0 +1,38 @@
+import pytest
+
+from repository.stock_list import StockListAPI
+
+CSV = '''銘柄コード,銘柄名,業種分類
+7203,トヨタ,情報・通信
+1301,極洋,建設業
+9999,除外,食料品
+4000,医薬,医薬品
+'''
+
+
+@pytest.fixture
+def stocklist(tmp_path):
+    path = tmp_path / 'stocklist.csv'
+    path.write_text(CSV, encoding='utf8')
+    return str(path)
+
+
+def test_codes_keep_csv_order(stocklist, tmp_path):
+    api = StockListAPI(stocklist, filter_mode=True)
+    assert api.get_codes() == [7203, 1301, 4000]
+    assert api.get_first_code() == 7203
+    assert [api.get_next_code(code) for code in ('7203', 1301, 4000)] == [1301, 4000, 7203]
+    assert api.get_prev_code(7203) == 4000
+    assert api.get_position('9999') is None and api.get_next_code('9999') is None
+    assert api.get_stock_info_by_code('1301') == {'銘柄名': '極洋', '業種分類': '建設業'}
+
+    snapshot = str(tmp_path / 'stocklist.npz')
+    api.save_snapshot(snapshot)
+    assert StockListAPI(snapshot).get_codes() == [7203, 1301, 4000]
+
+
+def test_non_numeric_code_is_rejected(tmp_path):
+    path = tmp_path / 'stocklist.csv'
+    path.write_text(CSV + '130A,英字,建設業\n', encoding='utf8')
+    with pytest.raises(Exception, match='130A'):
+        StockListAPI(str(path))